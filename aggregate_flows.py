@@ -2,10 +2,10 @@ import common, objects, loaders, regionalization, collections, operator
 
 INTRAFLOW_MODES = {'NONE' : [], 'ALL' : [(True, True, True, True)], 'CORE-HINTERLAND' : [(True, False, False, True), (False, True, True, False)], 'CORE-CORE' : [(True, False, True, False)], 'CORE-(CORE+HINTERLAND)' : [(True, False, True, True), (False, True, True, False)]}
 
-with common.runtool(11) as parameters:
+with common.runtool(12) as parameters:
   common.progress('loading settings')
   zoneLayer, zoneIDFld, zoneRegFld, zoneCoreFld, aggregMode, intraflowMode, \
-    interLayer, interFromIDFld, interToIDFld, aggregFldsStr, outPath = parameters
+    interLayer, interFromIDFld, interToIDFld, aggregFldsStr, outPath, interStore = parameters
   # set up data loading
   regload = loaders.RegionalLoader(regionalization.Regionalizer(objects.FunctionalRegion))
   regload.sourceOfZones(zoneLayer, {'id' : zoneIDFld}, targetClass=objects.MonoZone)
@@ -13,7 +13,7 @@ with common.runtool(11) as parameters:
   interDict = {'from' : interFromIDFld, 'to' : interToIDFld}
   aggregFlds = common.parseFields(aggregFldsStr)
   interDict.update({fld : fld for fld in aggregFlds})
-  regload.sourceOfMultiInteractions(interLayer, interDict, ordering=aggregFlds)
+  regload.sourceOfMultiInteractions(interLayer, interDict, ordering=aggregFlds, store=(interStore or None)) # a store directory memory-maps the interactions
   # flow aggregation mode
   regSrc, regTgt = aggregMode.split('-')
   hinterSrc = bool(regSrc != 'CORE')
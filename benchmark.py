@@ -0,0 +1,236 @@
+'''Benchmarks the regionalization engine on synthetic inputs and compares the results of two commits.
+
+Generates square grids of zones with rook neighbourhood tables, lognormal masses and gravity-style flows (each zone sends its mass to the zones at most FLOW_RADIUS grid steps away, itself included, in proportion to their mass over their squared distance), writes them as CSV files and runs the bundled algorithms on them through the headless loader and Regionalizer. Every case runs in a separate process; its load and run times, peak memory and a hash of the resulting zone assignment are reported.
+
+Usage:
+  python benchmark.py run [report file] [zone counts (default 1000,10000)] [algorithms (default all)] [random seed] [package directory]
+  python benchmark.py compare <old commit> <new commit> [zone counts] [algorithms] [random seed]
+  python benchmark.py report <old report file> <new report file>
+Commits are checked out to temporary git worktrees (. stands for the current tree) and run by this script on the same data, so both must contain the headless loader. The generated data are kept in DATA_DIR for reuse. There are about 20 flows per zone; a grid of 50000 zones takes about a minute to load and run and over 1 GB of memory per algorithm, so the largest grids (200000 zones) take several.'''
+
+import sys, os, json, time, hashlib, subprocess, tempfile, shutil
+from xml.etree import cElementTree as eltree
+import numpy
+try:
+  import resource
+except ImportError: # not available on Windows, peak memory not reported
+  resource = None
+
+FLOW_RADIUS = 2
+SELF_WEIGHT = 9.0 # weight of the intrazonal flow relative to zone mass, roughly equal to the weight of all other targets
+MASS_LOG_MEAN = 5.0
+MASS_LOG_SIGMA = 1.2
+DEFAULT_COUNTS = [1000, 10000]
+DEFAULT_SEED = 0
+# values of algorithm parameters with no default in the algorithm file
+FALLBACK_PARAMETERS = {'main-mass' : '5000', 'hint-mass' : '1000'}
+INPUTS_FILE = 'inputs.xml'
+DATA_DIR = os.path.join(tempfile.gettempdir(), 'interactions-benchmark')
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+INPUTS_TEMPLATE = '''<?xml version="1.0" encoding="utf-8" ?>
+<delimiterdata version="1.1.0">
+  <metadata><name>Synthetic grid of {count} zones</name></metadata>
+  <root-path type="absolute" id="{directory}" />
+  <zones>
+    <path type="relative" id="zones.csv" />
+    <fields><field slot="id" name="ID" /><field slot="mass" name="MASS" /></fields>
+    <neighbourhood>
+      <path type="relative" id="neighbours.csv" />
+      <fields><field slot="from" name="ID_FROM" /><field slot="to" name="ID_TO" /></fields>
+    </neighbourhood>
+  </zones>
+  <interactions>
+    <path type="relative" id="flows.csv" />
+    <fields><field slot="from" name="ID_FROM" /><field slot="to" name="ID_TO" /><field slot="value" name="FLOW" /></fields>
+  </interactions>
+</delimiterdata>
+'''
+
+def writeTable(path, names, columns):
+  numpy.savetxt(path, numpy.column_stack(columns), fmt='%d', delimiter=',', header=','.join(names), comments='')
+
+def generate(count, seed, directory):
+  '''Writes the zones, neighbourhood and flows of a synthetic grid of count zones and a data setup file for them.'''
+  rnd = numpy.random.RandomState(seed)
+  side = int(numpy.ceil(numpy.sqrt(count)))
+  ids = numpy.arange(1, count + 1)
+  xs = (ids - 1) % side
+  ys = (ids - 1) // side
+  masses = numpy.maximum(1, rnd.lognormal(MASS_LOG_MEAN, MASS_LOG_SIGMA, count)).astype(int)
+  writeTable(os.path.join(directory, 'zones.csv'), ['ID', 'MASS'], [ids, masses])
+  right = (xs < side - 1) & (ids < count)
+  down = (ids + side <= count)
+  froms = numpy.concatenate((ids[right], ids[down]))
+  tos = numpy.concatenate((ids[right] + 1, ids[down] + side))
+  writeTable(os.path.join(directory, 'neighbours.csv'), ['ID_FROM', 'ID_TO'], [numpy.concatenate((froms, tos)), numpy.concatenate((tos, froms))])
+  sources, targets, weights = [], [], []
+  for dx in xrange(-FLOW_RADIUS, FLOW_RADIUS + 1):
+    for dy in xrange(-FLOW_RADIUS, FLOW_RADIUS + 1):
+      tx = xs + dx
+      ty = ys + dy
+      valid = (tx >= 0) & (tx < side) & (ty >= 0) & (ty * side + tx < count)
+      source = numpy.flatnonzero(valid)
+      target = ty[valid] * side + tx[valid]
+      sources.append(source)
+      targets.append(target)
+      weights.append(masses[target] * SELF_WEIGHT if dx == dy == 0 else masses[target] / float(dx * dx + dy * dy))
+  sources = numpy.concatenate(sources)
+  targets = numpy.concatenate(targets)
+  weights = numpy.concatenate(weights)
+  flows = numpy.rint(masses[sources] * weights / numpy.bincount(sources, weights, minlength=count)[sources]).astype(int)
+  kept = flows > 0
+  writeTable(os.path.join(directory, 'flows.csv'), ['ID_FROM', 'ID_TO', 'FLOW'], [ids[sources[kept]], ids[targets[kept]], flows[kept]])
+  with open(os.path.join(directory, INPUTS_FILE), 'w') as file:
+    file.write(INPUTS_TEMPLATE.format(count=count, directory=directory))
+  return int(kept.sum())
+
+def dataFor(count, seed):
+  directory = os.path.join(DATA_DIR, '{}-{}'.format(count, seed))
+  if not os.path.exists(os.path.join(directory, INPUTS_FILE)):
+    if not os.path.exists(directory):
+      os.makedirs(directory)
+    start = time.time()
+    flowCount = generate(count, seed, directory)
+    print 'generated %i zones and %i flows in %.2f s' % (count, flowCount, time.time() - start)
+  return directory
+
+def algorithmParameters(algorithmFile):
+  '''Returns the parameter values of the algorithm in the order of their declaration: their defaults, or FALLBACK_PARAMETERS.'''
+  paramEl = eltree.parse(algorithmFile).getroot().find('parameters')
+  values = []
+  if paramEl is not None:
+    for item in paramEl.findall('parameter'):
+      if item.get('id'):
+        values.append(item.get('default') or FALLBACK_PARAMETERS.get(item.get('id')))
+  return values
+
+def algorithmFiles(packageDir, names=None):
+  directory = os.path.join(packageDir, 'algorithms')
+  if not names:
+    names = sorted(name[:-4] for name in os.listdir(directory) if name.endswith('.xml'))
+  return [(name, os.path.join(directory, name + '.xml')) for name in names]
+
+def peakMemory():
+  '''Returns the peak resident memory of this process in MB (None where unknown).'''
+  if resource is None:
+    return None
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+def runCase(dataDir, algorithmFile, packageDir):
+  '''Loads the data and runs the algorithm with the engine from packageDir; to be called in a fresh process.'''
+  sys.path.insert(0, packageDir)
+  import regionalization
+  start = time.time()
+  reg = regionalization.DRSetupReader(parameters=algorithmParameters(algorithmFile)).create(algorithmFile)
+  loader = regionalization.RLSetupReader().create(os.path.join(dataDir, INPUTS_FILE), reg)
+  loader.load()
+  loaded = time.time()
+  reg.run(loader.getZoneList())
+  finished = time.time()
+  digest = hashlib.sha1()
+  regions = set()
+  for zone in sorted(reg.getZones(), key=lambda zone: zone.getID()):
+    digest.update('{} {} {}\n'.format(zone.getID(), zone.getRegionID(), zone.getCore() is not None))
+    regions.add(zone.getRegionID())
+  regions.discard(None)
+  return {'load' : loaded - start, 'run' : finished - loaded, 'memory' : peakMemory(), 'hash' : digest.hexdigest(), 'regions' : len(regions)}
+
+def spawnCase(dataDir, algorithmFile, packageDir):
+  process = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'case', dataDir, algorithmFile, packageDir], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  out, err = process.communicate()
+  if process.returncode:
+    lines = err.strip().splitlines()
+    return {'error' : lines[-1] if lines else 'exit code {}'.format(process.returncode)}
+  return json.loads(out.strip().splitlines()[-1])
+
+def currentCommit(packageDir):
+  try:
+    return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=packageDir).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def run(reportFile=None, counts=DEFAULT_COUNTS, algorithms=None, seed=DEFAULT_SEED, packageDir=PACKAGE_DIR):
+  results = []
+  for count in counts:
+    dataDir = dataFor(count, seed)
+    for name, algorithmFile in algorithmFiles(packageDir, algorithms):
+      result = spawnCase(dataDir, algorithmFile, packageDir)
+      result.update(zones=count, algorithm=name)
+      results.append(result)
+      if 'error' in result:
+        print '%-24s %7i zones: FAILED (%s)' % (name, count, result['error'])
+      else:
+        print '%-24s %7i zones: load %8.2f s, run %8.2f s, %8s MB, %6i regions, %s' % (name, count, result['load'], result['run'], formatMemory(result['memory']), result['regions'], result['hash'][:12])
+  report = {'package' : packageDir, 'commit' : currentCommit(packageDir), 'seed' : seed, 'results' : results}
+  if reportFile:
+    with open(reportFile, 'w') as file:
+      json.dump(report, file, indent=2, sort_keys=True)
+  return report
+
+def formatMemory(memory):
+  return '-' if memory is None else '%.1f' % memory
+
+def compare(oldCommit, newCommit, counts=DEFAULT_COUNTS, algorithms=None, seed=DEFAULT_SEED):
+  '''Runs the benchmark on both commits and prints the comparison.'''
+  reports = []
+  for commit in (oldCommit, newCommit):
+    print 'benchmarking %s' % commit
+    if commit == '.':
+      reports.append(run(None, counts, algorithms, seed))
+    else:
+      worktree = tempfile.mkdtemp(prefix='interactions-')
+      subprocess.check_call(['git', 'worktree', 'add', '--detach', worktree, commit], cwd=PACKAGE_DIR)
+      try:
+        reports.append(run(None, counts, algorithms, seed, packageDir=worktree))
+      finally:
+        subprocess.call(['git', 'worktree', 'remove', '--force', worktree], cwd=PACKAGE_DIR)
+        shutil.rmtree(worktree, ignore_errors=True)
+  return report(*reports)
+
+def report(old, new):
+  '''Prints the times, memory and assignment identity of cases in both reports. Returns whether all assignments are identical.'''
+  print '%-24s %7s %10s %10s %8s %9s %9s  %s' % ('algorithm', 'zones', 'old run s', 'new run s', 'speedup', 'old MB', 'new MB', 'assignment')
+  newResults = {(result['algorithm'], result['zones']) : result for result in new['results']}
+  identical = True
+  for oldResult in old['results']:
+    newResult = newResults.get((oldResult['algorithm'], oldResult['zones']))
+    if newResult is None:
+      continue
+    if 'error' in oldResult or 'error' in newResult:
+      print '%-24s %7i  %s' % (oldResult['algorithm'], oldResult['zones'], 'old failed: ' + oldResult['error'] if 'error' in oldResult else 'new failed: ' + newResult['error'])
+      identical = False
+      continue
+    same = oldResult['hash'] == newResult['hash']
+    identical = identical and same
+    print '%-24s %7i %10.2f %10.2f %7.2fx %9s %9s  %s' % (oldResult['algorithm'], oldResult['zones'], oldResult['run'], newResult['run'], oldResult['run'] / max(newResult['run'], 1e-6), formatMemory(oldResult['memory']), formatMemory(newResult['memory']), ('identical' if same else 'DIFFERENT'))
+  return identical
+
+def loadReport(path):
+  with open(path) as file:
+    return json.load(file)
+
+def parseCounts(text):
+  return [int(count) for count in text.split(',')] if text else DEFAULT_COUNTS
+
+def parseNames(text):
+  return text.split(',') if text else None
+
+
+if __name__ == '__main__':
+  args = sys.argv[1:] + [''] * 6
+  mode = args[0]
+  if mode == 'case':
+    print json.dumps(runCase(args[1], args[2], args[3]))
+  elif mode == 'run':
+    run(args[1] or None, parseCounts(args[2]), parseNames(args[3]), int(args[4] or DEFAULT_SEED), os.path.abspath(args[5] or PACKAGE_DIR))
+  elif mode == 'compare':
+    if not compare(args[1], args[2], parseCounts(args[3]), parseNames(args[4]), int(args[5] or DEFAULT_SEED)):
+      sys.exit(1)
+  elif mode == 'report':
+    if not report(loadReport(args[1]), loadReport(args[2])):
+      sys.exit(1)
+  else:
+    print __doc__
+    sys.exit(2)
@@ -0,0 +1,128 @@
+'''Checks that the heap-based aggregation candidate queue pops the candidates in the same order as the original sort-and-pop implementation.
+
+Runs both aggregator variants on identical synthetic regions (one per zone) where each candidate is merged to a random region (or fails to be merged), in both sort directions and for several random seeds, and compares the orders in which the candidates were popped. The original implementation is kept below as the reference; it re-sorts all remaining candidates before each pop, so it is quadratic and only small zone counts are practical (about a minute for 5000 zones).
+
+Usage:
+  python check_aggregation.py [zone count (default 1000)] [seed count (default 3)]
+Exits with status 1 if any order differs.'''
+
+import sys, time, random
+import regionalization
+
+DEFAULT_COUNT = 1000
+DEFAULT_SEEDS = 3
+FAIL_RATIO = 0.05
+class SyntheticRegion:
+  def __init__(self, id, mass):
+    self.id = id
+    self.mass = mass
+    self.version = 0
+
+  def getID(self):
+    return self.id
+
+  def getMass(self):
+    return self.mass
+
+  def getRawMass(self):
+    return self.mass
+
+  def getVersion(self):
+    return self.version
+
+  def addMass(self, mass):
+    self.mass += mass
+    self.version += 1
+
+  def __repr__(self):
+    return '<SyntheticRegion %s (%i)>' % (self.id, self.mass)
+
+
+class SyntheticAggregator(regionalization.Aggregator):
+  '''Merges each candidate to a random region; a given share of attempts fails.'''
+
+  def __init__(self, regions, seed, descending):
+    regionalization.Aggregator.__init__(self, target=True, descending=descending, warnFail=False)
+    self.sorter = regionalization.Sorter(regionalization.MASS_SORTER)
+    self.regions = regions
+    self.random = random.Random(seed)
+
+  def aggregateItem(self, item):
+    if self.random.random() < FAIL_RATIO:
+      yield None
+    else:
+      target = self.random.choice(self.regions)
+      yield (None if target is item else target)
+
+
+class LegacySyntheticAggregator(SyntheticAggregator):
+  '''The original implementation re-sorting all remaining candidates before each pop.'''
+
+  def feed(self, targets):
+    self.targets = targets
+    self.targets.sort(key=regionalization.operator.methodcaller('getRawMass'))
+    self.todo = []
+
+  def next(self):
+    if not self.targets:
+      if self.todo:
+        if self.failRow >= len(self.todo):
+          if self.finalRound:
+            return None
+          else:
+            self.finalRound = True
+        self.targets.extend(self.todo)
+        self.todo = []
+      else:
+        return None
+    self.sorter.sort(self.targets, reverse=(not self.descending))
+    return self.targets.pop()
+
+  def update(self, targets):
+    pass
+
+
+def generate(count, seed):
+  rnd = random.Random(seed)
+  return [SyntheticRegion(i, rnd.randint(1, 100)) for i in xrange(count)]
+
+def run(aggregatorClass, count, seed, descending):
+  regionalization.SORT_KEYS.clear()
+  regions = generate(count, seed)
+  aggregator = aggregatorClass(regions, seed, descending)
+  order = []
+  start = time.time()
+  aggregator.feed(list(regions))
+  candidate = aggregator.next()
+  while candidate:
+    order.append(candidate.getID())
+    for target in aggregator.aggregate(candidate):
+      if target is not None:
+        target.addMass(candidate.getMass())
+        aggregator.update([target])
+    candidate = aggregator.next()
+  return order, time.time() - start
+
+def divergence(order1, order2):
+  for i in xrange(min(len(order1), len(order2))):
+    if order1[i] != order2[i]:
+      return i
+  return None if len(order1) == len(order2) else min(len(order1), len(order2))
+
+def check(count, seeds):
+  '''Compares the candidate orders for the given number of seeds in both directions; returns True if all of them are identical.'''
+  same = True
+  for seed in xrange(seeds):
+    for descending in (False, True):
+      heapOrder, heapTime = run(SyntheticAggregator, count, seed, descending)
+      legacyOrder, legacyTime = run(LegacySyntheticAggregator, count, seed, descending)
+      diverge = divergence(heapOrder, legacyOrder)
+      print 'seed %i, %-10s: %i candidates, heap %.2f s, legacy %.2f s, %s' % (seed, ('descending' if descending else 'ascending'), len(heapOrder), heapTime, legacyTime, ('identical' if diverge is None else 'DIFFERENT from position %i' % diverge))
+      same = same and diverge is None
+  return same
+
+
+if __name__ == '__main__':
+  args = sys.argv[1:] + [''] * 2
+  if not check(int(args[0] or DEFAULT_COUNT), int(args[1] or DEFAULT_SEEDS)):
+    sys.exit(1)
@@ -0,0 +1,168 @@
+'''Checks the articulation answers of the region block-cut index against brute-force connectivity.
+
+Builds random regions on small grids of zones (rook neighbourhood with some random diagonals) with random core and exclave flags, grows them by hinterland pendants and removes some leaf pendants again so that the incremental index updates are exercised, and compares BlockCutIndex.disconnects(), reconnects(), separated(), joined(), Region.getArticulation() and Region.getArticulations() with answers found by searching the region's contiguity graph directly.
+
+Usage:
+  python check_articulations.py [region count (default 300)] [random seed]
+Exits with status 1 and prints the first mismatches if any answer differs.'''
+
+import sys, random
+import objects
+
+DEFAULT_COUNT = 300
+DEFAULT_SEED = 0
+MAX_REPORTED = 10
+DIAGONAL_RATIO = 0.15
+PENDANT_ROUNDS = 3
+
+
+def createGrid(rnd, side):
+  zones = [objects.RegionalZone(i, 1) for i in xrange(side * side)]
+  for i in xrange(side * side):
+    x, y = i % side, i // side
+    if x + 1 < side:
+      link(zones[i], zones[i + 1])
+    if y + 1 < side:
+      link(zones[i], zones[i + side])
+      if x + 1 < side and rnd.random() < DIAGONAL_RATIO:
+        link(zones[i], zones[i + side + 1])
+  return zones
+
+def link(zone1, zone2):
+  zone1.addNeighbour(zone2)
+  zone2.addNeighbour(zone1)
+
+def createRegion(rnd, zones):
+  '''Creates a region of a random subset of the zones with random core and exclave flags; the index is built before pendants are attached to it and detached from it.'''
+  density = rnd.uniform(0.3, 0.9)
+  members = [zone for zone in zones if rnd.random() < density] or [zones[0]]
+  rnd.shuffle(members)
+  region = objects.PlainRegion(members[0])
+  coreRatio = rnd.choice((0.0, 0.05, 0.2))
+  exclaveRatio = rnd.choice((0.0, 0.1))
+  for zone in members[1:]:
+    objects.Assignment(zone, region, core=(rnd.random() < coreRatio), exclave=(rnd.random() < exclaveRatio)).tangle()
+  region.getBlockCut()
+  for i in xrange(PENDANT_ROUNDS):
+    contiguous = contiguousOf(region)
+    for zone in zones:
+      if zone.getRegion() is None and sum(1 for neigh in zone.getNeighbours() if neigh in contiguous) == 1 and rnd.random() < 0.5:
+        objects.Assignment(zone, region).tangle()
+        contiguous.add(zone)
+  for zone in list(region.getBlockCut().pendants):
+    if not region.getBlockCut().pendantChildren.get(zone) and rnd.random() < 0.3:
+      zone.deassign()
+  return region
+
+def contiguousOf(region):
+  return set(ass.getZone() for ass in region.getAssignments() if not ass.isExclave())
+
+def reachable(start, allowed):
+  '''Returns the zones of allowed reachable from start (which must be in allowed).'''
+  found = set([start])
+  stack = [start]
+  while stack:
+    for neigh in stack.pop().getNeighbours():
+      if neigh in allowed and neigh not in found:
+        found.add(neigh)
+        stack.append(neigh)
+  return found
+
+def componentsOf(zones):
+  remaining = set(zones)
+  components = []
+  while remaining:
+    component = reachable(next(iter(remaining)), remaining)
+    remaining -= component
+    components.append(frozenset(component))
+  return components
+
+def disconnects(contiguous, cores, zone, removed):
+  if zone is removed or zone not in contiguous or removed not in contiguous:
+    return False
+  if not reachable(zone, contiguous) & cores:
+    return False # already without a core
+  return not reachable(zone, contiguous - set([removed])) & cores
+
+def separated(contiguous, zone):
+  '''Returns the parts of the zone's component that removing the zone would split it into, an empty list if it would not split it.'''
+  if zone not in contiguous:
+    return []
+  parts = componentsOf(reachable(zone, contiguous) - set([zone]))
+  return parts if len(parts) > 1 else []
+
+def joined(exclaves, added):
+  found = set()
+  for neigh in added.getNeighbours():
+    if neigh in exclaves and neigh not in found:
+      found.update(reachable(neigh, exclaves))
+  return found
+
+def checkSeparated(answer, expected):
+  '''The index reports the parts split off from the DFS root side, so it may omit one of the expected parts.'''
+  answer = [frozenset(part) for part in answer]
+  if not expected:
+    return not answer
+  return len(set(answer)) == len(answer) and set(answer) <= set(expected) and len(answer) >= len(expected) - 1
+
+def checkRegion(region, zones):
+  '''Yields descriptions of the answers of the region's block-cut index that differ from the brute-force ones.'''
+  blockCut = region.getBlockCut()
+  members = set(region.getZones())
+  contiguous = contiguousOf(region)
+  cores = set(ass.getZone() for ass in region.getAssignments() if ass.isCore() and not ass.isExclave())
+  exclaves = members - contiguous
+  expectedArticulations = {}
+  for zone in members:
+    expected = separated(contiguous, zone)
+    if expected:
+      expectedArticulations[zone] = expected
+    answer = blockCut.separated(zone)
+    if not checkSeparated(answer, expected):
+      yield 'separated({}): {} instead of {}'.format(zone, answer, expected)
+    articulation = region.getArticulation(zone)
+    if not checkSeparated(articulation or [], expected) or (articulation is not None and not articulation):
+      yield 'getArticulation({}): {} instead of {}'.format(zone, articulation, expected)
+    for other in members:
+      answer = blockCut.disconnects(other, zone)
+      if answer != disconnects(contiguous, cores, other, zone):
+        yield 'disconnects({}, {}): {}'.format(other, zone, answer)
+  articulations = region.getArticulations()
+  if set(articulations) != set(expectedArticulations):
+    yield 'getArticulations(): {} instead of {}'.format(sorted(articulations), sorted(expectedArticulations))
+  for zone in zones:
+    if zone not in members:
+      expected = joined(exclaves, zone)
+      answer = blockCut.joined(zone)
+      if answer != expected:
+        yield 'joined({}): {} instead of {}'.format(zone, answer, expected)
+      articulation = region.getArticulation(zone)
+      if articulation != ([expected] if expected else None):
+        yield 'getArticulation({}): {} instead of {}'.format(zone, articulation, expected)
+      for exclave in exclaves:
+        answer = blockCut.reconnects(exclave, zone)
+        if answer != (exclave in expected):
+          yield 'reconnects({}, {}): {}'.format(exclave, zone, answer)
+
+def check(count, seed):
+  '''Checks count random regions, returns a list of mismatch descriptions.'''
+  rnd = random.Random(seed)
+  failures = []
+  pendants = 0
+  for i in xrange(count):
+    zones = createGrid(rnd, rnd.randint(2, 8))
+    region = createRegion(rnd, zones)
+    pendants += len(region.getBlockCut().pendants)
+    for failure in checkRegion(region, zones):
+      failures.append('region {}: {}'.format(i, failure))
+  print 'checked %i regions (%i pendants attached), %i mismatches' % (count, pendants, len(failures))
+  return failures
+
+
+if __name__ == '__main__':
+  args = sys.argv[1:] + [''] * 2
+  failures = check(int(args[0] or DEFAULT_COUNT), int(args[1] or DEFAULT_SEED))
+  for failure in failures[:MAX_REPORTED]:
+    print failure
+  if failures:
+    sys.exit(1)
@@ -1,6 +1,7 @@
 MAX_VALUE = 254 # arcgis seems to have problems with 255 (makes holes where one of RGB parts is 255)
 BLACK_RGB = [0] * 3
 WHITE_RGB = [MAX_VALUE] * 3
+WHITE_PACKED = (MAX_VALUE << 16) | (MAX_VALUE << 8) | MAX_VALUE
 
 import operator
 
@@ -99,6 +100,13 @@ class ColorChooser:
           colorList.append(col)
     return colorList
 
+def packRGB(color):
+  '''Packs a RGB color to a single int (components truncated to 0-255 as when converted to hex).'''
+  return sum(min(max(int(num), 0), 255) << shift for num, shift in zip(color, (16, 8, 0)))
+
+def unpackRGB(value):
+  return [(value >> 16) & 255, (value >> 8) & 255, value & 255]
+
 def rgbToHex(color):
   return ''.join('{:02x}'.format(int(num) if num < MAX_VALUE else MAX_VALUE) for num in color)
 
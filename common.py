@@ -1,6 +1,11 @@
 # COMMON.PY
 # A common module for all scripts in the Interactions toolbox.
-import sys, os, arcpy, operator, traceback, numpy, random
+import sys, os, operator, traceback, numpy, random
+
+try:
+  import arcpy
+except ImportError: # headless run with non-ArcGIS datasets, messages go to standard error
+  arcpy = None
 
 
 # constants defining neighbour table field names
@@ -141,10 +146,12 @@ def parameters(number):
   '''Returns tool parameters from the tool input as strings.'''
   if len(sys.argv) == 1:
     sys.exit(1)
+  if not arcpy: # headless run, parameters are given on the command line
+    return (sys.argv[1:] + [''] * number)[:number]
   params = []
-  for i in range(number):
+  for i in range(min(number, arcpy.GetArgumentCount())): # trailing optional parameters may be missing from older toolboxes
     params.append(arcpy.GetParameterAsText(i))
-  return params
+  return params + [''] * (number - len(params))
 
 def setParameter(paramIndex, output):
   arcpy.SetParameterAsText(paramIndex, output)
@@ -356,7 +363,8 @@ class runtool:
   def __init__(self, parcount=0, debug=None, overwrite=True):
     if debug is not None:
       debugMode = debug
-    arcpy.env.overwriteOutput = overwrite
+    if arcpy:
+      arcpy.env.overwriteOutput = overwrite
     if parcount:
       self.params = parameters(parcount)
 
@@ -370,7 +378,7 @@ class runtool:
     if exc_type is not None:
       if debugMode:
         debug('\n'.join(traceback.format_exception(exc_type, exc_value, tb)))
-      else:
+      elif arcpy: # headless runs let the exception propagate to exit with a traceback
         arcpy.AddError(u'{} {}'.format(exc_type, exc_value))
         return True
     else:
@@ -436,25 +444,28 @@ class ProgressBar:
     self.position = 0 # progressbar position
     self.posExact = 0 # exact position (noninteger)
     self.progress = 0 # how many of count has passed
-    arcpy.SetProgressor('step', self.text, self.position, 100, self.posBy)
+    if arcpy:
+      arcpy.SetProgressor('step', self.text, self.position, 100, self.posBy)
   
-  def move(self):
-    '''Signals the progress bar that one step has been performed. The progress bar may move forward if the step means at least one per cent difference.'''
-    self.progress += 1
-    self.posExact += self.progressBy
+  def move(self, steps=1):
+    '''Signals the progress bar that one step (or the given number of steps) has been performed. The progress bar may move forward if the steps mean at least one per cent difference.'''
+    self.progress += steps
+    self.posExact += self.progressBy * steps
     if int(self.posExact) > self.position: # if crossed per cent to one more
       self.position = int(self.posExact)
-      arcpy.SetProgressorPosition(self.position)
+      if arcpy:
+        arcpy.SetProgressorPosition(self.position)
   
   def end(self):
     '''Ends the counting and resets the progressor.'''
-    arcpy.ResetProgressor()
+    if arcpy:
+      arcpy.ResetProgressor()
 
 class MutedProgressBar(ProgressBar):
   def __init__(self, *args):
     pass
   
-  def move(self):
+  def move(self, steps=1):
     pass
     
   def end(self):
@@ -527,21 +538,30 @@ class PathManager:
     
 def warning(text):
   '''Displays a warning to the tool user.'''
-  arcpy.AddWarning((u'WARNING: ' if debugMode else u'') + encodeMessage(text))
+  if arcpy:
+    arcpy.AddWarning((u'WARNING: ' if debugMode else u'') + encodeMessage(text))
+  else:
+    headless(u'WARNING: ' + encodeMessage(text))
 
 def debug(*args):
   '''Displays a debug message (only in debug mode).'''
   if debugMode:
-    arcpy.AddMessage(u'DEBUG: ' + ' '.join(encodeMessage(arg) for arg in args))
+    (arcpy.AddMessage if arcpy else headless)(u'DEBUG: ' + ' '.join(encodeMessage(arg) for arg in args))
 
 def progress(text):
   '''Signals tool progress by setting the progressor label.'''
+  if not arcpy:
+    headless(u'PROGRESS: ' + encodeProgress(text))
+    return
   if debugMode:
     arcpy.AddMessage(u'PROGRESS: ' + encodeProgress(text))
   arcpy.SetProgressorLabel(encodeProgress(text))
 
 def done():
   '''Signals ArcPy that the script has successfully terminated. If the script is running in a debug mode, raises an error to bring the tool dialog up again for debugger's convenience; otherwise just displays the message.'''
+  if not arcpy:
+    headless(u'PROGRESS: Done.')
+    return
   if debugMode:
     arcpy.AddMessage('PROGRESS: Done.')
   # else:
@@ -549,7 +569,11 @@ def done():
 
 def message(text):
   '''Signals an ordinary message to the user.'''
-  arcpy.AddMessage(encodeMessage(text))
+  (arcpy.AddMessage if arcpy else headless)(encodeMessage(text))
+
+def headless(text):
+  '''Prints a message to standard error when running without ArcGIS.'''
+  sys.stderr.write(text.encode('utf8') + '\n')
 
 def encodeMessage(text):
   '''Encodes the message to UNICODE.'''
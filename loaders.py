@@ -1,7 +1,7 @@
 from __future__ import absolute_import
 
-import os, collections, operator, arcpy, objects, common, math# , geojson
-import regional
+import os, time, json, hashlib, collections, operator, multiprocessing.pool, numpy, objects, common, storage, snapshot, math# , geojson
+from common import arcpy
 from xml.etree import cElementTree as eltree
 
 # TODOS
@@ -15,6 +15,11 @@ SHAPE_FIELDS = (SHAPE_FIELD, SHAPE_FIELD_DA)
 
 WGS_84_PRJ = os.path.join(os.path.dirname(__file__), 'wgs84.prj')
 
+WRITE_BUFFER_SIZE = 10000
+
+STORE_VERSION = 4
+STORE_KEY_FILE = 'key.json'
+
 
 def arcpyToPoint(shape): # returns multid array as in geojson point
   if shape is None:
@@ -109,7 +114,95 @@ ARCPY_TO_LIST_SHAPE_CONV = {'point' : arcpyToPoint, 'multipoint' : arcpyToMultiP
 LIST_TO_ARCPY_SHAPE_CONV = {'point' : pointToArcPy, 'multipoint' : multiPointToArcPy, 'polyline' : lineToArcPy, 'polygon' : polygonToArcPy}
 
 GEOJSON_TO_ARCPY_SHAPE_CONV = {'Point' : pointToArcPy, 'MultiPoint' : multiPointToArcPy, 'LineString' : (lambda x: lineToArcPy([x])), 'MultiLineString' : lineToArcPy, 'Polygon' : (lambda x: polygonToArcPy([x])), 'MultiPolygon' : polygonToArcPy}
+
+# vectorized key matching
+def positionsOf(ids, keys):
+  '''Maps the IDs to positions of the same values in the keys by a binary search in the sorted keys, -1 for unknown IDs.'''
+  ids = numpy.asarray(ids)
+  keys = numpy.asarray(keys)
+  if comparable(ids, keys):
+    order = numpy.argsort(keys, kind='mergesort')
+    found = sortedPositionsOf(ids, keys[order])
+    return numpy.where(found >= 0, order[found], -1).astype(numpy.int64)
+  else:
+    positions = {keys[i] : i for i in xrange(len(keys))}
+    return numpy.fromiter((positions.get(id, -1) for id in ids), dtype=numpy.int64, count=len(ids))
+
+def sortedPositionsOf(ids, sortedKeys):
+  '''Maps the IDs to positions of the same values in the already sorted keys (of a comparable kind), -1 for unknown IDs.'''
+  found = numpy.searchsorted(sortedKeys, ids, side='right') - 1 # the last of duplicate keys, as in a dictionary
+  valid = (found >= 0)
+  valid[valid] = (sortedKeys[found[valid]] == ids[valid])
+  found[~valid] = -1
+  return found.astype(numpy.int64)
+
+def comparable(ids, keys):
+  '''Whether both ID arrays are numeric or both textual, so that they can be matched by sorting.'''
+  for kinds in ('biuf', 'U', 'S'):
+    if ids.dtype.kind in kinds and keys.dtype.kind in kinds:
+      return True
+  return False
+
+def keyPositions(columns, keyColumns):
+  '''Maps the rows given as columns of key fields to positions of the same keys, also given as columns; -1 for unknown keys. Composite keys are encoded to single integers first.'''
+  if len(columns) == 1:
+    return positionsOf(columns[0], keyColumns[0])
+  columns = [numpy.asarray(column) for column in columns]
+  keyColumns = [numpy.asarray(column) for column in keyColumns]
+  if all(comparable(columns[i], keyColumns[i]) for i in range(len(columns))):
+    codes = numpy.zeros(len(columns[0]), dtype=numpy.int64)
+    keyCodes = numpy.zeros(len(keyColumns[0]), dtype=numpy.int64)
+    for column, keyColumn in zip(columns, keyColumns):
+      values, inverse = numpy.unique(numpy.concatenate((keyColumn, column)), return_inverse=True)
+      keyCodes = keyCodes * len(values) + inverse[:len(keyColumn)]
+      codes = codes * len(values) + inverse[len(keyColumn):]
+    return positionsOf(codes, keyCodes)
+  else:
+    positions = {key : i for i, key in enumerate(zip(*keyColumns))}
+    return numpy.fromiter((positions.get(key, -1) for key in zip(*columns)), dtype=numpy.int64, count=len(columns[0]))
   
+class IDIndex:
+  '''Interns external zone IDs (such as census code strings) as dense integer codes, given by the ascending order of the IDs.
+
+  Created at load time from the zones sorted by ID, so that the code of a zone is its position in the zone list; relations and presets are matched through the codes and external IDs are only needed again at output.'''
+
+  def __init__(self, ids):
+    self.ids = sorted(ids)
+    self.codes = {self.ids[i] : i for i in xrange(len(self.ids))}
+    self.array = None
+
+  def __len__(self):
+    return len(self.ids)
+
+  def code(self, id):
+    return self.codes[id]
+
+  def get(self, id, default=None):
+    return self.codes.get(id, default)
+
+  def id(self, code):
+    return self.ids[code]
+
+  def codesOf(self, ids):
+    '''Translates an array of external IDs to codes in bulk, -1 for unknown IDs. The IDs are kept sorted, so they are searched directly.'''
+    if self.array is None:
+      self.array = numpy.array(self.ids)
+    ids = numpy.asarray(ids)
+    if comparable(ids, self.array):
+      return sortedPositionsOf(ids, self.array)
+    else:
+      return numpy.fromiter((self.codes.get(id, -1) for id in ids), dtype=numpy.int64, count=len(ids))
+
+
+def readSource(request):
+  '''Reads the raw data requested by ReadCursor.request(): NumPy columns in bulk mode, otherwise a list of row lists. A module-level function so that it can be run in a worker process.'''
+  layer, fields, where, bulk = request
+  backend = storage.backendFor(layer)
+  if bulk:
+    return backend.columns(fields, where)
+  else:
+    return [list(row) for row in backend.search(fields, where)]
+
 class ConfigError(Exception):
   pass
 
@@ -124,16 +217,27 @@ class RegionalLoader:
     self.makePresets = False
     self.makeInteractions = False
     self.makeNeighbourhood = False
+    self.freezeNeighbourhood = False
+    self.snapshotPath = None
+    self.interStore = None
+    self.concurrency = None
     self.outputs = []
     self.outputTransforms = []
+    self.needsNeighbourhood = True
+    self.needsColors = True
+    self.needsPresets = False
     if self.regionalizer:
       self.loadRequirements()
     
   def loadRequirements(self):
-    pass
+    '''Determines which optional inputs are used by the regionalizer so that the unused ones are not read at all.'''
+    self.needsNeighbourhood = self.regionalizer.neighbourhoodNeeded()
+    self.needsColors = self.regionalizer.colorsNeeded()
+    self.needsPresets = True # presets are only applied by the regionalizer
     
-  def sourceOfZones(self, layer, slots, coreQuery=None, targetClass=None):
+  def sourceOfZones(self, layer, slots, coreQuery=None, targetClass=None, where=None):
     self.zoneLayer = layer
+    self.zoneWhere = where
     slots = self.checkSlots(slots, self.requiredZoneSlots)
     if 'id' not in slots:
       raise ValueError, 'zone ID field required'
@@ -147,49 +251,159 @@ class RegionalLoader:
   
   def sourceOfPresets(self, slots):
     slots = self.checkSlots(slots, {})
-    if slots:
+    if slots and self.needsPresets:
       self.makePresets = True
       self.zoneSlots.update(slots)
     
-  def sourceOfInteractions(self, layer, slots, where=None):
-    self.interLoader = InteractionReader(layer, self.checkSlots(slots, self.requiredInteractionSlots), where=where)
+  def sourceOfInteractions(self, layer, slots, where=None, matrix=False, store=None):
+    '''Sets the interaction source. If matrix is set, the interactions are kept in a single InteractionMatrix. If a store directory is given, the matrix is memory-mapped from there (and built into it from the source first if needed).'''
+    readerClass = MatrixInteractionReader if (matrix or store) else InteractionReader
+    self.interLoader = readerClass(layer, self.checkSlots(slots, self.requiredInteractionSlots), where=where)
+    self.interStore = store
     self.makeInteractions = True
   
-  def sourceOfMultiInteractions(self, layer, slots, where=None, ordering=None):
+  def sourceOfMultiInteractions(self, layer, slots, where=None, ordering=None, matrix=False, store=None):
     objects.MultiInteractions.setDefaultLength(len(slots) - 2)
     if self.zoneClass:
       self.zoneClass.interactionClass = objects.MultiInteractions
     if self.regionalizer:
       self.regionalizer.getRegionFactory().interactionClass = objects.MultiInteractions
-    self.interLoader = MultiInteractionReader(layer, slots, ordering=ordering, where=where)
+    readerClass = MatrixMultiInteractionReader if (matrix or store) else MultiInteractionReader
+    self.interLoader = readerClass(layer, slots, ordering=ordering, where=where)
+    self.interStore = store
     self.makeInteractions = True
   
-  def possibleNeighbourhood(self, layer, slots={}, exterior=False):
-    if not self.regionalizer or self.regionalizer.neighbourhoodNeeded():
+  def possibleNeighbourhood(self, layer, slots={}, exterior=False, freeze=True, where=None):
+    '''Loads the zone neighbourhood if the regionalizer needs it. If freeze is set, neighbour sets are replaced by more compact tuples after loading.'''
+    if self.needsNeighbourhood:
       # common.debug(repr(layer))
       if not layer:
         layer = self.createNeighbourTable(exterior=exterior)
       self.makeNeighbourhood = True
-      self.neighbourLoader = NeighbourTableReader(layer, slots, exterior)
+      self.freezeNeighbourhood = freeze
+      self.neighbourLoader = NeighbourTableReader(layer, slots, exterior, where=(where or None))
     
+  def useSnapshot(self, path):
+    '''Keeps the loaded zones, interactions and neighbourhood in a binary snapshot file at the given path. Later loads with the same sources and settings read the snapshot instead of the sources.'''
+    self.snapshotPath = path
+
+  def useConcurrentLoad(self, processes=False):
+    '''Reads the zones, interactions and neighbourhood concurrently and matches them to the zones afterwards. Threads are used by default, which suits I/O-bound sources (databases, network storage); worker processes suit sources whose parsing is CPU-bound (CSV files), but they must be started from a script guarded by if __name__ == '__main__' and import the loaders anew.'''
+    self.concurrency = 'processes' if processes else 'threads'
+
   def createNeighbourTable(self, exterior=False):
     tblPath = common.tablePath(common.location(self.zoneLayer), common.fcName(self.zoneLayer) + '_neigh')
     import neighbour_table
     return neighbour_table.table(self.zoneLayer, self.zoneSlots['id'], tblPath, exterior=exterior, selfrel=False)
     
-  def load(self):
-    self.zoneLoader = ZoneReader(self.zoneLayer, self.zoneSlots, targetClass=self.zoneClass)
-    self.zoneList = self.zoneLoader.read('loading zones')
-    if self.makeInteractions:
-      self.interLoader.match(self.zoneList, text='loading interactions')
+  def load(self, init=True):
+    '''Loads the inputs. If init is not set, the regionalizer run is not initialized so that the zones stay unassigned.'''
+    self.zoneLoader = ZoneReader(self.zoneLayer, self.neededZoneSlots(), targetClass=self.zoneClass, where=self.zoneWhere)
+    if self.snapshotPath:
+      self.loadSnapshot()
+    elif self.concurrency and self.zoneLoader.concurrent():
+      self.loadConcurrently()
+    else:
+      self.zoneList = self.zoneLoader.read('loading zones')
+      self.indexZones()
+      if self.makeInteractions and self.interStore:
+        self.interLoader.matchStore(self.zoneList, self.interStore, text='loading interactions')
+      elif self.makeInteractions:
+        self.interLoader.match(self.zoneList, text='loading interactions')
+      if self.makeNeighbourhood:
+        self.neighbourLoader.match(self.zoneList, text='loading neighbourhood')
     if self.makeNeighbourhood:
-      self.neighbourLoader.match(self.zoneList, text='loading neighbourhood')
-    if self.regionalizer:
+      if self.freezeNeighbourhood:
+        for zone in self.zoneList:
+          zone.freezeNeighbours()
+    if self.regionalizer and init:
       if self.makePresets:
-        self.regionalizer.initRun(self.zoneList, presets=self.zoneLoader.getPresets())
+        self.regionalizer.initRun(self.zoneList, presets=self.zoneLoader.getPresets(), index=self.zoneIndex)
       else:
-        self.regionalizer.initRun(self.zoneList)
+        self.regionalizer.initRun(self.zoneList, index=self.zoneIndex)
+
+  def indexZones(self):
+    '''Makes the interaction and neighbourhood readers match IDs through the zone ID index.'''
+    self.zoneIndex = self.zoneLoader.getIndex()
+    if self.makeInteractions:
+      self.interLoader.useIndex(self.zoneIndex)
+    if self.makeNeighbourhood:
+      self.neighbourLoader.useIndex(self.zoneIndex)
   
+  def loadConcurrently(self):
+    '''Reads the raw zone rows and the interaction and neighbourhood columns in a pool of workers, then builds the zones and matches the rest to them.'''
+    parts = [] # (name, reader) of bulk-read relation sources
+    if self.makeInteractions and not self.interStore:
+      parts.append(('interactions', self.interLoader))
+    if self.makeNeighbourhood:
+      parts.append(('neighbourhood', self.neighbourLoader))
+    requests = [reader.request() for reader in self.zoneLoader.readers]
+    requests.extend(reader.reader.request(bulk=True) for name, reader in parts)
+    common.progress('loading zones, {} concurrently'.format(' and '.join(name for name, reader in parts) if parts else 'alone'))
+    pool = (multiprocessing.Pool if self.concurrency == 'processes' else multiprocessing.pool.ThreadPool)(len(requests))
+    try:
+      results = pool.map(readSource, requests)
+    finally:
+      pool.close()
+      pool.join()
+    zoneCount = len(self.zoneLoader.readers)
+    self.zoneList = self.zoneLoader.build(self.zoneLoader.rowsFrom(results[:zoneCount]))
+    self.indexZones()
+    for (name, reader), result in zip(parts, results[zoneCount:]):
+      common.progress('matching ' + name)
+      reader.matchArrays(self.zoneList, *reader.positionArrays(self.zoneList, reader.reader.columnsFrom(result)))
+      reader.failWarning()
+    if self.makeInteractions and self.interStore:
+      self.interLoader.matchStore(self.zoneList, self.interStore, text='loading interactions')
+
+  def loadSnapshot(self):
+    '''Loads the inputs from the snapshot if it is up to date, otherwise reads them in bulk from the sources and saves the snapshot.'''
+    snap = snapshot.Snapshot(self.snapshotPath, self.snapshotSources())
+    loaded = snap.load()
+    if loaded:
+      common.progress('loading snapshot')
+      self.zoneList = self.zoneLoader.build(snap.getRows('zones'))
+    else:
+      rows = self.zoneLoader.readRows('loading zones')
+      snap.putRows('zones', rows)
+      self.zoneList = self.zoneLoader.build(rows)
+    self.indexZones()
+    if self.makeInteractions and self.interStore:
+      self.interLoader.matchStore(self.zoneList, self.interStore, text='loading interactions')
+    elif self.makeInteractions:
+      self.loadSnapshotPart(snap, loaded, 'interactions', self.interLoader, ('from', 'to', 'value'))
+    if self.makeNeighbourhood:
+      self.loadSnapshotPart(snap, loaded, 'neighbourhood', self.neighbourLoader, ('from', 'to'))
+    if not loaded:
+      common.progress('saving snapshot')
+      snap.save()
+
+  def loadSnapshotPart(self, snap, loaded, name, reader, slots):
+    if loaded:
+      columns = snap.getColumns(name)
+      reader.fails = int(columns['fails'])
+    else:
+      columns = dict(zip(slots, reader.readArrays(self.zoneList, text='loading ' + name)))
+      columns['fails'] = reader.fails
+      snap.putColumns(name, columns)
+    reader.matchArrays(self.zoneList, *[columns[slot] for slot in slots])
+    reader.failWarning()
+
+  def snapshotSources(self):
+    sources = {'zones' : self.zoneLoader.describe()}
+    if self.makeInteractions and not self.interStore:
+      sources['interactions'] = self.interLoader.describe()
+    if self.makeNeighbourhood:
+      sources['neighbourhood'] = self.neighbourLoader.describe()
+    return sources
+
+  def neededZoneSlots(self):
+    '''Returns the zone slots whose values are used, so that only their fields are read from the zone layer.'''
+    slots = self.zoneSlots.copy()
+    if 'color' in slots and not (self.needsColors or 'color' in self.zoneOutputSlots):
+      del slots['color']
+    return slots
+
   def checkSlots(self, slots, required):
     # common.debug(slots)
     todel = []
@@ -277,10 +491,12 @@ class RowOperator:
   def initSlots(self):
     if SHAPE_SLOT in self.slots:
       self.slots[SHAPE_SLOT] = (SHAPE_FIELD_DA if self.indexAccess else SHAPE_FIELD)
-    fieldSet = set()
+    fieldNames = [] # in the order of the slots if they are ordered
     for mapping in self.slots.values():
-      fieldSet.update(self.getKeys(mapping))
-    self.fieldNames = tuple(fieldSet)
+      for field in self.getKeys(mapping):
+        if field not in fieldNames:
+          fieldNames.append(field)
+    self.fieldNames = tuple(fieldNames)
     if self.indexAccess:
       self.fieldIndexes = {self.fieldNames[i] : i + self.indexOffset for i in range(len(self.fieldNames))}
   
@@ -351,9 +567,18 @@ class OneFieldSetter(OneFieldRowOperator):
     row.setValue(self.field, self.converter(value) if self.converter else value)
     return row
   
-  def createFields(self, layer, value, overwrite=True, append=False):
-    if self.field not in SHAPE_FIELDS:
-      common.addFields(layer, [self.field], typePattern=[value], overwrite=overwrite, append=append)
+  def createFields(self, backend, value, overwrite=True, append=False):
+    if self.field in SHAPE_FIELDS:
+      return
+    fieldFound = bool(self.field in backend.fieldList())
+    if fieldFound:
+      if append:
+        return
+      elif overwrite:
+        backend.deleteField(self.field)
+      else:
+        raise IOError, 'field {} already exists in table {} while overwrite is off'.format(self.field, backend.path)
+    backend.addField(self.field, type(self.converter(value) if self.converter else value))
   
 class OneFieldGetter(OneFieldRowOperator):
   def initSlots(self):
@@ -464,20 +689,26 @@ class Setter(RowOperator):
     # except KeyError, slot:
       # raise KeyError, 'slot {} value not supplied when writing to {}'.format(slot, self.layer)
     
-  def createFields(self, layer, typePattern, overwrite=True, append=False):
+  def columns(self, objects):
+    '''Computes the values of all fields for a list of objects at once, returning a dictionary of value lists by field. Fields of None objects are left None.'''
+    objects = [(self.converted(obj) if self.conversions and obj is not None else obj) for obj in objects]
+    return {field : [(caller(obj) if obj is not None else None) for obj in objects] for field, caller in self.fieldCallers.iteritems()}
+
+  def createFields(self, backend, typePattern, overwrite=True, append=False):
     # print self.fieldsToSlots, typePattern
-    fieldList = common.fieldList(layer)
-    for field, caller in self.fieldCallers.iteritems():
+    fieldList = backend.fieldList()
+    for field in self.fieldNames:
+      caller = self.fieldCallers[field]
       if field in SHAPE_FIELDS:
         continue
       fieldFound = bool(field in fieldList)
       if fieldFound:
         if overwrite and not append:
-          arcpy.DeleteField_management(layer, field)
+          backend.deleteField(field)
         elif not append:
-          raise IOError, 'field {} already exists in table {} while overwrite is off'.format(field, layer)
+          raise IOError, 'field {} already exists in table {} while overwrite is off'.format(field, backend.path)
       elif append:
-        common.warning('field {} does not exist in table {} while append is on, creating')
+        common.warning('field {} does not exist in table {} while append is on, creating'.format(field, backend.path))
       if self.fieldSlots[field] in self.types:
         coltype = self.types[self.fieldSlots[field]]
       else:
@@ -486,13 +717,15 @@ class Setter(RowOperator):
         if coltype is type(None):
           raise ValueError, 'could not infer type for {} slot'.format(self.fieldSlots[field])
       if not (append and fieldFound):
-        common.addField(layer, field, coltype)
+        backend.addField(field, coltype)
   
   def getFieldNames(self):
     return self.fieldNames
 
     
 class Retriever:
+  keySlots = () # slots matched to the object keys, if they can be matched in bulk
+
   def __init__(self, getter, strict=True, default=None):
     self.getter = getter
     self.objects = None
@@ -520,6 +753,16 @@ class Retriever:
   def getFieldCount(self):
     return self.getter.getFieldCount()
 
+  def getKeyFields(self):
+    return [self.getter.getSlots()[slot] for slot in self.keySlots]
+
+  def positions(self, columns, keys):
+    '''Maps the rows given as columns of key field values to positions in the list of object keys, -1 for rows with no object.'''
+    if len(self.keySlots) == 1:
+      return keyPositions(columns, [keys])
+    else:
+      return keyPositions(columns, [[key[i] for key in keys] for i in range(len(self.keySlots))])
+
 class SequentialRetriever(Retriever):
   def __init__(self, strict=True):
     Retriever.__init__(self, None, strict=strict)
@@ -546,6 +789,7 @@ class SequentialRetriever(Retriever):
     
 class IDRetriever(Retriever):
   ID_SLOT = 'id'
+  keySlots = (ID_SLOT, )
 
   def lookup(self, data):
     return self.objects[data[self.ID_SLOT]]
@@ -553,6 +797,7 @@ class IDRetriever(Retriever):
 class RelationRetriever(Retriever):
   FROM_SLOT = 'from'
   TO_SLOT = 'to'
+  keySlots = (FROM_SLOT, TO_SLOT)
   
   def lookup(self, data):
     return self.objects[(data[self.FROM_SLOT], data[self.TO_SLOT])]
@@ -565,6 +810,11 @@ class SidelessRelationRetriever(RelationRetriever):
     except KeyError:
       return self.objects[(direct[1], direct[0])]
 
+  def positions(self, columns, keys):
+    direct = RelationRetriever.positions(self, columns, keys)
+    reverse = RelationRetriever.positions(self, columns[::-1], keys)
+    return numpy.where(direct >= 0, direct, reverse)
+
 
 # class Remapper:
   # def __init__(self, getter, setter):
@@ -580,31 +830,26 @@ class CursorOperator:
   def __init__(self, layer, useDA=True):
     self.layer = layer
     self.count = 0
-    self.usesDA = hasattr(arcpy, 'da') and useDA
-    self._description = None
+    self.backend = storage.backendFor(layer)
+    self.usesDA = self.backend.indexAccess(useDA)
     self.progressor = None
 
   def getCount(self):
     return self.count
   
   def hasShapeField(self):
-    return hasattr(self.getDescription(), 'shapeFieldName')
+    return self.backend.hasShape()
   
   def getShapeFieldName(self):
-    return self.getDescription().shapeFieldName
+    return self.backend.getShapeFieldName()
   
   def getShapeType(self):
-    return self.getDescription().shapeType.lower()
-  
-  def getDescription(self):
-    if self._description is None:
-      self._description = arcpy.Describe(self.layer)
-    return self._description
+    return self.backend.getShapeType()
   
-  def move(self):
+  def move(self, steps=1):
     if self.progressor:
-      self.progressor.move()
-    self.count += 1
+      self.progressor.move(steps)
+    self.count += steps
   
   def end(self):
     if self.progressor:
@@ -628,11 +873,11 @@ class ReadCursor(CursorOperator):
   def calibrate(self, row, text=None):
     if text:
       # print(common.count(self.layer))
-      self.progressor = common.progressor(text, common.count(self.layer))
+      self.progressor = common.progressor(text, self.backend.count())
   
   def rows(self, text=None):
     if self.usesDA:
-      cursor = arcpy.da.SearchCursor(self.layer, self.getter.getFieldNames(), self.where)
+      cursor = self.backend.search(self.getter.getFieldNames(), self.where)
     else:
       cursor = arcpy.SearchCursor(self.layer, self.where, '', '', self.sortExpr)
     first = True
@@ -644,12 +889,40 @@ class ReadCursor(CursorOperator):
       self.move()
     del row, cursor
     self.end()
+
+  def columns(self, text=None):
+    '''Reads the whole dataset at once, returning a dictionary of NumPy arrays (one per slot). Slot conversions are not applied.'''
+    if text:
+      common.progress(text)
+    return self.columnsFrom(self.backend.columns(self.getter.getFieldNames(), self.where))
+
+  def request(self, bulk=False):
+    '''Returns the arguments for readSource() to read the raw data of this cursor, possibly in another thread or process.'''
+    return (self.layer, list(self.getter.getFieldNames()), self.where, bulk)
+
+  def columnsFrom(self, arrays):
+    '''Maps the arrays read by readSource() in bulk mode to slots.'''
+    fields = self.getter.getFieldNames()
+    columns = {field : arrays[i] for i, field in enumerate(fields)}
+    return {slot : columns[field] for slot, field in self.getter.getSlots().iteritems()}
+
+  def rowsFrom(self, rows):
+    '''Converts the raw rows read by readSource() as rows() would.'''
+    return [self.getter.get(row) for row in rows]
+
+  def describe(self):
+    '''Returns a description of the source and its settings that changes when the read data may change.'''
+    return {'layer' : self.layer, 'slots' : self.getter.getSlots(), 'constants' : self.getter.constants,
+      'where' : self.where, 'modified' : self.backend.modified()}
   
     
 class WriteCursor(CursorOperator):
-  def __init__(self, layer, setter, overwrite=True, append=False, template=None, shapeType=None, crs=None):
+  '''Writes rows (dictionaries of slot values) given as any iterable, including generators. The rows are converted and passed to the backend in blocks of bufferSize rows.'''
+
+  def __init__(self, layer, setter, overwrite=True, append=False, template=None, shapeType=None, crs=None, bufferSize=WRITE_BUFFER_SIZE):
     CursorOperator.__init__(self, layer)
     self.setter = setter
+    self.bufferSize = bufferSize
     self.overwrite = overwrite
     self.append = append
     self.template = template
@@ -686,28 +959,63 @@ class WriteCursor(CursorOperator):
       return lambda coor: listToShape(coor, spr)
   
   def write(self, rows, text=None, rowcount=None):
-    if rows:
-      first = True
-      for row in rows:
-        if first:
-          cursor = self.calibrate(row, text, (len(rows) if rowcount is None else rowcount))
-          first = False
+    if rowcount is None and hasattr(rows, '__len__'):
+      rowcount = len(rows)
+    start = time.time()
+    cursor = None
+    for block in self.blocks(rows):
+      if cursor is None:
+        cursor = self.calibrate(block[0], text, rowcount)
+      self.writeBlock(cursor, block)
+    if cursor is None:
+      common.warning('empty output created: {}'.format(self.layer))
+    else:
+      self.backend.release(cursor)
+      self.report(time.time() - start, text)
+      del cursor
+    self.end()
+
+  def blocks(self, rows):
+    block = []
+    for row in rows:
+      block.append(row)
+      if len(block) >= self.bufferSize:
+        yield block
+        block = []
+    if block:
+      yield block
+
+  def writeBlock(self, cursor, block):
+    if self.usesDA:
+      try:
+        self.backend.insertRows(cursor, [self.setter.set(self.setter.newRow(cursor), row) for row in block])
+      except:
+        common.warning('writing {} rows to {} failed, first row of block: {}'.format(len(block), self.layer, block[0]))
+        raise
+      self.move(len(block))
+    else:
+      for row in block:
         self.writeRow(cursor, row)
         self.move()
-      del row
-      del cursor
+
+  def report(self, seconds, text=None):
+    message = '{} rows written to {} in {:.2f} s ({:.0f} rows/s)'.format(self.count, self.layer, seconds, self.count / max(seconds, 1e-6))
+    if text:
+      common.message(message)
     else:
-      common.warning('empty output created: {}'.format(self.layer))
-    self.end()
+      common.debug(message)
   
   def calibrate(self, row, text=None, count=None):
     # print 'CALIBRATING'
     # print row
     if text:
-      self.progressor = common.progressor(text, count)
+      if count:
+        self.progressor = common.progressor(text, count)
+      else:
+        common.progress(text)
     self.create(row)
     if self.usesDA:
-      return arcpy.da.InsertCursor(self.layer, self.setter.getFieldNames())
+      return self.backend.insert(self.setter.getFieldNames())
     else:
       return arcpy.InsertCursor(self.layer)
     
@@ -715,12 +1023,12 @@ class WriteCursor(CursorOperator):
     # print(row, self.setter.slots, self.hasShape, self.shapeType, self.setter.conversions)
     if not self.append:
       if self.overwrite:
-        arcpy.env.overwriteOutput = True
+        self.backend.setOverwrite()
       if self.hasShape:
-        self.layer = common.createFeatureClass(self.layer, self.shapeType.upper(), self.template, self.crs)
+        self.layer = self.backend.createFeatureClass(self.shapeType.upper(), self.template, self.crs)
       else:
-        self.layer = common.createTable(self.layer)
-    self.setter.createFields(self.layer, row, append=self.append)
+        self.layer = self.backend.createTable()
+    self.setter.createFields(self.backend, row, append=self.append)
   
   def writeRow(self, cursor, values):
     # if values['osm_id'] == '207732211': print(values)
@@ -737,14 +1045,30 @@ class WriteCursor(CursorOperator):
       raise
 
 class AsynchronousWriteCursor(WriteCursor):
+  '''Accepts the rows one by one, buffering them into blocks; must be closed to write the last block.'''
+
   def __init__(self, *args, **kwargs):
     WriteCursor.__init__(self, *args, **kwargs)
     self.cursor = None
+    self.buffer = []
   
   def write(self, row):
     if not self.cursor:
       self.cursor = self.calibrate(row)
-    self.writeRow(self.cursor, row)
+    self.buffer.append(row)
+    if len(self.buffer) >= self.bufferSize:
+      self.flush()
+
+  def flush(self):
+    if self.buffer:
+      self.writeBlock(self.cursor, self.buffer)
+      self.buffer = []
+
+  def close(self):
+    if self.cursor:
+      self.flush()
+      self.backend.release(self.cursor)
+      self.cursor = None
       
 class UpdateCursor(CursorOperator):
   def __init__(self, layer, retriever, setter, overwrite=True, where=None, constants={}):
@@ -759,6 +1083,9 @@ class UpdateCursor(CursorOperator):
 
   def update(self, objects, text=None):
     if objects:
+      if self.updatesColumns(objects):
+        self.updateColumns(objects, text)
+        return
       self.retriever.feed(objects)
       if isinstance(objects, dict):
         pattern = next(objects.itervalues())
@@ -769,19 +1096,54 @@ class UpdateCursor(CursorOperator):
       for row in cursor:
         self.updateRow(cursor, row)
         self.count += 1
+      self.backend.release(cursor)
       del row, cursor
     
   def calibrate(self, row, text=None):
     if self.overwrite:
-      arcpy.env.overwriteOutput = True
+      self.backend.setOverwrite()
     if text:
-      self.progressor = common.progressor(text, common.count(self.layer))
-    self.setter.createFields(self.layer, row, overwrite=self.overwrite)
+      self.progressor = common.progressor(text, self.backend.count())
+    self.setter.createFields(self.backend, row, overwrite=self.overwrite)
     if self.usesDA:
-      return arcpy.da.UpdateCursor(self.layer, self.retriever.getFieldNames() + self.setter.getFieldNames(), self.where)
+      return self.backend.update(tuple(self.retriever.getFieldNames()) + tuple(self.setter.getFieldNames()), self.where)
     else:
       return arcpy.UpdateCursor(self.layer, self.where)
   
+  def updatesColumns(self, objects):
+    '''Whether the update can be performed column-wise by updateColumns().'''
+    return self.usesDA and isinstance(objects, dict) and bool(self.retriever.keySlots) and self.backend.columnUpdates()
+
+  def updateColumns(self, objects, text=None):
+    '''Updates all rows in a single pass: matches the key field values of the rows to the object keys by a vectorized join and writes the output fields column by column.'''
+    if self.overwrite:
+      self.backend.setOverwrite()
+    if text:
+      common.progress(text)
+    keys = objects.keys()
+    values = [objects[key] for key in keys]
+    self.setter.createFields(self.backend, values[0], overwrite=self.overwrite)
+    handles, columns = self.backend.keyColumns(self.retriever.getKeyFields(), self.where)
+    positions = self.retriever.positions(columns, keys)
+    if getattr(objects, 'default_factory', None) is not None: # a defaultdict provides objects for all keys
+      values.append(objects.default_factory())
+    else:
+      missing = numpy.flatnonzero(positions < 0)
+      if len(missing) and self.retriever.strict:
+        raise KeyError, tuple(column[missing[0]] for column in columns)
+      values.append(self.retriever.default)
+    # rows with no object point to the last value
+    outputs = self.setter.columns(values)
+    fields = outputs.keys()
+    self.backend.setColumns(handles, fields, [self.aligned(outputs[field], positions) for field in fields])
+    self.count = len(handles)
+
+  @staticmethod
+  def aligned(values, positions):
+    array = numpy.empty(len(values), dtype=object)
+    array[:] = values
+    return array[positions].tolist()
+
   def updateRow(self, cursor, row):
     # common.message(row)
     # common.message(self.setter.fieldIndexes)
@@ -806,11 +1168,12 @@ class TranslateCursor(UpdateCursor):
 
   def translate(self, function, text=None):
     if self.overwrite:
-      arcpy.env.overwriteOutput = True
+      self.backend.setOverwrite()
     cursor = self.calibrate(function(), text)
     for row in cursor:
       self.translateRow(cursor, row, function)
       self.count += 1
+    self.backend.release(cursor)
     del row, cursor
   
   def translateRow(self, cursor, row, function):
@@ -882,7 +1245,7 @@ class ZoneReader(DatasetReader):
   coreDiffSlot = 'coreable'
   presetSlots = collections.OrderedDict([('coop', True), ('assign', False)])
   
-  def __init__(self, layer, slotDict, targetClass=None, coreQuery=None):
+  def __init__(self, layer, slotDict, targetClass=None, coreQuery=None, where=None):
     # common.debug(slotDict)
     DatasetReader.__init__(self, layer)
     self.zoneClass = objects.FlowZone if targetClass is None else targetClass
@@ -890,10 +1253,10 @@ class ZoneReader(DatasetReader):
     if coreQuery:
       coreGetter = self.createGetter(slotDict, constants={self.coreDiffSlot : True})
       hinterGetter = self.createGetter(slotDict, constants={self.coreDiffSlot : False})
-      self.readers = [ReadCursor(layer, coreGetter, where=coreQuery),
-        ReadCursor(layer, hinterGetter, where=common.invertQuery(coreQuery))]
+      self.readers = [ReadCursor(layer, coreGetter, where=self.restrict(coreQuery, where)),
+        ReadCursor(layer, hinterGetter, where=self.restrict(common.invertQuery(coreQuery), where))]
     else:
-      self.readers = [ReadCursor(self.layer, self.createGetter(slotDict))]
+      self.readers = [ReadCursor(self.layer, self.createGetter(slotDict), where=(where or None))]
     self.presets = []
 
   def prepareSlots(self, slots, required=[], default={}):
@@ -908,6 +1271,13 @@ class ZoneReader(DatasetReader):
     
   def getPresets(self):
     return self.presets
+
+  @staticmethod
+  def restrict(query, where):
+    return '({}) AND ({})'.format(query, where) if where else query
+
+  def describe(self):
+    return {'reader' : self.__class__.__name__, 'zoneClass' : self.zoneClass.__name__, 'sources' : [reader.describe() for reader in self.readers]}
  
   def savePreset(self, row):
     doSave = True
@@ -919,13 +1289,38 @@ class ZoneReader(DatasetReader):
     return row
         
   def read(self, text='loading zones'):
-    zones = []
+    return self.build(self.readRows(text=text))
+
+  def readRows(self, text='loading zones'):
+    rows = []
     for reader in self.readers:
-      for row in reader.rows(text=text):
-        if self.presetsOn:
-          row = self.savePreset(row)
-        zones.append(self.zoneClass(**row))
+      rows.extend(reader.rows(text=text))
+    return rows
+
+  def concurrent(self):
+    '''Whether the zones can be read by readSource() in another thread or process.'''
+    return all(reader.usesDA for reader in self.readers)
+
+  def rowsFrom(self, results):
+    '''Converts the raw rows read by readSource() for each of the readers.'''
+    rows = []
+    for reader, result in zip(self.readers, results):
+      rows.extend(reader.rowsFrom(result))
+    return rows
+
+  def build(self, rows):
+    '''Creates the zones from the rows read by readRows(), saving their presets. The zones are sorted by ID and indexed.'''
+    zones = []
+    for row in rows:
+      if self.presetsOn:
+        row = self.savePreset(row)
+      zones.append(self.zoneClass(**row))
+    zones.sort(key=objects.ID_SORTER)
+    self.index = IDIndex([zone.getID() for zone in zones])
     return zones
+
+  def getIndex(self):
+    return self.index
   
   
 class MatchReader(DatasetReader):
@@ -935,6 +1330,11 @@ class MatchReader(DatasetReader):
     DatasetReader.__init__(self, layer, targetClass)
     self.reader = ReadCursor(self.layer, self.createGetter(slotDict), where=where)
     self.fails = 0
+    self.index = None
+
+  def useIndex(self, index):
+    '''Matches the IDs through the IDIndex of the zones (which must be sorted by ID) instead of sorting their IDs for every match.'''
+    self.index = index
   
   def fail(self):
     self.fails += 1
@@ -942,6 +1342,23 @@ class MatchReader(DatasetReader):
   def failWarning(self):
     if self.fails:
       common.warning('{} {} failed to match, {}'.format(self.fails, self.containsWhat, self.handledFails))
+
+  def describe(self):
+    return {'reader' : self.__class__.__name__, 'source' : self.reader.describe()}
+
+  def zoneIDs(self, zones, idGetter=None):
+    '''Returns the IDs of the zones to be passed to positionsOf(), or the zone ID index if used.'''
+    if self.index is not None and idGetter is None:
+      return self.index
+    idGetter = self.DEFAULT_ID_GETTER if idGetter is None else idGetter
+    return numpy.array([idGetter(zone) for zone in zones])
+
+  def positionsOf(self, ids, zoneIDs, countFails=True):
+    '''Maps the IDs to positions of zones with these IDs, -1 for unknown IDs.'''
+    found = zoneIDs.codesOf(ids) if isinstance(zoneIDs, IDIndex) else positionsOf(ids, zoneIDs)
+    if countFails:
+      self.fails += int((found < 0).sum())
+    return found
   
 class RelationReader(MatchReader):
   DEFAULT_FROM_SETTER_NAME = 'setOutflows'
@@ -1004,6 +1421,34 @@ class InteractionReader(RelationReader):
         self.fail()
     return remapped
 
+  def strengths(self, columns):
+    return columns['value']
+
+  def readArrays(self, zones, idGetter=None, text=None):
+    '''Reads the interactions in bulk as three parallel arrays: source zone positions, target zone positions (-1 for unknown zones) and strengths.'''
+    return self.positionArrays(zones, self.reader.columns(text=text), idGetter)
+
+  def positionArrays(self, zones, columns, idGetter=None):
+    zoneIDs = self.zoneIDs(zones, idGetter)
+    return self.positionsOf(columns['from'], zoneIDs), self.positionsOf(columns['to'], zoneIDs), self.strengths(columns)
+
+  def matchArrays(self, zones, sources, targets, strengths):
+    '''Sets zone outflows and inflows from the arrays produced by readArrays().'''
+    outflows = [self.relationClass() for zone in zones]
+    inflows = [self.relationClass() for zone in zones]
+    for source, target, strength in zip(sources.tolist(), targets.tolist(), (strengths.tolist() if strengths.ndim == 1 else strengths)):
+      if source >= 0:
+        if target >= 0:
+          outflows[source][zones[target]] += strength
+          inflows[target][zones[source]] += strength
+        else:
+          outflows[source].addRaw(strength)
+      elif target >= 0:
+        inflows[target].addRaw(strength)
+    for i in xrange(len(zones)):
+      zones[i].setOutflows(outflows[i])
+      zones[i].setInflows(inflows[i])
+
     
 class MultiInteractionReader(InteractionReader):
   relationClass = objects.MultiInteractions
@@ -1016,14 +1461,86 @@ class MultiInteractionReader(InteractionReader):
       ordering.remove('from')
       ordering.remove('to')
     self.ordering = ordering
-    global numpy
-    import numpy
   
+  def describe(self):
+    description = InteractionReader.describe(self)
+    description['ordering'] = self.ordering
+    return description
+
+  def strengths(self, columns):
+    return numpy.column_stack([numpy.asarray(columns[slot], dtype=float) for slot in self.ordering]).reshape(-1, len(self.ordering))
+
   def addRelation(self, relations, row):
     relvec = numpy.array([row[slot] for slot in self.ordering])
     relations[row['from']][0][row['to']] += relvec
     relations[row['to']][1][row['from']] += relvec
   
+class MatrixInteractionReader(InteractionReader):
+  '''Reads the interactions into a single compressed InteractionMatrix instead of per-zone dictionaries.
+
+  Meant for large interaction tables where the dictionaries would not fit into memory.'''
+
+  def match(self, zones, idGetter=None, text=None, **kwargs):
+    matrix = self.matchArrays(zones, *self.readArrays(zones, idGetter, text=text))
+    self.failWarning()
+    return matrix
+
+  def matchArrays(self, zones, sources, targets, strengths):
+    matrix = objects.InteractionMatrix.fromArrays(zones, sources, targets, strengths, interactionClass=self.relationClass)
+    matrix.attach()
+    return matrix
+
+  def matchStore(self, zones, directory, idGetter=None, text=None):
+    '''Attaches the interactions memory-mapped from a matrix store in the given directory. The store is (re)built from the source if it is missing or was built from a different source or for different zones. The zones are told apart by a digest of their IDs, not by their layer, which the tools may write to between runs.'''
+    key = json.dumps({'version' : STORE_VERSION, 'zones' : self.zoneDigest(zones, idGetter), 'interactions' : self.describe()}, sort_keys=True)
+    keyPath = os.path.join(directory, STORE_KEY_FILE)
+    stored = None
+    if os.path.exists(keyPath):
+      with open(keyPath) as keyFile:
+        stored = keyFile.read()
+    if stored != key:
+      if stored is not None:
+        os.remove(keyPath)
+      matrix = self.matchArrays(zones, *self.readArrays(zones, idGetter, text=text))
+      common.progress('saving interaction store')
+      matrix.save(directory)
+      with open(keyPath, 'w') as keyFile:
+        keyFile.write(key)
+      self.failWarning()
+    common.progress('opening interaction store')
+    matrix = objects.InteractionMatrix.load(zones, directory, interactionClass=self.relationClass)
+    matrix.attach()
+    return matrix
+
+  def zoneDigest(self, zones, idGetter=None):
+    '''Returns a digest of the IDs of the zones in their order, which gives their positions in the store.'''
+    idGetter = self.DEFAULT_ID_GETTER if idGetter is None else idGetter
+    digest = hashlib.sha1()
+    for zone in zones:
+      digest.update(unicode(idGetter(zone)).encode('utf8') + '\n')
+    return digest.hexdigest()
+
+class MatrixMultiInteractionReader(MatrixInteractionReader):
+  relationClass = objects.MultiInteractions
+  requiredInputSlots = RelationReader.requiredInputSlots
+
+  def __init__(self, layer, slotDict={}, ordering=None, **kwargs):
+    MatrixInteractionReader.__init__(self, layer, slotDict, **kwargs)
+    if ordering is None:
+      ordering = slotDict.keys()
+      ordering.remove('from')
+      ordering.remove('to')
+    self.ordering = ordering
+
+  def describe(self):
+    description = MatrixInteractionReader.describe(self)
+    description['ordering'] = self.ordering
+    return description
+
+  def strengths(self, columns):
+    return numpy.column_stack([numpy.asarray(columns[slot], dtype=float) for slot in self.ordering]).reshape(-1, len(self.ordering))
+
+
 class OverlapReader(RelationReader):
   relationClass = collections.defaultdict
   twosided = False
@@ -1048,7 +1565,7 @@ class NeighbourTableReader(RelationReader):
     RelationReader.__init__(self, layer, slots, **kwargs)
     self.doExterior = exterior
     common.debug(self.doExterior, '!')
-    self.exterior = regional.exterior
+    self.exterior = objects.exterior
   
   def addRelation(self, relations, row):
     relations[row['from']].append(row['to'])
@@ -1069,6 +1586,36 @@ class NeighbourTableReader(RelationReader):
 
   def isExteriorID(self, id):
     return (int(id) == -1)
+
+  def describe(self):
+    description = RelationReader.describe(self)
+    description['exterior'] = self.doExterior
+    return description
+
+  def readArrays(self, zones, idGetter=None, text=None):
+    '''Reads the neighbourhood in bulk as two parallel arrays of zone positions. A target position of -1 denotes the exterior (present only if exterior neighbourhood was requested), relations with other unknown zones are omitted.'''
+    return self.positionArrays(zones, self.reader.columns(text=text), idGetter)
+
+  def positionArrays(self, zones, columns, idGetter=None):
+    zoneIDs = self.zoneIDs(zones, idGetter)
+    sources = self.positionsOf(columns['from'], zoneIDs, countFails=False)
+    targets = self.positionsOf(columns['to'], zoneIDs, countFails=False)
+    known = (sources >= 0)
+    unknown = numpy.flatnonzero(known & (targets < 0))
+    exterior = numpy.array([self.isExteriorID(id) for id in columns['to'][unknown]], dtype=bool)
+    self.fails += int((~exterior).sum())
+    kept = known & (targets >= 0)
+    if self.doExterior:
+      kept[unknown[exterior]] = True
+    return sources[kept], targets[kept]
+
+  def matchArrays(self, zones, sources, targets):
+    '''Sets zone neighbours from the arrays produced by readArrays().'''
+    neighbours = [[] for zone in zones]
+    for source, target in zip(sources.tolist(), targets.tolist()):
+      neighbours[source].append(zones[target] if target >= 0 else self.exterior)
+    for i in xrange(len(zones)):
+      zones[i].setNeighbours(neighbours[i])
         
 class AdditiveReader(MatchReader):
   targetClass = None
@@ -1097,12 +1644,12 @@ class PointGeometryAdditiveReader(AdditiveReader):
  
  
 class BasicWriter(DatasetOperator):
-  def __init__(self, layer, slotDict, **kwargs):
+  def __init__(self, layer, slotDict, types={}, **kwargs):
     DatasetOperator.__init__(self, layer)
-    self.writer = WriteCursor(layer, Setter(slotDict), **kwargs)
+    self.writer = WriteCursor(layer, Setter(slotDict, types=types), **kwargs)
 
-  def write(self, dicts, text=None):
-    self.writer.write(dicts)
+  def write(self, dicts, text=None, rowcount=None):
+    self.writer.write(dicts, text=text, rowcount=rowcount)
 
 class OneFieldWriter(DatasetOperator):
   def __init__(self, layer, field, **kwargs):
@@ -1134,12 +1681,15 @@ class GeoJSONBasedWriter(DatasetOperator):
     # print(self.writer.layer, arc)
     # if props['osm_id'] == '207732211': print('geoj-write', json['geometry'], arc)
     self.writer.write(arc)
+
+  def close(self):
+    self.writer.close()
     
 class RelationWriter(DatasetOperator):
   REQUIRED_SLOTS = ('from', 'to')
   DEFAULT_FIELDS = {'from' : 'ID_FROM', 'to' : 'ID_TO'}
 
-  def __init__(self, layer, slotDict, convertToID=False, append=False):
+  def __init__(self, layer, slotDict, convertToID=False, append=False, bufferSize=WRITE_BUFFER_SIZE):
     self.layer = layer
     self.convertToID = convertToID
     # if convertToID:
@@ -1147,10 +1697,14 @@ class RelationWriter(DatasetOperator):
     # else:
       # self.fromtoConverter = None
     self.slotDict = self.prepareSlots(slotDict, self.REQUIRED_SLOTS, self.DEFAULT_FIELDS)
-    self.writer = WriteCursor(self.layer, Setter(self.slotDict), append=append)
+    self.writer = WriteCursor(self.layer, Setter(self.slotDict), append=append, bufferSize=bufferSize)
   
   def write(self, relations, text=None):
-    self.writer.write(self.objectRelationsToRows(relations) if self.convertToID else self.relationsToRows(relations), text=text)
+    rows = self.objectRelationsToRows(relations) if self.convertToID else self.relationsToRows(relations)
+    self.writer.write(rows, text=text, rowcount=self.countRelations(relations))
+
+  def countRelations(self, relations):
+    return None
   
   def saveRelations(self, relations):
     self.write(relations)
@@ -1160,20 +1714,19 @@ class RelationWriter(DatasetOperator):
   
 class InteractionWriter(RelationWriter):
   def relationsToRows(self, relations):
-    rels = []
     for source, relation in relations.iteritems():
       for target, value in relation.iteritems():
-        rels.append(self.rowFactory(source, target, value))
-    return rels
+        yield self.rowFactory(source, target, value)
   
   def objectRelationsToRows(self, relations):
     conv = operator.methodcaller('getID')
-    rels = []
     for source, relation in relations.iteritems():
       source = conv(source)
       for target, value in relation.iteritems():
-        rels.append(self.rowFactory(source, conv(target), value))
-    return rels
+        yield self.rowFactory(source, conv(target), value)
+
+  def countRelations(self, relations):
+    return sum(len(relation) for relation in relations.itervalues())
   
   def rowFactory(self, source, target, value):
     return {'from' : source, 'to' : target, 'value' : value}
@@ -1285,6 +1838,128 @@ class InteractionPresenceMarker(RelationMarker):
         rowDict[(target, source)]['in'] = 1
     return rowDict
 
+
+class InteractionStreamer(DatasetOperator):
+  '''A pseudoabstract operator that streams through the interaction table sorted by zone IDs, so that only a bounded part of the table is held in memory at a time.
+
+  Reads and writes back through two cursors sorted the same way; the source must be able to sort (a database, a SQLite table or a file read by a non-ArcGIS backend) and order the IDs as Python does.'''
+  requiredInputSlots = ('from', 'to')
+
+  def __init__(self, layer, inSlots, where=None):
+    DatasetOperator.__init__(self, layer)
+    self.slots = self.prepareSlots(dict(inSlots), self.requiredInputSlots)
+    self.where = where
+    self.backend = storage.backendFor(layer)
+
+  @staticmethod
+  def canStream(layer):
+    return storage.backendFor(layer).sortable()
+
+  def createFields(self, fieldTypes):
+    '''Creates the output fields given as (name, type) pairs, overwriting existing ones.'''
+    existing = self.backend.fieldList()
+    self.backend.setOverwrite()
+    for field, fldType in fieldTypes:
+      if field in existing:
+        common.warning('field {} already exists, contents will be overwritten'.format(field))
+        self.backend.deleteField(field)
+      self.backend.addField(field, fldType)
+
+  def sorted(self, rows, keyLength):
+    '''Passes the rows through, checking that their first keyLength values ascend.'''
+    previous = None
+    for row in rows:
+      key = tuple(row[:keyLength])
+      if previous is not None and key < previous:
+        raise ValueError, 'interactions in {} not sorted consistently by zone IDs, cannot stream'.format(self.layer)
+      previous = key
+      yield row
+
+
+class InteractionGroupMarker(InteractionStreamer):
+  '''Marks interactions with values computed from all interactions of their origin or destination zone.
+
+  Outputs are given as a dictionary of output field name to a (side, function, type) tuple; the fields are created in its order, so an OrderedDict gives them a fixed one. The side is 'out' to group the interactions by origin (the function then receives the origin's outflows) or 'in' to group them by destination (inflows). The function returns a dictionary-like object of values by the other zone's ID; interactions missing in it are marked with zero. Only one zone's interactions are held in memory at a time.'''
+  requiredInputSlots = ('from', 'to', 'value')
+  SIDES = {'out' : ('from', 'to'), 'in' : ('to', 'from')}
+
+  def mark(self, outputs, text=None):
+    self.createFields([(field, output[2]) for field, output in outputs.iteritems()])
+    for side in self.SIDES:
+      sideOutputs = [(field, output[1]) for field, output in outputs.iteritems() if output[0] == side]
+      if sideOutputs:
+        if text:
+          common.progress(text + ' ({})'.format(side))
+        self.markSide(side, sideOutputs)
+
+  def markSide(self, side, outputs):
+    keyField, otherField = [self.slots[slot] for slot in self.SIDES[side]]
+    groups = self.groups(self.backend.search((keyField, otherField, self.slots['value']), self.where, orderBy=[keyField]))
+    cursor = self.backend.update([keyField, otherField] + [field for field, function in outputs], self.where, orderBy=[keyField])
+    key = None
+    results = None
+    for row in self.sorted(cursor, 1):
+      if results is None or row[0] != key:
+        key, group = next(groups)
+        if row[0] != key:
+          raise IOError, 'interaction groups in {} changed while marking'.format(self.layer)
+        results = [function(group) for field, function in outputs]
+      for i in xrange(len(results)):
+        row[2 + i] = results[i].get(row[1], 0)
+      cursor.updateRow(row)
+    self.backend.release(cursor)
+    del cursor
+
+  def groups(self, rows):
+    '''Yields the zone IDs and Interactions of consecutive groups of (zone ID, other zone ID, value) rows sorted by zone ID.'''
+    key = None
+    group = None
+    for zone, other, value in self.sorted(rows, 1):
+      if group is None or zone != key:
+        if group is not None:
+          yield key, group
+        key = zone
+        group = objects.Interactions()
+      group[other] += value
+    if group is not None:
+      yield key, group
+
+
+class MutualMarker(InteractionStreamer):
+  '''Copies the values of the opposite interaction (from the target to the source) to output fields of each interaction, null if there is none.
+
+  Merge-joins the table sorted by source and target with the table sorted by target and source, so it holds no more than one row of each in memory.'''
+
+  def mark(self, fields, outFields, text=None):
+    if text:
+      common.progress(text)
+    fromField, toField = self.slots['from'], self.slots['to']
+    self.createFields(zip(outFields, self.sampleTypes(fields)))
+    opposites = self.sorted(self.backend.search([toField, fromField] + fields, self.where, orderBy=[toField, fromField]), 2)
+    opposite = next(opposites, None)
+    cursor = self.backend.update([fromField, toField] + outFields, self.where, orderBy=[fromField, toField])
+    key = None
+    values = None
+    for row in self.sorted(cursor, 2):
+      if (row[0], row[1]) != key: # duplicate interactions get the same values
+        key = (row[0], row[1])
+        values = [None] * len(outFields)
+        while opposite is not None and tuple(opposite[:2]) < key:
+          opposite = next(opposites, None)
+        while opposite is not None and tuple(opposite[:2]) == key: # the last of duplicate opposites
+          values = list(opposite[2:])
+          opposite = next(opposites, None)
+      cursor.updateRow(list(key) + values)
+    self.backend.release(cursor)
+    del cursor
+
+  def sampleTypes(self, fields):
+    types = [float] * len(fields)
+    for row in self.backend.search(fields, self.where):
+      types = [(float if value is None else type(value)) for value in row]
+      break
+    return types
+
     
 class FunctionUpdater(DatasetOperator):
   def __init__(self, layer, inSlots, outSlots, overwrite=True, where=None):
@@ -1,24 +1,37 @@
-import common, objects, loaders
+import operator, collections, common, objects, loaders
+
+def significantPresence(inter):
+  return {target : 1 for target in inter.significant()}
 
 with common.runtool(5) as parameters:
   interLayer, query, interStrengthFld, interFromIDFld, interToIDFld = parameters
   inSlots = {'from' : interFromIDFld, 'to' : interToIDFld, 'value' : interStrengthFld}
-  outOrdSlots = {'in' : 'ORD_IN', 'out' : 'ORD_OUT'}
-  outRelSlots = {'in' : 'RELS_IN', 'out' : 'RELS_OUT'}
-  outSigSlots = {'in' : 'SIG_IN', 'out' : 'SIG_OUT'}
-  common.progress('loading interactions')
-  inter = loaders.InteractionReader(interLayer, inSlots, where=query).read()
-  # common.message(inter)
-  common.progress('ordering interactions')
-  orders = objects.Interactions.transform(inter, 'orders')
-  # common.message(orders)
-  common.progress('counting relative interaction strength')
-  relst = objects.Interactions.transform(inter, 'relativeStrengths')
-  # common.message(relst)
-  common.progress('selecting significant interactions')
-  signif = objects.Interactions.transform(inter, 'significant')
-  # common.message(signif)
-  common.progress('writing output')
-  loaders.InteractionTwosideMarker(interLayer, inSlots, outOrdSlots, where=query).mark(orders)
-  loaders.InteractionTwosideMarker(interLayer, inSlots, outRelSlots, where=query).mark(relst)
-  loaders.InteractionPresenceMarker(interLayer, inSlots, outSigSlots, where=query).mark(signif)
+  if loaders.InteractionStreamer.canStream(interLayer):
+    # process the interactions origin by origin and destination by destination
+    orders = operator.methodcaller('orders')
+    relst = operator.methodcaller('relativeStrengths')
+    loaders.InteractionGroupMarker(interLayer, inSlots, where=query).mark(collections.OrderedDict([
+      ('ORD_IN', ('in', orders, float)), ('ORD_OUT', ('out', orders, float)),
+      ('RELS_IN', ('in', relst, float)), ('RELS_OUT', ('out', relst, float)),
+      ('SIG_IN', ('in', significantPresence, int)), ('SIG_OUT', ('out', significantPresence, int))
+    ]), text='marking interactions')
+  else:
+    outOrdSlots = {'in' : 'ORD_IN', 'out' : 'ORD_OUT'}
+    outRelSlots = {'in' : 'RELS_IN', 'out' : 'RELS_OUT'}
+    outSigSlots = {'in' : 'SIG_IN', 'out' : 'SIG_OUT'}
+    common.progress('loading interactions')
+    inter = loaders.InteractionReader(interLayer, inSlots, where=query).read()
+    # common.message(inter)
+    common.progress('ordering interactions')
+    orders = objects.Interactions.transform(inter, 'orders')
+    # common.message(orders)
+    common.progress('counting relative interaction strength')
+    relst = objects.Interactions.transform(inter, 'relativeStrengths')
+    # common.message(relst)
+    common.progress('selecting significant interactions')
+    signif = objects.Interactions.transform(inter, 'significant')
+    # common.message(signif)
+    common.progress('writing output')
+    loaders.InteractionTwosideMarker(interLayer, inSlots, outOrdSlots, where=query).mark(orders)
+    loaders.InteractionTwosideMarker(interLayer, inSlots, outRelSlots, where=query).mark(relst)
+    loaders.InteractionPresenceMarker(interLayer, inSlots, outSigSlots, where=query).mark(signif)
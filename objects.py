@@ -1,7 +1,8 @@
-import sys, arcpy, operator, numpy
+import sys, os, operator, itertools, numpy
 from collections import defaultdict, deque
 sys.path.append('.')
 import common, colors
+from common import arcpy
 
 MASS_TO_STRG = 1e-10
 ID_SORTER = operator.methodcaller('getID')
@@ -411,23 +412,546 @@ class MultiInteractions(BaseInteractions):
   def setDefaultLength(cls, length):
     cls.defaultLength = length
 
-  
-class RegionalUnit:
-  '''A measurable regional unit - a pseudoabstract superclass of Zone and Region allowing both of them to provide IDs.'''
+
+class InteractionMatrix(object):
+  '''A compressed store of all interactions among a fixed list of zones.
+
+  Keeps the whole origin-destination matrix as two triplets of NumPy arrays (pointers, zone positions, strengths) - a CSR one for outflows and a CSC one for inflows - instead of three Interactions dictionaries per zone. Zones are addressed by their position in the zone list and get lightweight row and column views of the matrix (MatrixInteractions) that provide the BaseInteractions API.
+
+  Strengths are either a vector (one value per interaction) or a two-dimensional array (an InteractionVector-like row per interaction).
+
+  The arrays can be saved to a directory of .npy files and memory-mapped from there, so that only the matrix rows and columns actually touched are read from disk. The per-zone flow totals are saved along with them so that opening the store does not have to sum all the strengths.'''
+  OUT = 0
+  IN = 1
+  STORE_ARRAYS = ('pointers', 'indexes', 'strengths', 'raws', 'totals')
+  STORE_SIDES = ('out', 'in')
+
+  def __init__(self, zones, outArrays, inArrays, rawOutflows, rawInflows, interactionClass=None, totals=None):
+    self.zones = zones
+    self.pointers = (outArrays[0], inArrays[0])
+    self.indexes = (outArrays[1], inArrays[1])
+    self.strengths = (outArrays[2], inArrays[2])
+    self.raws = (rawOutflows, rawInflows)
+    self.multi = bool(outArrays[2].ndim > 1)
+    if interactionClass is None:
+      interactionClass = MultiInteractions if self.multi else Interactions
+    self.interactionClass = interactionClass
+    self.totals = (self.zoneSums(self.OUT), self.zoneSums(self.IN)) if totals is None else totals
+    self.initLabels()
+
+  def zoneSums(self, side):
+    '''Returns a sum of flows (including raw flows) in the given direction for each zone.'''
+    count = len(self.zones)
+    positions = numpy.repeat(numpy.arange(count, dtype=numpy.int32), numpy.diff(self.pointers[side]))
+    return self.sumBy(positions, self.strengths[side], count, self.strengths[side]) + self.raws[side]
+
+  def initLabels(self):
+    '''Initializes the zone labels: a region label (-1 for no region), a core flag and an activity (non-oscillation) flag for each zone.'''
+    count = len(self.zones)
+    self.regionLabels = numpy.empty(count, dtype=numpy.int32)
+    self.regionLabels.fill(-1)
+    self.coreFlags = numpy.zeros(count, dtype=bool)
+    self.activeFlags = numpy.zeros(count, dtype=bool)
+    self.regionIndex = {}
+    self.regions = []
+    self.labeled = True
+
+  @classmethod
+  def fromArrays(cls, zones, sources, targets, strengths, interactionClass=None):
+    '''Creates the matrix from parallel arrays of source zone positions, target zone positions and strengths.
+
+    Duplicate source-target pairs are summed. A position of -1 marks an unknown zone; strengths of interactions with one unknown side are kept as raw flows of the other side, interactions with both sides unknown are dropped.'''
+    count = len(zones)
+    sources = numpy.asarray(sources, dtype=numpy.int64)
+    targets = numpy.asarray(targets, dtype=numpy.int64)
+    strengths = numpy.asarray(strengths)
+    knownSources = (sources >= 0)
+    knownTargets = (targets >= 0)
+    known = knownSources & knownTargets
+    rawOutflows = cls.sumBy(sources[knownSources & ~knownTargets], strengths[knownSources & ~knownTargets], count, strengths)
+    rawInflows = cls.sumBy(targets[knownTargets & ~knownSources], strengths[knownTargets & ~knownSources], count, strengths)
+    sources = sources[known]
+    targets = targets[known]
+    strengths = strengths[known]
+    return cls(zones,
+      cls.compress(sources, targets, strengths, count),
+      cls.compress(targets, sources, strengths, count),
+      rawOutflows, rawInflows, interactionClass=interactionClass)
+
+  @classmethod
+  def load(cls, zones, directory, interactionClass=None, mmap=True):
+    '''Opens the matrix saved in the given directory by save(), memory-mapping its arrays read-only unless mmap is off.'''
+    arrays = {}
+    for side in cls.STORE_SIDES:
+      for name in cls.STORE_ARRAYS:
+        arrays[side, name] = numpy.load(cls.storePath(directory, side, name), mmap_mode=('r' if mmap else None))
+      if len(arrays[side, 'pointers']) != len(zones) + 1:
+        raise ValueError, 'interaction store {} does not match the zone count {}'.format(directory, len(zones))
+    outArrays, inArrays = [tuple(arrays[side, name] for name in cls.STORE_ARRAYS[:3]) for side in cls.STORE_SIDES]
+    return cls(zones, outArrays, inArrays, arrays['out', 'raws'], arrays['in', 'raws'], interactionClass=interactionClass, totals=(arrays['out', 'totals'], arrays['in', 'totals']))
+
+  def save(self, directory):
+    '''Saves the matrix arrays as separate .npy files to the given directory.'''
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    sideArrays = (self.pointers, self.indexes, self.strengths, self.raws, self.totals)
+    for i in xrange(len(self.STORE_SIDES)):
+      for j in xrange(len(self.STORE_ARRAYS)):
+        numpy.save(self.storePath(directory, self.STORE_SIDES[i], self.STORE_ARRAYS[j]), sideArrays[j][i])
+
+  @staticmethod
+  def storePath(directory, side, name):
+    return os.path.join(directory, side + '_' + name + '.npy')
+
+  @staticmethod
+  def compress(majors, minors, strengths, count):
+    '''Sorts the interactions by major and minor position, sums the duplicates and returns a (pointers, minor positions, strengths) triplet.'''
+    keys = majors * count + minors
+    order = numpy.argsort(keys, kind='mergesort')
+    keys = keys[order]
+    if len(keys):
+      starts = numpy.flatnonzero(numpy.concatenate(([True], keys[1:] != keys[:-1])))
+      keys = keys[starts]
+      strengths = numpy.add.reduceat(strengths[order], starts, axis=0)
+    else:
+      strengths = strengths[order]
+    pointers = numpy.zeros(count + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(keys // count, minlength=count), out=pointers[1:])
+    return pointers, (keys % count).astype(numpy.int32), strengths
+
+  @staticmethod
+  def sumBy(positions, strengths, count, pattern):
+    '''Sums the strengths by zone positions into an array with a row for each zone.'''
+    if pattern.ndim > 1:
+      summed = numpy.zeros((count, ) + pattern.shape[1:], dtype=pattern.dtype)
+      for j in xrange(pattern.shape[1]):
+        summed[:,j] = numpy.bincount(positions, weights=strengths[:,j], minlength=count)
+      return summed
+    else:
+      return numpy.bincount(positions, weights=strengths, minlength=count).astype(pattern.dtype)
+
+  def attach(self):
+    '''Replaces the flow dictionaries of all its zones by views of the matrix.'''
+    for i in xrange(len(self.zones)):
+      self.zones[i].setFlowMatrix(self, i)
+
+  def disableLabels(self):
+    '''Switches off the label-based aggregation. Used when zones may belong to more than one region at once.'''
+    self.labeled = False
+
+  def regionLabel(self, region, create=False):
+    '''Returns an integer label of the region, -2 (matching no zone) for an unknown region.'''
+    if region in self.regionIndex:
+      return self.regionIndex[region]
+    elif create:
+      self.regionIndex[region] = len(self.regions)
+      self.regions.append(region)
+      return self.regionIndex[region]
+    else:
+      return -2
+
+  def label(self, position, region, core, active=True):
+    '''Marks the zone at the given position as belonging to the region.'''
+    self.regionLabels[position] = self.regionLabel(region, create=True)
+    self.coreFlags[position] = core
+    self.activeFlags[position] = active
+
+  def unlabel(self, position):
+    self.regionLabels[position] = -1
+    self.coreFlags[position] = False
+    self.activeFlags[position] = False
+
+  def coreLabels(self, positions):
+    '''Returns region labels of zones at the given positions where only core zones are labeled.'''
+    return numpy.where(self.coreFlags[positions], self.regionLabels[positions], -1)
+
+  def outflowsOf(self, position):
+    return MatrixInteractions(self, self.OUT, position)
+
+  def inflowsOf(self, position):
+    return MatrixInteractions(self, self.IN, position)
+
+  def zero(self):
+    return numpy.zeros(self.strengths[0].shape[1:]) if self.multi else 0
+
+  def native(self, value):
+    '''Converts a NumPy scalar to a Python number; vector strengths are copied to protect the matrix.'''
+    return numpy.array(value) if self.multi else value.item()
+
+  def natives(self, values):
+    '''Converts an array of strengths to a list of Python numbers (or vector copies).'''
+    return list(numpy.array(values)) if self.multi else values.tolist()
+
+  def getZoneCount(self):
+    return len(self.zones)
+
+  def getInteractionCount(self):
+    return len(self.indexes[self.OUT])
+
+
+class MatrixInteractionView(object):
+  '''A pseudoabstract read-only view of InteractionMatrix interactions providing the BaseInteractions API.
+
+  Operations that would modify the interactions (addition, restriction, exclusion...) return a new Interactions instance and leave the matrix untouched.'''
+  __slots__ = ()
+
+  def __iter__(self):
+    return iter(self.keys())
+
+  def iterkeys(self):
+    return iter(self.keys())
+
+  def itervalues(self):
+    return iter(self.values())
+
+  def iteritems(self):
+    return itertools.izip(self.keys(), self.values())
+
+  def items(self):
+    return zip(self.keys(), self.values())
+
+  def __nonzero__(self):
+    return len(self) > 0
+
+  def get(self, target, default=None):
+    return self[target] if target in self else default
+
+  def new(self):
+    return self.getMatrix().interactionClass()
+
+  def copy(self):
+    cp = self.new()
+    cp.update(self.iteritems())
+    cp.raw = self.raw
+    return cp
+
+  def __add__(self, plusinter):
+    ret = self.copy()
+    ret += plusinter
+    return ret
+
+  __iadd__ = __add__
+
+  def __isub__(self, inter):
+    ret = self.copy()
+    ret -= inter
+    return ret
+
+  def __mul__(self, factor):
+    return self.copy() * factor
+
+  def __div__(self, divisor):
+    return self.copy() / divisor
+
+  def restrict(self, restricted):
+    return self.copy().restrict(restricted)
+
+  def restrictToRegions(self):
+    return self.new() # matrix targets are always zones
+
+  def exclude(self, excluded):
+    return self.copy().exclude(excluded)
+
+  def allOver(self, strength, exclude=[]):
+    return self.copy().allOver(strength, exclude=exclude)
+
+  def strongest(self):
+    return self.copy().strongest()
+
+  def significant(self):
+    return self.copy().significant()
+
+  def sortedTargets(self):
+    return self.copy().sortedTargets()
+
+  def orders(self):
+    return self.copy().orders()
+
+  def relativeStrengths(self):
+    return self.copy().relativeStrengths()
+
+  def onlyClassSum(self, targetClass):
+    total = self.getMatrix().zero()
+    for target, strength in self.iteritems():
+      if isinstance(target, targetClass):
+        total += strength
+    return total
+
+  def toCore(self):
+    '''Returns its copy with values to zones that are cores of a region added to that region's value instead.'''
+    regional = self.new()
+    for target, strength in self.iteritems():
+      region = target.getCore()
+      regional[target if region is None else region] += strength
+    regional.raw = self.raw
+    return regional
+
+  def toRegional(self):
+    '''Returns its copy with values to zones that are inside a region added to that region's value instead.'''
+    regional = self.new()
+    for target, strength in self.iteritems():
+      region = target.getRegion()
+      regional[target if region is None else region] += strength
+    regional.raw = self.raw
+    return regional
+
+  def sumToCoreOf(self, region):
+    total = self.getMatrix().zero()
+    for target, strength in self.iteritems():
+      if target.isCoreOf(region):
+        total += strength
+    return total
+
+  def sumToRegion(self, region):
+    total = self.getMatrix().zero()
+    for target, strength in self.iteritems():
+      if target.isInRegion(region):
+        total += strength
+    return total
+
+  def sumOutOf(self, region):
+    total = self.getMatrix().zero()
+    for target, strength in self.iteritems():
+      if not target.isInRegion(region):
+        total += strength
+    return total
+
+  def sumsByCore(self, region):
+    inside = self.getMatrix().zero()
+    outside = self.getMatrix().zero()
+    for target, strength in self.iteritems():
+      if target.isCoreOf(region):
+        inside += strength
+      elif not target.isInRegion(region):
+        outside += strength
+    return (inside, outside)
+
+  def sumsByRegion(self, region):
+    inside = self.getMatrix().zero()
+    outside = self.getMatrix().zero()
+    for target, strength in self.iteritems():
+      if target.isInRegion(region):
+        inside += strength
+      else:
+        outside += strength
+    return (inside, outside)
+
+  def getRaw(self):
+    return self.raw
+
+
+class MatrixInteractions(MatrixInteractionView):
+  '''A row (outflows) or column (inflows) of an InteractionMatrix.'''
+  __slots__ = ('matrix', 'side', 'position')
+
+  def __init__(self, matrix, side, position):
+    self.matrix = matrix
+    self.side = side
+    self.position = position
+
+  def getMatrix(self):
+    return self.matrix
+
+  def bounds(self):
+    pointers = self.matrix.pointers[self.side]
+    return pointers[self.position], pointers[self.position + 1]
+
+  def targetIndexes(self):
+    start, end = self.bounds()
+    return self.matrix.indexes[self.side][start:end]
+
+  def strengths(self):
+    start, end = self.bounds()
+    return self.matrix.strengths[self.side][start:end]
+
+  def keys(self):
+    zones = self.matrix.zones
+    return [zones[i] for i in self.targetIndexes().tolist()]
+
+  def values(self):
+    return self.matrix.natives(self.strengths())
+
+  def __len__(self):
+    start, end = self.bounds()
+    return int(end - start)
+
+  def locate(self, target):
+    '''Returns a position of the strength to the target in the matrix strength array, None if not present.'''
+    index = getattr(target, 'index', None)
+    if index is None:
+      return None
+    start, end = self.bounds()
+    indexes = self.matrix.indexes[self.side]
+    pos = start + numpy.searchsorted(indexes[start:end], index)
+    if pos < end and indexes[pos] == index:
+      return pos
+    else:
+      return None
+
+  def __contains__(self, target):
+    return self.locate(target) is not None
+
+  def __getitem__(self, target):
+    pos = self.locate(target)
+    if pos is None:
+      return self.matrix.zero()
+    else:
+      return self.matrix.native(self.matrix.strengths[self.side][pos])
+
+  @property
+  def raw(self):
+    return self.matrix.native(self.matrix.raws[self.side][self.position])
+
+  def sum(self):
+    '''Returns a sum of its values (strengths) including raw.'''
+    return self.matrix.native(self.matrix.totals[self.side][self.position])
+
+  def max(self):
+    '''Returns a maximum of its values.'''
+    strengths = self.strengths()
+    return strengths.max().item() if len(strengths) else 0
+
+  def labeledSums(self, labels, region):
+    '''Returns sums of its strengths to zones with the given region label and to other zones.'''
+    inside = (labels == self.matrix.regionLabel(region))
+    strengths = self.strengths()
+    return self.matrix.native(strengths[inside].sum(axis=0)), self.matrix.native(strengths[~inside].sum(axis=0))
+
+  def sumToRegion(self, region):
+    if not self.matrix.labeled:
+      return MatrixInteractionView.sumToRegion(self, region)
+    return self.labeledSums(self.matrix.regionLabels[self.targetIndexes()], region)[0]
+
+  def sumOutOf(self, region):
+    if not self.matrix.labeled:
+      return MatrixInteractionView.sumOutOf(self, region)
+    return self.labeledSums(self.matrix.regionLabels[self.targetIndexes()], region)[1]
+
+  def sumToCoreOf(self, region):
+    if not self.matrix.labeled:
+      return MatrixInteractionView.sumToCoreOf(self, region)
+    return self.labeledSums(self.matrix.coreLabels(self.targetIndexes()), region)[0]
+
+  def sumsByRegion(self, region):
+    if not self.matrix.labeled:
+      return MatrixInteractionView.sumsByRegion(self, region)
+    return self.labeledSums(self.matrix.regionLabels[self.targetIndexes()], region)
+
+  def sumsByCore(self, region):
+    if not self.matrix.labeled:
+      return MatrixInteractionView.sumsByCore(self, region)
+    targets = self.targetIndexes()
+    label = self.matrix.regionLabel(region)
+    inRegion = (self.matrix.regionLabels[targets] == label)
+    toCore = inRegion & self.matrix.coreFlags[targets]
+    strengths = self.strengths()
+    return self.matrix.native(strengths[toCore].sum(axis=0)), self.matrix.native(strengths[~inRegion].sum(axis=0))
+
+  def toLabeled(self, labels):
+    '''Returns its copy with values to zones with a region label added to that region's value instead.'''
+    regional = self.new()
+    targets = self.targetIndexes()
+    strengths = self.strengths()
+    free = (labels < 0)
+    zones = self.matrix.zones
+    regional.update(itertools.izip([zones[i] for i in targets[free].tolist()], self.matrix.natives(strengths[free])))
+    uniques, inverse = numpy.unique(labels[~free], return_inverse=True)
+    if len(uniques):
+      regions = self.matrix.regions
+      regional.update(itertools.izip([regions[i] for i in uniques.tolist()], self.matrix.natives(self.matrix.sumBy(inverse, strengths[~free], len(uniques), strengths))))
+    regional.raw = self.raw
+    return regional
+
+  def toCore(self):
+    if not self.matrix.labeled:
+      return MatrixInteractionView.toCore(self)
+    return self.toLabeled(self.matrix.coreLabels(self.targetIndexes()))
+
+  def toRegional(self):
+    if not self.matrix.labeled:
+      return MatrixInteractionView.toRegional(self)
+    return self.toLabeled(self.matrix.regionLabels[self.targetIndexes()])
+
+
+class MutualMatrixInteractions(MatrixInteractionView):
+  '''A sum of outflows and inflows of a zone in an InteractionMatrix.'''
+  __slots__ = ('outflows', 'inflows')
+
+  def __init__(self, outflows, inflows):
+    self.outflows = outflows
+    self.inflows = inflows
+
+  def getMatrix(self):
+    return self.outflows.getMatrix()
+
+  def keys(self):
+    zones = self.getMatrix().zones
+    return [zones[i] for i in numpy.union1d(self.outflows.targetIndexes(), self.inflows.targetIndexes()).tolist()]
+
+  def values(self):
+    return [self[target] for target in self.keys()]
+
+  def iteritems(self):
+    return ((target, self[target]) for target in self.keys())
+
+  def __len__(self):
+    return len(numpy.union1d(self.outflows.targetIndexes(), self.inflows.targetIndexes()))
+
+  def __nonzero__(self):
+    return bool(self.outflows) or bool(self.inflows)
+
+  def __contains__(self, target):
+    return target in self.outflows or target in self.inflows
+
+  def __getitem__(self, target):
+    return self.outflows[target] + self.inflows[target]
+
+  @property
+  def raw(self):
+    return self.outflows.raw + self.inflows.raw
+
+  def sum(self):
+    return self.outflows.sum() + self.inflows.sum()
+
+  def max(self):
+    return max(self.itervalues()) if self else 0
+
+  def copy(self):
+    cp = self.outflows.copy()
+    cp += self.inflows
+    return cp
+
+
+class RegionalUnit(object):
+  '''A measurable regional unit - a pseudoabstract superclass of Zone and Region allowing both of them to provide IDs.
+
+  Zones, regions and assignments are slotted to keep the memory footprint of large zone sets low; their subclasses must declare the attributes they introduce in __slots__ (or omit __slots__ to get an instance dictionary).'''
+  __slots__ = ()
   id = None
+  version = 0
 
   def __init__(self, id):
     self.id = id
+    self.version = 0
 
   def getID(self):
     return self.id
 
+  def getVersion(self):
+    '''Returns a counter that increases with every change of the unit's assignments or mass; used to invalidate cached values.'''
+    return self.version
+
+  def bumpVersion(self):
+    self.version += 1
+
   # for interaction calculations (excluding zones by their region)
   def getRegion(self):
     return None
     
-class Neighbour:
+class Neighbour(object):
   '''A simple superclass allowing neighbourhood formalization.'''
+  __slots__ = ()
+
   def __init__(self):
     self.neighbours = set()
   
@@ -443,6 +967,10 @@ class Neighbour:
   
   def getNeighbours(self):
     return self.neighbours
+
+  def freezeNeighbours(self):
+    '''Replaces the neighbour set by a tuple once the neighbourhood is complete. Saves memory and speeds up iteration; no neighbours may be added afterwards.'''
+    self.neighbours = tuple(self.neighbours)
     
 class Exterior(Neighbour):
   def getID(self):
@@ -483,6 +1011,7 @@ class GeometricalZone(Neighbour):
 
 # zone (a basic territorial unit for which data is provided, usually a settlement)    
 class RegionalZone(RegionalUnit, Neighbour):
+  __slots__ = ('id', 'version', 'neighbours', 'mass', 'assignment', '_region')
   delegation = 'region'
   coreable = True
 
@@ -503,11 +1032,13 @@ class RegionalZone(RegionalUnit, Neighbour):
   def addAssignment(self, ass):
     self.assignment = ass
     self._region = ass.getRegion()
+    self.bumpVersion()
 
   def removeAssignment(self, ass=None):
     if ass is None or ass is self.assignment:
       self.assignment = None
       self._region = None
+      self.bumpVersion()
 
   def getAssignments(self):
     return [self.assignment] if self.assignment is not None else []
@@ -603,16 +1134,18 @@ class NoFlowZone(RegionalZone):
 
   
 class FlowZone(RegionalZone):
+  __slots__ = ('inflows', 'outflows', 'mutualFlows', 'regionPreset', 'coop', 'coreable', 'color', 'exclaveFlag', 'index', 'flowMatrix', 'sortedTargets', 'relativizedOutflows')
   delegation = 'region'
   penalization = 1
   interactionClass = Interactions
-  coreable = True
 
   def __init__(self, id, mass=None, coop=None, assign=None, color=None, coreable=True):
     '''Initialize the zone with a given ID, mass, color and regional setup.
     
     coop signals that the zone should be merged to that region as a core,
     assign signals that the zone should be added to that region's hinterland.'''
+    self.index = None
+    self.flowMatrix = None
     RegionalZone.__init__(self, id, (0 if mass is None else mass))
     self.inflows = self.interactionClass()
     self.outflows = self.interactionClass()
@@ -620,7 +1153,7 @@ class FlowZone(RegionalZone):
     self.regionPreset = assign
     self.coop = coop
     self.coreable = coreable
-    self.color = colors.hexToRGB(color) if color is not None and color.strip() else colors.WHITE_RGB
+    self.color = colors.packRGB(colors.hexToRGB(color)) if color is not None and color.strip() else colors.WHITE_PACKED # packed to a single int
     self.exclaveFlag = 0
   
   def addInflow(self, source, strength):
@@ -646,6 +1179,14 @@ class FlowZone(RegionalZone):
   def setOutflows(self, outflows):
     self.outflows = outflows
     self.mutualFlows = self.inflows + self.outflows
+
+  def setFlowMatrix(self, matrix, index):
+    '''Replaces its flows by views of the given InteractionMatrix where the zone has the given position.'''
+    self.index = index
+    self.flowMatrix = matrix
+    self.outflows = matrix.outflowsOf(index)
+    self.inflows = matrix.inflowsOf(index)
+    self.mutualFlows = MutualMatrixInteractions(self.outflows, self.inflows)
   
   def getOutflow(self, target):
     return self.outflows[target]
@@ -666,25 +1207,25 @@ class FlowZone(RegionalZone):
     return self.coop
   
   def setColor(self, color):
-    self.color = color
+    self.color = colors.packRGB(color)
   
   def getColor(self):
-    return self.color
+    return colors.unpackRGB(self.color)
   
   def getColorHex(self):
-    return colors.rgbToHex(self.color)
+    return colors.rgbToHex(colors.unpackRGB(self.color))
   
   # deprecated, do not use
   def calcFuzzyColor(self, memName=None):
     '''Calculates a membership color using the provided membership function.'''
     if memFunc:
-      self.color = self.membershipColor(self.membershipFlows(memName))
+      self.setColor(self.membershipColor(self.membershipFlows(memName)))
     else:
       reg = self.getRegion()
       if reg:
-        self.color = reg.getColor()
+        self.setColor(reg.getColor())
       else:
-        self.color = RGBColor.makeWhite()
+        self.setColor(RGBColor.makeWhite())
   
   def getMaxOutflowTarget(self):
     tgt = common.maxKey(self.outflows)
@@ -797,6 +1338,7 @@ class FlowZone(RegionalZone):
   
 
 class MonoZone(FlowZone):
+  __slots__ = ('_iscore', )
   oscillationRatio = 1
   
   def __init__(self, *args, **kwargs):
@@ -812,11 +1354,16 @@ class MonoZone(FlowZone):
   def addAssignment(self, ass):
     FlowZone.addAssignment(self, ass)
     self._iscore = ass.isCore()
+    if self.flowMatrix is not None:
+      self.flowMatrix.label(self.index, self._region, self._iscore, bool(ass))
   
   def removeAssignment(self, ass=None):
+    removed = (ass is None or ass is self.assignment)
     FlowZone.removeAssignment(self, ass)
-    if ass is None or ass is self.assignment:
+    if removed:
       self._iscore = False
+      if self.flowMatrix is not None:
+        self.flowMatrix.unlabel(self.index)
   
   def setAssignmentExclave(self, region=None):
     if self._region is not None:
@@ -841,10 +1388,16 @@ class MonoZone(FlowZone):
   
 
 class MultiZone(FlowZone):
+  __slots__ = ('assignments', )
+
   def __init__(self, *args, **kwargs):
     RegionalZone.__init__(self, *args, **kwargs)
     self.assignments = []
 
+  def setFlowMatrix(self, matrix, index):
+    FlowZone.setFlowMatrix(self, matrix, index)
+    matrix.disableLabels() # zone labels cannot express multiple regions
+
   def isExclave(self): # if the zone is an exclave
     for ass in self.assignments:
       if not ass.isExclave():
@@ -854,6 +1407,7 @@ class MultiZone(FlowZone):
   def addAssignment(self, ass):
     # common.debug('adding %s' % ass)
     self.assignments.append(ass)
+    self.bumpVersion()
   
   def removeAssignment(self, ass=None):
     # common.debug('removing %s' % ass)
@@ -861,6 +1415,7 @@ class MultiZone(FlowZone):
       self.assignments.remove(ass)
       if len(self.assignments) == 1 and not self.assignments[0]:
         self.assignments[0].setDegree(1) # solidify the remaining assignment from 0 to 1
+      self.bumpVersion()
     else:
       pass
   
@@ -947,8 +1502,9 @@ class MultiZone(FlowZone):
       return colors.BLACK_RGB
     
 
-class SimpleAssignment:
+class SimpleAssignment(object):
   '''An assignment of a zone to a region.'''
+  __slots__ = ('zone', 'region')
   
   def __init__(self, zone, region):
     self.zone = zone
@@ -980,37 +1536,27 @@ class SimpleAssignment:
   
   def isExclave(self):
     return False
+  
+  def isCore(self):
+    return False
     
-  def isOnlyConnection(self, diffZone): # PERFORMANCE BOTTLENECK
+  def isOnlyConnection(self, diffZone):
     '''Returns True if diffZone would change exclave status of this assignment, False otherwise.'''
-    artic = self.region.getArticulation(diffZone)
-    if artic: # if diffZone is an articulation point of self.region
-      cores = len(self.region.getCoreZones())
-      myZone = False
-      for subtree in artic: # for each biconnected component separated by diffZone
-        coreZone = False
-        for zone in subtree:
-          if zone == self.zone:
-            myZone = True
-          elif zone.getCore():
-            coreZone = True
-        if myZone: # self.zone is inside, OK if there is a core in the same component
-          return (not coreZone)
-        elif coreZone: # one core less to be in the same component with self.zone
-          cores -= 1
-          if cores == 0: return True # no core left to be in the same component as self.zone
-      return False # self.zone not in separated components and so is at least one core
-    else:
-      return False
+    blockCut = self.region.getBlockCut()
+    if blockCut.contains(diffZone): # splitting diffZone from the region
+      return blockCut.disconnects(self.zone, diffZone)
+    else: # adding diffZone to the region
+      return blockCut.reconnects(self.zone, diffZone)
     
 class Assignment(SimpleAssignment):
   '''An assignment of a zone to a region storing its strength and contiguity (exclave) status.'''
+  __slots__ = ('core', 'degree', 'exclave', 'oscillatory')
 
   def __init__(self, zone, region, core=False, degree=1, exclave=False, oscillatory=False):
     SimpleAssignment.__init__(self, zone, region)
     self.core = core
     self.degree = degree # fuzzy membership
-    self.setExclave(exclave)
+    self.exclave = exclave
     # self.neighbours = set(self.zone.getNeighbours())
     self.oscillatory = oscillatory
   
@@ -1033,7 +1579,9 @@ class Assignment(SimpleAssignment):
     return self.exclave
    
   def setExclave(self, state):
-    self.exclave = state
+    if state != self.exclave:
+      self.exclave = state
+      self.region.resetBlockCut()
     
   def __repr__(self):
     return '<%s as %s of %s (%g%s)>' % (self.zone, ('core' if self.core else 'hinterland'), self.region, self.degree, ', exclave' if self.exclave else '')
@@ -1117,13 +1665,339 @@ class AssignmentPreset:
   def getRegionID(self):
     return self.regID
     
+
+class BlockCutIndex:
+  '''Articulation structure of a region's contiguity graph formed by its non-exclave zones.
+
+  A single DFS numbers the zones in preorder so that every DFS subtree is a preorder interval; a zone separates those of its DFS children whose lowpoint does not reach above it (a DFS root all its children if it has more of them). Core counts of subtrees are differences of core count prefix sums, so whether removing a zone cuts another zone off all cores is answered in time proportional to the number of parts the removed zone separates.
+
+  Hinterland zones added with a single contiguous neighbour are attached as pendants without renumbering (and detached again if they are leaves); other changes require a rebuild.'''
+
+  def __init__(self, assignments):
+    self.members = set() # all zones of the region
+    self.contiguous = set() # non-exclave zones including pendants
+    self.order = {} # DFS preorder numbers
+    self.ends = {} # last preorder numbers in DFS subtrees
+    self.sequence = [] # zones in DFS preorder
+    self.components = {} # contiguity graph component numbers
+    self.componentCores = [] # core counts by component
+    self.corePrefix = [0] # core counts in preorder prefixes
+    self.separators = defaultdict(list) # DFS children whose subtrees are separated by their parent
+    self.roots = set() # DFS roots separate their subtrees only if they have more of them
+    self.pendants = {} # pendant zone: zone it is attached to
+    self.pendantChildren = defaultdict(list)
+    self.exclaveGroups = {} # exclave zone: set of exclaves contiguous with it
+    cores = set()
+    exclaves = []
+    for ass in assignments:
+      zone = ass.getZone()
+      self.members.add(zone)
+      if ass.isExclave():
+        exclaves.append(zone)
+      else:
+        self.contiguous.add(zone)
+        if ass.isCore():
+          cores.add(zone)
+    for ass in assignments:
+      zone = ass.getZone()
+      if zone not in self.order and zone in self.contiguous:
+        self.search(zone, cores)
+    self.groupExclaves(exclaves)
+  
+  def neighboursOf(self, zone):
+    return [neigh for neigh in zone.getNeighbours() if neigh in self.contiguous]
+  
+  def search(self, root, cores):
+    '''Numbers the contiguity graph component of root by an iterative DFS, computing lowpoints and separated subtrees.'''
+    component = len(self.componentCores)
+    start = len(self.sequence)
+    lows = {}
+    parents = {root : None}
+    self.visit(root, component, root in cores, lows)
+    stack = [(root, iter(self.neighboursOf(root)))]
+    while stack:
+      now, neighs = stack[-1]
+      for neigh in neighs:
+        if neigh not in self.order: # tree edge, descend
+          parents[neigh] = now
+          self.visit(neigh, component, neigh in cores, lows)
+          stack.append((neigh, iter(self.neighboursOf(neigh))))
+          break
+        elif neigh is not parents[now] and self.order[neigh] < lows[now]: # back edge
+          lows[now] = self.order[neigh]
+      else: # all neighbours visited, exit vertex
+        stack.pop()
+        self.ends[now] = len(self.sequence) - 1
+        parent = parents[now]
+        if parent is not None:
+          if lows[now] < lows[parent]:
+            lows[parent] = lows[now]
+          if lows[now] >= self.order[parent]:
+            self.separators[parent].append(now)
+    self.roots.add(root)
+    self.componentCores.append(self.corePrefix[-1] - self.corePrefix[start])
+  
+  def visit(self, zone, component, core, lows):
+    self.order[zone] = lows[zone] = len(self.sequence)
+    self.sequence.append(zone)
+    self.components[zone] = component
+    self.corePrefix.append(self.corePrefix[-1] + (1 if core else 0))
+  
+  def groupExclaves(self, exclaves):
+    '''Groups the exclaves into mutually contiguous sets.'''
+    exclaveSet = set(exclaves)
+    for exclave in exclaves:
+      if exclave not in self.exclaveGroups:
+        group = set([exclave])
+        queue = deque([exclave])
+        while queue:
+          for neigh in queue.popleft().getNeighbours():
+            if neigh in exclaveSet and neigh not in group:
+              group.add(neigh)
+              queue.append(neigh)
+        for zone in group:
+          self.exclaveGroups[zone] = group
+  
+  def contains(self, zone):
+    return zone in self.members
+  
+  def coresIn(self, zone):
+    '''Returns a count of cores in the DFS subtree of the zone.'''
+    return self.corePrefix[self.ends[zone] + 1] - self.corePrefix[self.order[zone]]
+  
+  def isCore(self, zone):
+    return self.corePrefix[self.order[zone] + 1] > self.corePrefix[self.order[zone]]
+  
+  def inSubtree(self, zone, root):
+    return self.order[root] <= self.order[zone] <= self.ends[root]
+  
+  def disconnects(self, zone, removed):
+    '''Returns True if removing the removed zone would cut the zone off all cores it is contiguous with.'''
+    if zone is removed or zone not in self.contiguous or removed not in self.contiguous:
+      return False
+    while zone in self.pendants: # pendants carry no cores, find the numbered zone they hang on
+      zone = self.pendants[zone]
+      if zone is removed:
+        return self.componentCores[self.components[self.anchor(zone)]] > 0
+    if removed in self.pendants or self.components[zone] != self.components[removed]:
+      return False
+    remaining = self.componentCores[self.components[zone]]
+    if not remaining:
+      return False # already without a core
+    if self.isCore(removed):
+      remaining -= 1
+    for child in self.separators.get(removed, ()):
+      cores = self.coresIn(child)
+      if self.inSubtree(zone, child):
+        return cores == 0
+      remaining -= cores
+    return remaining == 0
+  
+  def reconnects(self, zone, added):
+    '''Returns True if adding the added zone would connect the exclave zone to the region.'''
+    group = self.exclaveGroups.get(zone)
+    if group is None:
+      return False
+    for neigh in added.getNeighbours():
+      if neigh in group:
+        return True
+    return False
+  
+  def joined(self, added):
+    '''Returns a set of exclaves that adding the zone would connect.'''
+    joined = set()
+    for neigh in added.getNeighbours():
+      if neigh in self.exclaveGroups:
+        joined.update(self.exclaveGroups[neigh])
+    return joined
+  
+  def anchor(self, zone):
+    while zone in self.pendants:
+      zone = self.pendants[zone]
+    return zone
+  
+  def separated(self, zone):
+    '''Returns a list of zone sets that removing the zone would separate from the rest of its contiguity graph component (its DFS root side).'''
+    parts = []
+    if zone in self.order:
+      for child in self.separators.get(zone, ()):
+        parts.append(self.withPendants(self.sequence[self.order[child]:(self.ends[child] + 1)]))
+    for pendant in self.pendantChildren.get(zone, ()):
+      parts.append(self.withPendants([pendant]))
+    if zone in self.roots and len(parts) < 2:
+      return []
+    return parts
+  
+  def withPendants(self, zones):
+    part = set(zones)
+    stack = list(zones)
+    while stack:
+      for pendant in self.pendantChildren.get(stack.pop(), ()):
+        part.add(pendant)
+        stack.append(pendant)
+    return part
+  
+  def articulations(self):
+    zones = set(zone for zone in self.separators if self.separators[zone])
+    zones.update(zone for zone in self.pendantChildren if self.pendantChildren[zone])
+    return [zone for zone in zones if zone not in self.roots or len(self.separators.get(zone, ())) + len(self.pendantChildren.get(zone, ())) > 1]
+  
+  def attach(self, assignment):
+    '''Attaches the zone of a new assignment as a pendant if possible. Returns False if the structure must be rebuilt.'''
+    zone = assignment.getZone()
+    if assignment.isExclave() or assignment.isCore() or zone in self.members:
+      return False
+    neighs = self.neighboursOf(zone)
+    if len(neighs) != 1:
+      return False
+    self.members.add(zone)
+    self.contiguous.add(zone)
+    self.pendants[zone] = neighs[0]
+    self.pendantChildren[neighs[0]].append(zone)
+    return True
+  
+  def detach(self, assignment):
+    '''Detaches the zone of a removed assignment if it is a leaf pendant. Returns False if the structure must be rebuilt.'''
+    zone = assignment.getZone()
+    if zone not in self.pendants or self.pendantChildren.get(zone):
+      return False
+    self.pendantChildren[self.pendants.pop(zone)].remove(zone)
+    self.members.discard(zone)
+    self.contiguous.discard(zone)
+    return True
+
       
+class ExclaveTracker:
+  '''Keeps exclave flags of a region's assignments up to date between exclave detections.
+
+  The first detection, and any detection after a core or a zone cutting the region body was removed, runs a full breadth-first search from the cores. Otherwise, only zones added since the last detection and the exclaves they may reconnect are examined. A removed zone is recognized as non-cutting when a search finds its former contiguous neighbours mutually reachable.
+
+  Counts of full and incremental detections are kept on the class for profiling.'''
+  fullCount = 0
+  incrementalCount = 0
+
+  def __init__(self):
+    self.assignments = {} # zone: assignment
+    self.added = set() # zones added since the last detection
+    self.removed = [] # contiguous hinterland zones removed since the last detection
+    self.detected = False
+    self.stale = False
+  
+  @classmethod
+  def getCounts(cls):
+    '''Returns counts of full and incremental detections.'''
+    return cls.fullCount, cls.incrementalCount
+  
+  @classmethod
+  def resetCounts(cls):
+    cls.fullCount = 0
+    cls.incrementalCount = 0
+  
+  def add(self, assignment):
+    self.assignments[assignment.getZone()] = assignment
+    if self.detected:
+      self.added.add(assignment.getZone())
+  
+  def remove(self, assignment):
+    zone = assignment.getZone()
+    if self.assignments.get(zone) is assignment:
+      del self.assignments[zone]
+    if self.detected:
+      if zone in self.added:
+        self.added.discard(zone)
+      elif assignment.isCore():
+        self.stale = True
+      elif not assignment.isExclave():
+        self.removed.append(zone)
+  
+  def isContiguous(self, zone):
+    '''Returns True if the zone is a known non-exclave zone of the region.'''
+    ass = self.assignments.get(zone)
+    return ass is not None and not ass.isExclave() and zone not in self.added
+  
+  def detect(self):
+    if not self.detected or self.stale or not self.keepsConnected():
+      self.detectAll()
+    else:
+      self.connectAdded()
+    self.added = set()
+    self.removed = []
+    self.detected = True
+    self.stale = False
+  
+  def detectAll(self):
+    queue = deque(zone for zone, ass in self.assignments.iteritems() if ass.isCore()) # not exclaves, searching their neighbours for more nonexclaves
+    connected = set(queue)
+    while queue:
+      for neigh in queue.popleft().getNeighbours():
+        if neigh in self.assignments and neigh not in connected:
+          connected.add(neigh)
+          queue.append(neigh)
+    # anything that remained unconnected is an exclave
+    for zone, ass in self.assignments.iteritems():
+      ass.setExclave(zone not in connected)
+    ExclaveTracker.fullCount += 1
+  
+  def keepsConnected(self):
+    '''Returns True if no removed zone has cut the region body.
+
+    Removed zones are taken in mutually adjacent clusters since a path to a core might have led through several of them.'''
+    removed = set(self.removed)
+    while removed:
+      cluster = [removed.pop()]
+      neighs = set()
+      for zone in cluster:
+        for neigh in zone.getNeighbours():
+          if neigh in removed:
+            removed.discard(neigh)
+            cluster.append(neigh)
+          elif self.isContiguous(neigh):
+            neighs.add(neigh)
+      if len(neighs) > 1 and not self.reaches(neighs.pop(), neighs):
+        return False
+    return True
+  
+  def reaches(self, start, targets):
+    '''Returns True if all targets are reachable from start through contiguous zones.'''
+    queue = deque([start])
+    seen = set(queue)
+    while queue and targets:
+      for neigh in queue.popleft().getNeighbours():
+        if neigh not in seen and self.isContiguous(neigh):
+          seen.add(neigh)
+          targets.discard(neigh)
+          queue.append(neigh)
+    return not targets
+  
+  def connectAdded(self):
+    '''Connects the added zones adjacent to the region body (and the exclaves and added zones contiguous with them) and marks the rest as exclaves.'''
+    queue = deque()
+    for zone in self.added:
+      if self.assignments[zone].isCore() or any(self.isContiguous(neigh) for neigh in zone.getNeighbours()):
+        queue.append(zone)
+    connected = set(queue)
+    while queue:
+      zone = queue.popleft()
+      self.assignments[zone].setExclave(False)
+      for neigh in zone.getNeighbours():
+        if neigh not in connected and (neigh in self.added or neigh in self.assignments and self.assignments[neigh].isExclave()):
+          connected.add(neigh)
+          queue.append(neigh)
+    for zone in self.added:
+      if zone not in connected:
+        self.assignments[zone].setExclave(True)
+    ExclaveTracker.incrementalCount += 1
+
+    
 class Region(RegionalUnit):
+  __slots__ = ('id', 'version', 'assignments', 'indepOverride', 'blockCut', 'exclaveTracker', '_mass')
+
   def __init__(self, id):
     RegionalUnit.__init__(self, id)
     self.assignments = []
     self.indepOverride = False
-    self.articulations = None
+    self.blockCut = None
+    self.exclaveTracker = ExclaveTracker()
     self._mass = 0
   
   def setID(self, id):
@@ -1134,17 +2008,23 @@ class Region(RegionalUnit):
     return bool(self.assignments)
   
   def addAssignment(self, assignment):
-    '''Adds the assignment, updates the mass and resets the articulation point list.'''
+    '''Adds the assignment, updates the mass and the articulation structure.'''
     self.assignments.append(assignment)
     self._addMass(assignment)
-    self.articulations = None
+    if self.blockCut is not None and not self.blockCut.attach(assignment):
+      self.blockCut = None
+    self.exclaveTracker.add(assignment)
+    self.bumpVersion()
 
   def removeAssignment(self, assignment):
-    '''Removes the assignment, updates the mass and resets the articulation point list.'''
+    '''Removes the assignment, updates the mass and the articulation structure.'''
     if assignment in self.assignments:
       self.assignments.remove(assignment)
       self._subMass(assignment)
-      self.articulations = None
+      if self.blockCut is not None and not self.blockCut.detach(assignment):
+        self.blockCut = None
+      self.exclaveTracker.remove(assignment)
+      self.bumpVersion()
     else:
       pass # throw error if invalid?
   
@@ -1160,95 +2040,26 @@ class Region(RegionalUnit):
   # expects: zone in self.getContiguousZones()
   def getArticulation(self, zone):
     '''Returns a list of biconnected hinterland components that zone separates from the region core, None if no such components exist.'''
-    if zone.isInRegion(self): # splitting zone from self
-      if self.articulations is None:
-        self.articulations = self.calcArticulations()
-      if zone in self.articulations:
-        return self.articulations[zone]
-      else:
-        return None
+    blockCut = self.getBlockCut()
+    if blockCut.contains(zone): # splitting zone from self
+      separated = blockCut.separated(zone)
     else: # adding zone to self
-      excl = self.getExclaves()
-      if excl: # must also be a contiguous zone
-        connected = [zone]
-        for exc in excl:
-          for conn in connected:
-            if exc.hasNeighbour(conn):
-              connected.append(exc)
-        del connected[0]
-        if connected:
-          return [connected]
-        else:
-          return None
-      else:
-        return None
+      joined = blockCut.joined(zone)
+      separated = [joined] if joined else []
+    return separated if separated else None
   
   def getArticulations(self):
-    if self.articulations is None:
-      self.articulations = self.calcArticulations()
-    return self.articulations
-  
-  def calcArticulations(self):
-    '''Calculates region articulation points - zones that would cause some other hinterland zones of the region to become exclaves.'''
-    if not self.assignments: return []
-    artic = defaultdict(list) # articulation points and portions they hide from the start zone
-    togo = [] # DFS stack
-    ins = {} # enter time of DFS
-    lows = {} # lowpoint function
-    neighs = {} # neighbourhood list
-    children = defaultdict(list) # DFS tree children of given zones
-    # find start zone and load neighbour matrix
-    for ass in self.assignments:
-      if not ass.isExclave():
-        zone = ass.getZone()
-        if not togo: togo.append(zone)
-        neighs[zone] = [neigh for neigh in zone.getNeighbours() if
-            neigh is not exterior and neigh.isInContiguousRegion(self)]
-    # start DFS
-    root = togo[-1]
-    counter = 0
-    while togo:
-      now = togo[-1]
-      if now not in ins: # enter vertex
-        ins[now] = counter
-        lows[now] = counter
-        counter += 1
-      for neigh in neighs[now]: # add all unvisited neighbours to stack
-        if neigh not in ins:
-          children[now].append(neigh)
-          togo.append(neigh)
-          break
-      else: # exit vertex (if no unvisited neighbours found)
-        if now is not root: # root has different articulation procedures
-          counter += 1
-          for neigh in neighs[now]: # all have been visited; update lowpoint
-            if lows[neigh] < lows[now]:
-              lows[now] = lows[neigh]
-          for neigh in neighs[now]: # check if neigh is articulation
-            if lows[neigh] >= ins[now]:
-              for sub in artic[now]:
-                if neigh in sub:
-                  break
-              else:
-                artic[now].append(self.subtree(children, neigh)) # get what neigh separates from now
-            elif now not in children[neigh] and lows[now] > ins[neigh]:
-              lows[now] = ins[neigh]
-        del togo[-1]
-    for child in children[root][1:]: # if root has 2+ children, it is articulation
-      artic[now].append(self.subtree(children, child))
-    # if artic:
-      # common.debug('articulation of %s detected: %s' % (self, artic))
-    return artic
+    blockCut = self.getBlockCut()
+    return dict((zone, blockCut.separated(zone)) for zone in blockCut.articulations())
   
-  @staticmethod
-  def subtree(children, root):
-    stack = [root]
-    tree = set()
-    while stack:
-      now = stack.pop()
-      tree.add(now)
-      stack.extend(children[now])
-    return tree
+  def getBlockCut(self):
+    '''Returns the articulation structure of the region, building it if it has been invalidated.'''
+    if self.blockCut is None:
+      self.blockCut = BlockCutIndex(self.assignments)
+    return self.blockCut
+  
+  def resetBlockCut(self):
+    self.blockCut = None
     
   def hasOverride(self):
     return self.indepOverride
@@ -1268,19 +2079,7 @@ class Region(RegionalUnit):
   
   def detectExclaves(self):
     '''Detects zones that are not contiguous with the main region body (any contiguous part of the region containing at least one core is considered a region body).'''
-    queue = deque(self.getCoreZones()) # not exclaves, searching their neighbours for more nonexclaves
-    noconn = set(self.getAllHinterlandZones()) # yet to be connected
-    while queue:
-      examined = queue.popleft()
-      for neigh in examined.getNeighbours():
-        if neigh is not exterior and neigh.isInRegion(self) and neigh in noconn:
-          noconn.remove(neigh)
-          queue.append(neigh)
-    # anything that remained in noconn is an exclave
-    # if noconn:
-      # common.debug('exclaves detected at %s: %s' % (self, noconn))
-    for zone in noconn:
-      zone.setAssignmentExclave(self)
+    self.exclaveTracker.detect()
   
   def getExclaves(self):
     '''Returns zones that are exclaves of this region.'''
@@ -1325,6 +2124,8 @@ class Region(RegionalUnit):
     
     
 class PlainRegion(Region):
+  __slots__ = ()
+
   def __init__(self, zone):
     Region.__init__(self, zone.getID())
     self._resetMass()
@@ -1346,6 +2147,8 @@ class PlainRegion(Region):
     
     
 class StaticRegion(Region):
+  __slots__ = ('rigidUnit', 'flexibleUnit', '_secmass', '_location')
+
   def __init__(self, zone, id):
     self.rigidUnit = zone.getRigidUnit()
     Region.__init__(self, id)
@@ -1419,6 +2222,7 @@ class StaticRegion(Region):
 # a functional region with a number of cores (usually one) and a hinterland
 class FunctionalRegion(Region):
   '''A multicore region to which the zones may belong only to a certain degree.'''
+  __slots__ = ('color', '_coremass', '_rawcoremass', '_flowSums', '_flowVectors', '_flowCounts', '_intraSums', '_zoneParts')
   interactionClass = Interactions
 
   def __init__(self, coreZone):
@@ -1426,10 +2230,20 @@ class FunctionalRegion(Region):
     Region.__init__(self, coreZone.getID()) 
     self._coremass = 0
     self._rawcoremass = 0 # a true mass of the core zones (no membership correction) for discriminating between zero-EMW regions
+    self._resetFlows()
     Assignment(coreZone, self, core=True).tangle()
     zoneColor = coreZone.getColor()
     self.color = colors.BLACK_RGB if zoneColor is None else zoneColor
 
+  def addAssignment(self, assignment):
+    Region.addAssignment(self, assignment)
+    self._updateFlows(assignment, 1)
+
+  def removeAssignment(self, assignment):
+    if assignment in self.assignments:
+      Region.removeAssignment(self, assignment)
+      self._updateFlows(assignment, -1)
+
   def _addMass(self, assignment):
     '''Updates the mass with the mass of an assignment.'''
     mass = assignment.getMass()
@@ -1437,7 +2251,6 @@ class FunctionalRegion(Region):
     if assignment.isCore():
       self._coremass += mass
       self._rawcoremass += assignment.getZone().getMass()
-    self._inflows = None
       
   def _subMass(self, assignment):
     '''Updates the mass with the mass of an assignment.'''
@@ -1446,14 +2259,63 @@ class FunctionalRegion(Region):
     if assignment.isCore():
       self._coremass -= mass
       self._rawcoremass -= assignment.getZone().getMass()
-    self._inflows = None
   
   def _resetMass(self):
     self._mass = 0
     self._coremass = 0
     self._rawcoremass = 0
-    self._inflows = None
-    
+
+  def _resetFlows(self):
+    '''Initializes the running flow totals of the region parts (core - 0, hinterland - 1).
+
+    For each side (outflows - 0, inflows - 1) and part, stores the sum of all flows of the part's zones (including raw flows) and their flows summed by target (own flows, including targets inside the region) with a count of contributing zones for each target. Also stores sums of flows between each pair of parts, determined from the parts of the zones as recorded by the region.'''
+    self._flowSums = [[0, 0], [0, 0]]
+    self._flowVectors = [[self.interactionClass(), self.interactionClass()], [self.interactionClass(), self.interactionClass()]]
+    self._flowCounts = [[defaultdict(int), defaultdict(int)], [defaultdict(int), defaultdict(int)]]
+    self._intraSums = [[0, 0], [0, 0]]
+    self._zoneParts = {}
+
+  def _updateFlows(self, assignment, sign):
+    '''Adds (sign 1) or subtracts (sign -1) flows of the assignment's zone to or from the running flow totals. Works in time proportional to the number of the zone's flows.'''
+    if assignment.isCore():
+      part = 0
+    elif assignment:
+      part = 1
+    else:
+      return # oscillating zones do not count as a part of the region
+    zone = assignment.getZone()
+    if sign > 0:
+      self._zoneParts[zone] = part
+    for side, flows in enumerate((zone.getOutflows(), zone.getInflows())):
+      self._flowSums[side][part] = self._flowSums[side][part] + sign * flows.sum()
+      vector = self._flowVectors[side][part]
+      counts = self._flowCounts[side][part]
+      vector.raw = vector.raw + sign * flows.raw
+      for target, strength in flows.iteritems():
+        vector[target] = vector[target] + sign * strength
+        counts[target] += sign
+        if not counts[target]:
+          del vector[target], counts[target]
+        if target in self._zoneParts and (side == 0 or target is not zone): # flows to itself counted once
+          fromPart, toPart = (part, self._zoneParts[target]) if side == 0 else (self._zoneParts[target], part)
+          self._intraSums[fromPart][toPart] = self._intraSums[fromPart][toPart] + sign * strength
+      vector._summed = False
+    if sign < 0:
+      del self._zoneParts[zone]
+
+  def _parts(self, core, hinter):
+    return ((0, ) if core else ()) + ((1, ) if hinter else ())
+
+  def _ownFlows(self, side, core, hinter):
+    '''Returns own flows (including flows to the region itself) of given parts of the region from the running totals.'''
+    parts = self._parts(core, hinter)
+    if not parts:
+      return self.interactionClass()
+    flows = self._flowVectors[side][parts[0]].copy()
+    for part in parts[1:]:
+      flows += self._flowVectors[side][part]
+    return flows
+
   def getHinterlandMass(self):
     return (self._mass - self._coremass)
   
@@ -1502,11 +2364,13 @@ class FunctionalRegion(Region):
     for ass in self.assignments:
       ass.computeDegree(memName)
       self._addMass(ass)
+    self.bumpVersion()
   
   def updateMass(self):
     self._resetMass()
     for ass in self.assignments:
       self._addMass(ass)
+    self.bumpVersion()
 
   # def getBezakSC(self):
     # return self.getIntraflows().sum() / float(self.getMutualFlows())
@@ -1518,22 +2382,11 @@ class FunctionalRegion(Region):
   def getOutflows(self, core=True, hinter=True, own=False):
     '''Returns outflows from given parts of the region out of the region.'''
     # oscilacni zony se nepocitaji jako region...
-    src = (self.getCoreZones() if core else []) + (self.getHinterlandZones() if hinter else [])
-    # common.debug(self, core, hinter, src)
-    # common.debug(self.interactionClass.outflowsFrom(src))
-    # common.debug(self.interactionClass.outflowsFrom(src).exclude(self.getZones()))
-    outfl = self.interactionClass.outflowsFrom(src)
+    outfl = self._ownFlows(0, core, hinter)
     return outfl if own else outfl.exclude(self.getZones())
 
-  def getInflows(self, **kwargs):
-    if self._inflows is None or kwargs != self._lastInflowKWArgs:
-      self._inflows = self._getInflows(**kwargs)
-      self._lastInflowKWArgs = kwargs
-    return self._inflows
-
-  def _getInflows(self, core=True, hinter=True, own=False):
-    zones = (self.getCoreZones() if core else []) + (self.getHinterlandZones() if hinter else [])
-    infl = self.interactionClass.inflowsTo(zones)
+  def getInflows(self, core=True, hinter=True, own=False):
+    infl = self._ownFlows(1, core, hinter)
     return infl if own else infl.exclude(self.getZones())
   
   def getMutualFlows(self, core=True, hinter=True, own=False):
@@ -1543,10 +2396,50 @@ class FunctionalRegion(Region):
   def getIntraflows(self, fromCore=True, fromHinter=True, toCore=True, toHinter=True):
     '''Returns outflows from given parts of the region into the region.'''
     # oscilacni zony se nepocitaji jako region...
-    fromZones = (self.getCoreZones() if fromCore else []) + (self.getHinterlandZones() if fromHinter else [])
     toZones = (self.getCoreZones() if toCore else []) + (self.getHinterlandZones() if toHinter else [])
-    return self.interactionClass.outflowsFrom(fromZones).restrict(toZones)
-  
+    return self._ownFlows(0, fromCore, fromHinter).restrict(toZones)
+  
+  def iterOwnFlows(self, out=True, core=True, hinter=True):
+    '''Iterates over own flows (including flows to the region itself) of given parts of the region as (target, strength) pairs without copying them. A target may occur once for each part.'''
+    side = 0 if out else 1
+    for part in self._parts(core, hinter):
+      for item in self._flowVectors[side][part].iteritems():
+        yield item
+
+  def getOwnFlowSum(self, out=True, core=True, hinter=True):
+    '''Returns a sum of own flows (including flows to the region itself and raw flows) of given parts of the region.'''
+    side = 0 if out else 1
+    total = 0
+    for part in self._parts(core, hinter):
+      total = total + self._flowSums[side][part]
+    return total
+
+  def getOutflowSum(self, core=True, hinter=True):
+    '''Returns a sum of outflows from given parts of the region out of the region (including raw outflows).'''
+    total = 0
+    for part in self._parts(core, hinter):
+      total = total + self._flowSums[0][part] - self._intraSums[part][0] - self._intraSums[part][1]
+    return total
+
+  def getInflowSum(self, core=True, hinter=True):
+    '''Returns a sum of inflows to given parts of the region from outside the region (including raw inflows).'''
+    total = 0
+    for part in self._parts(core, hinter):
+      total = total + self._flowSums[1][part] - self._intraSums[0][part] - self._intraSums[1][part]
+    return total
+
+  def getMutualFlowSum(self, core=True, hinter=True):
+    return self.getInflowSum(core=core, hinter=hinter) + self.getOutflowSum(core=core, hinter=hinter)
+
+  def getIntraflowSum(self, fromCore=True, fromHinter=True, toCore=True, toHinter=True):
+    '''Returns a sum of flows from given parts of the region into given parts of the region. As with getIntraflows(), raw outflows of the source parts are included.'''
+    total = 0
+    for fromPart in self._parts(fromCore, fromHinter):
+      total = total + self._flowVectors[0][fromPart].raw
+      for toPart in self._parts(toCore, toHinter):
+        total = total + self._intraSums[fromPart][toPart]
+    return total
+
   # def getCoreHintFlows(self):
     # '''Returns flows from core to hinterland.'''
     # return self._getIntraflows(fromHinter=False, toCore=False)
@@ -1556,7 +2449,7 @@ class FunctionalRegion(Region):
     # return self._getIntraflows(fromCore=False, toHinter=False)
   
   def getFlowSum(self):
-    return sum(zone.getOutflows().sum() for zone in self.getZones())
+    return self._flowSums[0][0] + self._flowSums[0][1]
   
   def getEMWDiff(self, zone):
     '''Returns a difference in region EMW the reassignment of zone into/out of the region would make.'''
@@ -2557,7 +3450,7 @@ class RegionMeasurer:
   # MEASUREMENT METHODS
   @classmethod
   def hamplRegionIntegrity(cls, object):
-    outsum = object.getOutflows().sum()
+    outsum = object.getOutflowSum()
     if outsum:
       return cls.coreHintMutualFlowSum(object) / float(outsum) # i1+i2/d1+d2
     else:
@@ -2565,7 +3458,7 @@ class RegionMeasurer:
   
   @staticmethod
   def hamplHinterlandIntegrity(object):
-    outsum = object.getOutflows(core=False, hinter=True).sum()
+    outsum = object.getOutflowSum(core=False, hinter=True)
     if outsum:
       return object.getHintCoreFlows().sum() / float(outsum) # i1/d1
     else:
@@ -2577,7 +3470,7 @@ class RegionMeasurer:
 
   @staticmethod
   def bezakSelfContainment(object):
-    return object.getIntraflows().sum() / float(object.getMutualFlows().sum())
+    return object.getIntraflowSum() / float(object.getMutualFlowSum())
 
   @classmethod
   def coombesSelfContainment(cls, object):
@@ -2591,13 +3484,13 @@ class RegionMeasurer:
 
   @staticmethod
   def residenceSelfContainment(object):
-    intra = object.getIntraflows().sum()
-    return intra / float(intra + object.getOutflows().sum())
+    intra = object.getIntraflowSum()
+    return intra / float(intra + object.getOutflowSum())
   
   @staticmethod
   def workplaceSelfContainment(object):
-    intra = object.getIntraflows().sum()
-    return intra / float(intra + object.getInflows().sum())
+    intra = object.getIntraflowSum()
+    return intra / float(intra + object.getInflowSum())
   
   @staticmethod
   def emw(object):
@@ -2609,23 +3502,23 @@ class RegionMeasurer:
   
   @staticmethod
   def intraFlowSum(object):
-    return object.getIntraflows().sum()
+    return object.getIntraflowSum()
   
   @staticmethod
   def coreHintMutualFlowSum(object):
-    return (object.getIntraflows(fromHinter=False, toCore=False).sum() + object.getIntraflows(toHinter=False, fromCore=False).sum())
+    return (object.getIntraflowSum(fromHinter=False, toCore=False) + object.getIntraflowSum(toHinter=False, fromCore=False))
   
   @staticmethod
   def outflowSum(object):
-    return object.getOutflows().sum()
+    return object.getOutflowSum()
   
   @staticmethod
   def inflowSum(object):
-    return object.getInflows().sum()
+    return object.getInflowSum()
   
   @staticmethod
   def mutualFlowSum(object):
-    return object.getMutualFlows().sum()
+    return object.getMutualFlowSum()
   
 RegionMeasurer.measureMethods = {'HAM_IR' : RegionMeasurer.hamplRegionIntegrity, 'HAM_IZ' : RegionMeasurer.hamplHinterlandIntegrity, 'HAM_SIG' : RegionMeasurer.hinterlandSignificance, 'COO_SC' : RegionMeasurer.coombesSelfContainment, 'BEZ_SC' : RegionMeasurer.bezakSelfContainment, 'RB_SC' : RegionMeasurer.residenceSelfContainment, 'WB_SC' : RegionMeasurer.workplaceSelfContainment, 'FMW' : RegionMeasurer.fmw, 'EMW' : RegionMeasurer.emw, 'R_INTRA_SUM' : RegionMeasurer.intraFlowSum, 'R_C_H_SUM' : RegionMeasurer.coreHintMutualFlowSum, 'R_OUT_SUM' : RegionMeasurer.outflowSum, 'R_IN_SUM' : RegionMeasurer.inflowSum, 'R_BOTH_SUM' : RegionMeasurer.mutualFlowSum}
   
\ No newline at end of file
@@ -0,0 +1,189 @@
+'''Instrumentation of regionalization runs.
+
+A Profiler attached to a regionalizer records wall time and call counts of the algorithm stages, of the elements (grouped by their type) and of selected hot methods, and the net change in the number of objects tracked by the garbage collector during each stage. The methods are only wrapped while the stages run with the profiler attached, so runs without a profiler are not slowed down at all.
+
+The records can be saved as JSON and as collapsed stacks (one line of semicolon-separated frames and self time in microseconds per call path) that flame graph tools such as flamegraph.pl or speedscope read.'''
+
+import gc, json, inspect, collections, timeit
+import common, objects, regionalization
+
+# element type, base class and the methods timed for its elements
+ELEMENT_METHODS = [
+  ('aggregator', regionalization.Aggregator, ('feed', 'next', 'aggregate', 'update', 'fail', 'findZoneTarget', 'findRegionTarget', 'findScoredTarget', 'getAggregationTarget')),
+  ('fuzzier', regionalization.Fuzzier, ('update', 'updateAll', 'updateByChange')),
+  ('verifier', regionalization.Verifier, ('initThreshold', 'verify')),
+  ('merger', regionalization.Merger, ('run', 'single')),
+  ('destroyer', regionalization.Destroyer, ('run', )),
+  ('changer', regionalization.Changer, ('optimizer', 'enlarger', 'getAllChanges', 'getAffectedChanges')),
+  ('halter', regionalization.Halter, ('halt', )),
+  ('output', regionalization.OutputElement, ('run', ))]
+SORTER_ATTRIBUTES = ('sorter', 'secondary')
+SORTER_METHODS = ('sort', 'key', 'max')
+# hot methods of the regional objects and aggregation queues (created during the stages), timed for all their instances
+CLASS_METHODS = [
+  (objects.BlockCutIndex, '__init__', 'articulations.build', 'object'),
+  (objects.Region, 'detectExclaves', 'exclaves.detect', 'object'),
+  (regionalization.AggregationQueue, 'extend', 'queue.extend', 'queue'),
+  (regionalization.AggregationQueue, 'update', 'queue.update', 'queue'),
+  (regionalization.AggregationQueue, 'pop', 'queue.pop', 'queue'),
+  (regionalization.AggregationQueue, '_rekey', 'queue.rekey', 'queue')]
+STAGE_CATEGORY = 'stage'
+
+timer = timeit.default_timer
+
+
+class Profiler:
+  def __init__(self):
+    self.stack = [] # [label, category, start, child seconds]
+    self.active = collections.Counter() # labels and categories on the stack
+    self.frames = collections.defaultdict(lambda: [0, 0.0, 0.0]) # label: [calls, seconds, self seconds]
+    self.categories = collections.defaultdict(lambda: [0, 0.0]) # category: [calls, seconds]
+    self.paths = collections.defaultdict(float) # call path: self seconds
+    self.stages = []
+    self.wrapped = [] # (object, method name, original attribute or None)
+
+  def enter(self, label, category=None):
+    self.active[label] += 1
+    if category:
+      self.active[category] += 1
+    self.stack.append([label, category, timer(), 0.0])
+
+  def exit(self):
+    end = timer()
+    path = tuple(frame[0] for frame in self.stack)
+    label, category, start, childSeconds = self.stack.pop()
+    seconds = end - start
+    if self.stack:
+      self.stack[-1][3] += seconds
+    frame = self.frames[label]
+    frame[0] += 1
+    frame[2] += seconds - childSeconds
+    self.paths[path] += seconds - childSeconds
+    self.active[label] -= 1
+    if not self.active[label]: # recursive calls are only counted once in the inclusive time
+      frame[1] += seconds
+    if category:
+      self.active[category] -= 1
+      counts = self.categories[category]
+      counts[0] += 1
+      if not self.active[category]:
+        counts[1] += seconds
+    return seconds
+
+  def attach(self, regionalizer):
+    '''Wraps the stages, elements and hot methods of the regionalizer to be timed.'''
+    done = set()
+    for stage in regionalizer.stages:
+      self.wrapStage(stage)
+      for elName in stage.ELEMENT_TYPES:
+        element = getattr(stage, elName, None)
+        if element is not None and id(element) not in done:
+          done.add(id(element))
+          self.wrapElement(element, stage, done)
+    for cls, name, label, category in CLASS_METHODS:
+      self.wrap(cls, name, label, category, unbound=True)
+
+  def detach(self):
+    '''Restores the wrapped methods.'''
+    while self.wrapped:
+      target, name, original = self.wrapped.pop()
+      if original is None:
+        delattr(target, name)
+      else:
+        setattr(target, name, original)
+
+  def wrapStage(self, stage):
+    original = stage.run
+    label = 'stage {}: {}'.format(stage.getNo(), stage.message)
+    def run(*args, **kwargs):
+      objectCount = len(gc.get_objects())
+      self.enter(label, STAGE_CATEGORY)
+      try:
+        return original(*args, **kwargs)
+      finally:
+        seconds = self.exit()
+        self.stages.append({'stage' : label, 'seconds' : seconds, 'objects' : len(gc.get_objects()) - objectCount})
+    self.wrapped.append((stage, 'run', None))
+    stage.run = run
+
+  def wrapElement(self, element, stage, done):
+    name = self.elementName(element, stage)
+    for category, baseClass, methods in ELEMENT_METHODS:
+      if isinstance(element, baseClass):
+        for method in methods:
+          self.wrap(element, method, '{}:{}.{}'.format(category, name, method), category)
+    for attribute in SORTER_ATTRIBUTES:
+      sorter = getattr(element, attribute, None)
+      if isinstance(sorter, regionalization.Sorter) and id(sorter) not in done:
+        done.add(id(sorter))
+        for method in SORTER_METHODS:
+          self.wrap(sorter, method, 'sorter:{}.{}'.format(name, method), 'sorter')
+
+  @staticmethod
+  def elementName(element, stage):
+    for elName in stage.itemrefs:
+      if getattr(stage, elName, None) is element:
+        return stage.itemrefs[elName].getID()
+    return element.__class__.__name__
+
+  def wrap(self, target, name, label, category, unbound=False):
+    '''Replaces the method of the target by a timed one. If unbound is set, the target is a class whose own method is replaced for all its instances.'''
+    original = target.__dict__.get(name) if unbound else getattr(target, name, None)
+    if original is None:
+      return
+    isGenerator = inspect.isgeneratorfunction(original)
+    def wrapper(*args, **kwargs):
+      if isGenerator: # time every resumption of the generator
+        return self.iterate(label, category, original(*args, **kwargs))
+      self.enter(label, category)
+      try:
+        return original(*args, **kwargs)
+      finally:
+        self.exit()
+    self.wrapped.append((target, name, (original if unbound else None)))
+    setattr(target, name, wrapper)
+
+  def iterate(self, label, category, generator):
+    while True:
+      self.enter(label, category)
+      try:
+        item = next(generator)
+      except StopIteration:
+        return
+      finally:
+        self.exit()
+      yield item
+
+  def getSeconds(self):
+    return sum(stage['seconds'] for stage in self.stages)
+
+  def summary(self):
+    return {
+      'seconds' : self.getSeconds(),
+      'stages' : self.stages,
+      'elements' : {category : {'calls' : calls, 'seconds' : seconds} for category, (calls, seconds) in self.categories.iteritems()},
+      'frames' : {label : {'calls' : calls, 'seconds' : seconds, 'selfSeconds' : selfSeconds} for label, (calls, seconds, selfSeconds) in self.frames.iteritems()}}
+
+  def collapsed(self):
+    '''Returns the collapsed stack lines (frames separated by semicolons, self time in microseconds).'''
+    lines = []
+    for path, seconds in sorted(self.paths.iteritems()):
+      micros = int(round(seconds * 1e6))
+      if micros > 0:
+        lines.append('{} {}'.format(';'.join(label.replace(';', ',') for label in path), micros))
+    return lines
+
+  def writeJSON(self, path):
+    with open(path, 'w') as file:
+      json.dump(self.summary(), file, indent=2, sort_keys=True)
+
+  def writeCollapsed(self, path):
+    with open(path, 'w') as file:
+      for line in self.collapsed():
+        file.write(line + '\n')
+
+  def save(self, prefix):
+    '''Writes the records to prefix.json and the collapsed stacks to prefix.folded.'''
+    self.writeJSON(prefix + '.json')
+    self.writeCollapsed(prefix + '.folded')
+    common.message('Run profile written to {0}.json and {0}.folded ({1:.2f} s in stages)'.format(prefix, self.getSeconds()))
@@ -1,5 +1,5 @@
-import collections, operator
-import common, colors, loaders, stats
+import collections, operator, os
+import common, colors, loaders, stats, tracing
 from loaders import ConfigError
 import objects
 from objects import Region, Assignment
@@ -20,9 +20,6 @@ MASS_SORTER = operator.methodcaller('getMass')
 SECONDARY_MASS_SORTER = operator.methodcaller('getSecondaryMass')
 GAIN_SORTER = operator.methodcaller('getGain')
 
-DEBUG_FLOW = True
-# DEBUG_FLOW = False
-
 class Regionalizer:
   def __init__(self, regionFactory):
     self.elements = {}
@@ -30,6 +27,7 @@ class Regionalizer:
     self.regionFactory = regionFactory
     self.regionOverlaps = {} # optional output
     self.initDone = False
+    self.profiler = None
   
   def addElements(self, elements):
     for id in elements:
@@ -50,61 +48,96 @@ class Regionalizer:
         return True
     return False
 
-  def initRun(self, zones, presets=[]):
+  def colorsNeeded(self):
+    for item in self.elements.itervalues():
+      if isinstance(item, ZoneColoring):
+        return True
+    return False
+
+  def initRun(self, zones, presets=[], index=None):
+    SORT_KEYS.clear()
     self.zones = zones
     self.zones.sort(key=ID_SORTER)
+    self.index = loaders.IDIndex([zone.getID() for zone in self.zones]) if index is None else index
+    tracing.start(self.index)
     common.progress('creating regions')
-    self.regions = self.createRegions(self.zones)
     if presets:
-      self.current = AlgorithmStage('applying presets', 0)
-      self.current.reference([])
-      self.applyPresets(presets)
+      common.progress('applying presets')
+    self.regions = self.createRegions(self.zones, presets)
     self.initDone = True
   
   def run(self, zones, presets=[]):
     if not self.initDone:
-      self.initRun(zone, presets)
+      self.initRun(zones, presets)
     if not self.stages:
       raise ConfigError, 'no algorithm stage specified, aborting'
-    for stage in self.stages:
-      self.current = stage
-      self.current.run(self)
-      self.regions = self.recreateRegions()
+    self.runStages(self.stages)
   
   def postRun(self):
-    for stage in self.stages:
-      if isinstance(stage, OutputStage):
+    self.runStages([stage for stage in self.stages if isinstance(stage, OutputStage)])
+  
+  def runStages(self, stages):
+    if self.profiler:
+      self.profiler.attach(self)
+    try:
+      for stage in stages:
+        if tracing.active: tracing.decision(tracing.STAGE, stage.getNo())
         self.current = stage
         self.current.run(self)
         self.regions = self.recreateRegions()
-  
-  def createRegions(self, zones):
-    regions = []
-    for zone in zones: # region for each core zone
-      if zone.coreable:
-        regions.append(self.regionFactory(zone))
+    finally:
+      if self.profiler:
+        self.profiler.detach()
+  
+  def setProfiler(self, profiler):
+    '''Sets a profiling.Profiler to record the times spent in the stages, elements and hot methods of the runs.'''
+    self.profiler = profiler
+  
+  def getProfiler(self):
+    return self.profiler
+  
+  def createRegions(self, zones, presets=[]):
+    '''Creates a region for each coreable zone and assigns the preset zones to their preset regions. Zones preset to another region do not get a region of their own, so a previous solution given as presets (a warm start) is recreated in bulk; the stages then only aggregate the regions that do not pass the verifiers.'''
+    # zones are sorted by ID, so their positions are their codes; regions are found by the codes of their core zones
+    targets = self.presetTargets(presets)
+    seeds = set(target[0] for target in targets.itervalues() if target is not None)
+    regionsByCode = {}
+    for code in xrange(len(zones)): # region for each core zone
+      if zones[code].coreable and (code in seeds or code not in targets):
+        regionsByCode[code] = self.regionFactory(zones[code])
+    for zoneCode, target in sorted(targets.iteritems()):
+      zone = zones[zoneCode]
+      if target is None:
+        zone.deassign()
+        continue
+      targetReg = regionsByCode[target[0]]
+      if zone.getRegions() != [targetReg]: # current location is not desired
+        zone.deassign()
+        if tracing.active: tracing.decision(tracing.PRESET, zone, targetReg, (tracing.CORE if target[1] else 0))
+        Assignment(zone, targetReg, target[1]).tangle()
+    regions = [region for region in regionsByCode.itervalues() if region] # regions emptied by the presets are dropped
     regions.sort(key=ID_SORTER)
     return regions
   
-  def applyPresets(self, presets):
-    self.regions.sort(key=ID_SORTER)
+  def presetTargets(self, presets):
+    '''Returns the (region code, core state) targets of preset zones by their codes, None for presets to regions that are not allowed.'''
+    targets = {}
     for preset in presets:
-      zone = self.findBinaryByID(self.zones, preset.getZoneID())
-      targetReg = self.findBinaryByID(self.regions, preset.getRegionID())
-      if targetReg is None: # if the preset region is not valid
-        common.warning('{id} is not an allowed region ID, assignment of zone {zone} to it failed'.format(id=preset.getRegionID(), zone=zone.getID()))
-        zone.deassign()
+      zoneCode = self.index.get(preset.getZoneID())
+      if zoneCode is None:
+        common.warning('zone {} of a preset not found, preset ignored'.format(preset.getZoneID()))
+        continue
+      regionCode = self.index.get(preset.getRegionID())
+      if regionCode is None or not self.zones[regionCode].coreable: # if the preset region is not valid
+        common.warning('{id} is not an allowed region ID, assignment of zone {zone} to it failed'.format(id=preset.getRegionID(), zone=preset.getZoneID()))
+        targets[zoneCode] = None
       else:
-        currentRegions = zone.getRegions()
-        if currentRegions != [targetReg]: # current location is not desired
-          zone.deassign()
-          for reg in currentRegions:
-            if not reg: # remove region if it became empty
-              self.regions.remove(reg)
-          if DEBUG_FLOW:
-            state = 'core' if preset.getCoreState() else 'hinterland'
-            common.debug('Zone {zone} preset: {targetReg} ({state})'.format(**locals()))
-          self.current.tangleOne(Assignment(zone, targetReg, preset.getCoreState()))
+        targets[zoneCode] = (regionCode, preset.getCoreState())
+    return targets
+  
+  def getPresets(self):
+    '''Returns the current zone assignments as presets, to be used as a warm start of another run.'''
+    return [objects.AssignmentPreset(zone.getID(), zone.getRegionID(), zone.getCore() is not None) for zone in self.zones if zone.getRegion() is not None]
         
   def recreateRegions(self):
     regset = set(zone.getRegion() for zone in self.zones)
@@ -138,22 +171,6 @@ class Regionalizer:
   def getRegionOverlaps(self):
     return self.regionOverlaps
 
-  @staticmethod
-  def findBinaryByID(cont, id):
-    start = 0
-    end = len(cont)
-    while True:
-      i = (start + end) / 2
-      locID = cont[i].getID()
-      if locID == id:
-        return cont[i]
-      elif locID < id:
-        start = i
-      else:
-        end = i
-      if start == end:
-        return None
-  
   def getRegionFactory(self):
     return self.regionFactory
 
@@ -200,6 +217,7 @@ class Aggregator(SortingUser):
     self.warnFail = warnFail
     self.failRow = 0
     self.finalRound = False
+    self.queue = None
 
   def targetsRegions(self):
     return self.isRegional
@@ -208,12 +226,13 @@ class Aggregator(SortingUser):
     # for target in targets:
       # print target.getAssignments()
     # print targets
-    self.targets = targets
-    self.targets.sort(key=operator.methodcaller('getRawMass'))
+    targets.sort(key=operator.methodcaller('getRawMass'))
+    self.queue = AggregationQueue(self.sorter, self.descending)
+    self.queue.extend(targets)
     self.todo = []
 
   def next(self):
-    if not self.targets:
+    if not self.queue:
       if self.todo:
         # print self.todo, self.failRow, len(self.todo)
         if self.failRow >= len(self.todo):
@@ -221,14 +240,19 @@ class Aggregator(SortingUser):
             return None
           else:
             self.finalRound = True
-        self.targets.extend(self.todo)
+        self.queue.extend(self.todo)
         self.todo = []
       else:
         return None
-    common.debug(self.sorter)
-    self.sorter.sort(self.targets, reverse=(not self.descending))
-    common.debug(self.targets[-1:])
-    return self.targets.pop()
+    return self.queue.pop()
+  
+  def update(self, targets):
+    '''Notifies the aggregator that the targets' masses or flows might have changed.'''
+    if self.queue is not None:
+      self.queue.update(targets)
+  
+  def getQueue(self):
+    return self.queue
     
   def aggregate(self, candidate):
     ok = False
@@ -282,36 +306,40 @@ class FlowAggregator(Aggregator):
     return self.neighcon
     
   def aggregateZone(self, zone):
-    flows = self.indirectLinkage(self, zone, self.getFlowsForZone(zone))
     # print flows
     # if str(zone.getID()) == '576794':
       # common.debug(flows)
       # common.debug([tgt for tgt in flows.allOver(flows.max()).keys() if isinstance(tgt, Region)])
       # common.debug(self.secondary.max([tgt for tgt in flows.allOver(flows.max()).keys() if isinstance(tgt, Region)]))
     limitTo = (zone.getContiguousRegions() if self.finalRound and self.neighcon else None)
-    target = self.getAggregationTarget(flows, limitTo)
+    target = self.findZoneTarget(zone, limitTo)
     if target is None or self.neighcon and target not in zone.getContiguousRegions():
-      if DEBUG_FLOW: common.debug('{zone} not assigned'.format(**locals()))
+      if tracing.active: tracing.decision(tracing.ZONE_UNASSIGNED, zone)
       return None
     else:
-      if DEBUG_FLOW: common.debug('{zone}: {target}'.format(**locals()))
+      if tracing.active: tracing.decision(tracing.ZONE_ASSIGNED, zone, target)
       return Assignment(zone, target, False)
   
   def aggregateRegion(self, region):
     # if region.getID() == '508004':
       # self.detailed = True
-    flows = self.indirectLinkage(self, region, self.getFlowsForRegion(region))
     limitTo = (region.getContiguousRegions() if self.finalRound and self.neighcon else None)
     # if region.getID() == '508004':
       # common.debug(region, flows)
       # common.debug(region.getMutualFlows(hinter=self.useHinterlandFlows))
       # self.detailed = False
-    target = self.getAggregationTarget(flows, limitTo)
+    target = self.findRegionTarget(region, limitTo)
     if self.neighcon and target not in region.getContiguousRegions():
       target = None
-    if DEBUG_FLOW: common.debug('{region}: {target}'.format(**locals()))
+    if tracing.active: tracing.decision(tracing.REGION_AGGREGATED, region, target, tracing.REGIONAL)
     return self.assignmentsForRegion(region, target)
   
+  def findZoneTarget(self, zone, limitTo=None):
+    return self.getAggregationTarget(self.indirectLinkage(self, zone, self.getFlowsForZone(zone)), limitTo)
+  
+  def findRegionTarget(self, region, limitTo=None):
+    return self.getAggregationTarget(self.indirectLinkage(self, region, self.getFlowsForRegion(region)), limitTo)
+  
   def indirectLinkage(self, self2, object, flows):
     return self.toRegions(object, flows)
   
@@ -358,6 +386,64 @@ class ExhaustiveFlowAggregator(FlowAggregator):
     self.tryMerge = tryMerge
     self.transform = transform
     self.indirectLinkage = indirectLinkage
+    # direct linkage to regions does not need the flows to non-regional targets
+    self.linksDirectly = (getattr(indirectLinkage, 'im_func', indirectLinkage) is FlowAggregator.toRegions.im_func)
+    self.regionOf = operator.methodcaller('getCore' if self.targetCoreOnly else 'getRegion')
+
+  def findZoneTarget(self, zone, limitTo=None):
+    if self.linksDirectly:
+      return self.findScoredTarget(zone, limitTo)
+    else:
+      return FlowAggregator.findZoneTarget(self, zone, limitTo)
+  
+  def findRegionTarget(self, region, limitTo=None):
+    if self.linksDirectly:
+      return self.findScoredTarget(region, limitTo)
+    else:
+      return FlowAggregator.findRegionTarget(self, region, limitTo)
+  
+  def findScoredTarget(self, object, limitTo=None):
+    '''Finds the aggregation target in a single pass over the object's flows.
+
+    Equivalent to getAggregationTarget() on the transformed regional flows restricted to regions but does not build the intermediate flow dictionaries and transforms only the flows to regions.'''
+    scores = collections.defaultdict(int)
+    self.addRegionalScores(object, True, scores)
+    if self.bidirectional:
+      self.addRegionalScores(object, False, scores)
+    scores.pop(object, None)
+    if limitTo:
+      for region in set(scores).difference(limitTo):
+        del scores[region]
+    if not scores:
+      return None
+    best = max(scores.itervalues())
+    tops = [region for region, score in scores.iteritems() if score >= best]
+    if len(tops) == 1:
+      return tops[0]
+    else:
+      return self.secondary.max(tops)
+  
+  def addRegionalScores(self, object, out, scores):
+    '''Adds the object's flows in the given direction summed by target regions (or their cores) and transformed to the scores.'''
+    if isinstance(object, Region):
+      items = object.iterOwnFlows(out=out, hinter=self.useHinterlandFlows)
+      flowSum = object.getOwnFlowSum(out=out, hinter=self.useHinterlandFlows)
+    else:
+      flows = object.getOutflows() if out else object.getInflows()
+      items = flows.iteritems()
+      flowSum = flows.sum()
+    regional = collections.defaultdict(int)
+    for target, strength in items:
+      region = self.regionOf(target)
+      if region is not None:
+        regional[region] += strength
+    if self.transform:
+      flowSum = float(flowSum)
+      for region, strength in regional.iteritems():
+        scores[region] += self.transform(strength, flowSum, self.flowSumFor(region, out))
+    else:
+      for region, strength in regional.iteritems():
+        scores[region] += strength
 
   def getFlowsForZone(self, zone):
     flows = self.processFlows(zone.getOutflows(), out=True)
@@ -388,8 +474,9 @@ class ExhaustiveFlowAggregator(FlowAggregator):
     return regional
   
   def flowSumFor(self, target, out):
+    '''Returns a sum of the target's flows in the opposite direction, used as a transform denominator. Regional sums are maintained on their assignment changes, zone sums are cached by their flows.'''
     if isinstance(target, Region):
-      return (target.getInflows(hinter=self.useHinterlandFlows, own=True) if out else target.getOutflows(hinter=self.useHinterlandFlows, own=True)).sum()
+      return target.getOwnFlowSum(out=(not out), hinter=self.useHinterlandFlows)
     else:
       return (target.getInflows() if out else target.getOutflows()).sum()
   
@@ -480,10 +567,10 @@ class NeighbourhoodAggregator(Aggregator):
     contigs = item.getContiguousRegions()
     if contigs:
       target = self.secondary.max(contigs)
-      if DEBUG_FLOW: common.debug('{item} by neighbourhood: {target}'.format(**locals()))
+      if tracing.active: tracing.decision(tracing.NEIGHBOUR_ASSIGNED, item, target, (tracing.REGIONAL if isinstance(item, objects.Region) else 0))
       return [Assignment(item, target, False)]
     else:
-      if DEBUG_FLOW: common.debug('{item} by neighbourhood not assigned'.format(**locals()))
+      if tracing.active: tracing.decision(tracing.NEIGHBOUR_UNASSIGNED, item, None, (tracing.REGIONAL if isinstance(item, objects.Region) else 0))
       return [None]
   
   def getFailReason(self):
@@ -654,13 +741,13 @@ class Change:
   
   def assignment(self):
     '''Prepares the zone to be assigned to the target region and returns that assignment.'''
-    if DEBUG_FLOW: common.debug('Change %s' % self)
+    if tracing.active: tracing.decision(tracing.CHANGE, self.zone, self.target)
     self.zone.deassign()
     return Assignment(self.zone, self.target, core=False)
   
   def rollback(self):
     '''Prepares the zone to be assigned back to the source region (rollback the change) and returns that assignment.'''
-    if DEBUG_FLOW: common.debug('Rollback change %s' % self)
+    if tracing.active: tracing.decision(tracing.ROLLBACK, self.zone, self.source)
     self.zone.deassign()
     return Assignment(self.zone, self.source, core=False)
     
@@ -917,7 +1004,7 @@ class Merger(SortingUser): # OK, multiready
       return None
   
   def merge(self, master, slave):
-    if DEBUG_FLOW: common.debug('Merging {slave}: {master}'.format(**locals()))
+    if tracing.active: tracing.decision(tracing.MERGE, slave, master, tracing.REGIONAL)
     slave.dissolve()
     assig = []
     for core in slave.getCoreZones():
@@ -1014,7 +1101,7 @@ class Destroyer(RegionalizationElement): # OK, multiready
   def run(self, targets):
     for target in targets:
       if self.destroy(target):
-        if DEBUG_FLOW: common.debug('Destroying %s' % target)
+        if tracing.active: tracing.decision(tracing.DESTROY, target, None, (tracing.REGIONAL if self.isRegional else 0))
         if self.isRegional:
           target.erase()
         else:
@@ -1168,7 +1255,7 @@ class VerificationCriterion(Verifier):
   
   def initThreshold(self, objects):
     if self.value is None:
-      self.value = stats.genMode([self.getCriterionValue(obj) for obj in objects])
+      self.value = stats.genMode([SORT_KEYS.get(self.getCriterionValue, obj) for obj in objects])
     
   def verify(self, object):
     verif = self.getCriterionValue(object)
@@ -1238,7 +1325,7 @@ class RatioSelfContainmentCriterion(VerificationCriterion):
   @staticmethod
   def getCriterionValue(object):
     try:
-      return object.getIntraflows().sum() / float(object.getMutualFlows().sum())
+      return object.getIntraflowSum() / float(object.getMutualFlowSum())
     except ZeroDivisionError:
       return 0
   
@@ -1250,8 +1337,8 @@ class OutflowSelfContainmentCriterion(VerificationCriterion):
   
   @staticmethod
   def getCriterionValue(object):
-    intra = object.getIntraflows().sum()
-    outfl = object.getOutflows().sum()
+    intra = object.getIntraflowSum()
+    outfl = object.getOutflowSum()
     try:
       return intra / float(intra + outfl)
     except ZeroDivisionError:
@@ -1265,8 +1352,8 @@ class InflowSelfContainmentCriterion(VerificationCriterion):
   
   @staticmethod
   def getCriterionValue(object):
-    intra = object.getIntraflows().sum()
-    infl = object.getInflows().sum()
+    intra = object.getIntraflowSum()
+    infl = object.getInflowSum()
     try:
       return intra / float(intra + infl)
     except ZeroDivisionError:
@@ -1280,9 +1367,9 @@ class AveragedSelfContainmentCriterion(VerificationCriterion):
   
   @staticmethod
   def getCriterionValue(object):
-    intra = object.getIntraflows().sum()
-    infl = object.getInflows().sum()
-    outfl = object.getOutflows().sum()
+    intra = object.getIntraflowSum()
+    infl = object.getInflowSum()
+    outfl = object.getOutflowSum()
     try:
       return 0.5 * intra * (1 / float(intra + infl) + 1 / float(intra + outfl))
     except ZeroDivisionError:
@@ -1297,7 +1384,7 @@ class RegionIntegrityCriterion(VerificationCriterion):
   @staticmethod
   def getCriterionValue(object):
     try:
-      return (object.getIntraflows(fromHinter=False, toCore=False).sum() + object.getIntraflows(toHinter=False, fromCore=False).sum()) / float(object.getOutflows().sum())
+      return (object.getIntraflowSum(fromHinter=False, toCore=False) + object.getIntraflowSum(toHinter=False, fromCore=False)) / float(object.getOutflowSum())
     except ZeroDivisionError:
       return 0
 
@@ -1310,7 +1397,7 @@ class HinterlandIntegrityCriterion(VerificationCriterion):
   @staticmethod
   def getCriterionValue(object):
     try:
-      return object.getIntraflows(toHinter=False, fromCore=False).sum() / float(object.getOutflows(core=False).sum())
+      return object.getIntraflowSum(toHinter=False, fromCore=False) / float(object.getOutflowSum(core=False))
     except ZeroDivisionError:
       return 0
   
@@ -1426,10 +1513,10 @@ class AlgorithmStage(BaseStage):
     self.aggregator.feed(targets)
     candidate = self.aggregator.next()
     while candidate:
-      if self.halter and self.halter.halt(targets):
+      if self.halter and self.halter.halt(self.aggregator.getQueue()):
         break
       if self.isAggregable(candidate):
-        if DEBUG_FLOW: common.debug('{} aggregating'.format(candidate))
+        if tracing.active: tracing.decision(tracing.CANDIDATE, candidate, None, (tracing.REGIONAL if isinstance(candidate, objects.Region) else 0))
         if self.changer and self.aggregator.doTryChange() and self.tryEnlarge(candidate):
           continue
         if self.merger and self.aggregator.doTryMerge() and self.tryMerge(candidate):
@@ -1438,7 +1525,7 @@ class AlgorithmStage(BaseStage):
         if created:
           self.tangleMoreRegions(created)
       else:
-        if DEBUG_FLOW: common.debug('{} not aggregable'.format(candidate))
+        if tracing.active: tracing.decision(tracing.NOT_AGGREGABLE, candidate, None, (tracing.REGIONAL if isinstance(candidate, objects.Region) else 0))
       candidate = self.aggregator.next()
     if not self.halter:
       self.aggregator.fail()
@@ -1446,6 +1533,7 @@ class AlgorithmStage(BaseStage):
   def tangleOne(self, assignment):
     assignment.tangle()
     if self.fuzzier: self.fuzzier.update(assignment.getRegion())
+    self.updateTargets([assignment.getRegion()])
   
   def tangleRegion(self, listed):
     reg = None
@@ -1455,6 +1543,8 @@ class AlgorithmStage(BaseStage):
       assignment.tangle()
     if reg and self.fuzzier:
       self.fuzzier.update(reg)
+    if reg:
+      self.updateTargets([reg])
         
   def tangleMoreRegions(self, generator):
     regs = set()
@@ -1463,6 +1553,12 @@ class AlgorithmStage(BaseStage):
         assignment.tangle()
         regs.add(assignment.getRegion())
     if self.fuzzier: self.fuzzier.updateAll(regs)
+    self.updateTargets(regs)
+  
+  def updateTargets(self, changed):
+    '''Lets the aggregator re-sort the changed regions.'''
+    if self.aggregator:
+      self.aggregator.update(changed)
         
   def runMerge(self, targets):
     nowReg = None
@@ -1497,6 +1593,7 @@ class AlgorithmStage(BaseStage):
     while change:
       change.assignment().tangle()
       if self.fuzzier: self.fuzzier.updateByChange(change)
+      self.updateTargets(change.getAffected())
       generator.accept(change)
       if self.verifier.verify(region):
         break
@@ -1542,19 +1639,40 @@ class ElementReference:
   def __repr__(self):
     return '<{tag} {id}>'.format(tag=self.tag.capitalize(), id=self.id.upper())
       
+class SortKeyCache:
+  '''A cache of sort function values for regions and zones.
+
+  A value is recomputed only if the object's version (bumped on every change of its assignments or mass) differs from the version it was computed for. Objects without versions are not cached.'''
+
+  def __init__(self):
+    self.values = collections.defaultdict(dict)
+  
+  def get(self, function, obj):
+    if not hasattr(obj, 'getVersion'):
+      return function(obj)
+    version = obj.getVersion()
+    cached = self.values[function].get(obj)
+    if cached is None or cached[0] != version:
+      cached = (version, function(obj))
+      self.values[function][obj] = cached
+    return cached[1]
+  
+  def clear(self):
+    self.values.clear()
+
+SORT_KEYS = SortKeyCache()
+
 class Sorter:
   def __init__(self, function):
     self.function = function
-    self.catalog = {}
-    self.masses = collections.defaultdict(lambda: -1)
+    self.cache = SORT_KEYS
     
   def sort(self, objects, **kwargs):
-    for obj in objects:
-      mass = obj.getMass()
-      if self.masses[obj] != mass:
-        self.catalog[obj] = self.function(obj)
-        self.masses[obj] = mass
-    objects.sort(key=self.catalog.get, **kwargs)
+    objects.sort(key=self.key, **kwargs)
+  
+  def key(self, obj):
+    '''Returns the sort key of the object, recomputing it only if the object has changed.'''
+    return self.cache.get(self.function, obj)
   
   def max(self, objects, **kwargs):
     return max(objects, key=self.function, **kwargs)
@@ -1578,10 +1696,127 @@ class MultipleSorter(Sorter):
   
   def multiplyFunctionBuilder(self, fxs):
     def multiplyFunction(x):
-      common.debug(tuple(fx(x) for fx in fxs))
-      return reduce(operator.mul, ((1e-4 if val == 0 else val) for val in (fx(x) for fx in fxs)))
+      vals = tuple(SORT_KEYS.get(fx, x) for fx in fxs)
+      if tracing.detailed: tracing.detail('sort keys of {0}: {1}', x, vals)
+      return reduce(operator.mul, ((1e-4 if val == 0 else val) for val in vals))
     return multiplyFunction
   
+class AggregationQueue:
+  '''An indexed binary heap of aggregation candidates.
+
+  Pops the candidates in the same order as repeatedly stable-sorting them by the sorter and taking the last one would, but only re-keys the candidates reported as changed by update(). Each heap entry is a [key, rank, item] list where the rank emulates the position of the item among items with an equal key in the sorted list.'''
+
+  def __init__(self, sorter, descending):
+    self.sorter = sorter
+    self.descending = descending
+    self.heap = []
+    self.positions = {}
+    self.changed = set()
+    self.lowRank = 0
+    self.highRank = 0
+
+  def __len__(self):
+    return len(self.heap)
+  
+  def __nonzero__(self):
+    return bool(self.heap)
+  
+  def __contains__(self, item):
+    return item in self.positions
+
+  def extend(self, items):
+    '''Adds the items as if appended to the end of the list.'''
+    for item in items:
+      self.positions[item] = len(self.heap)
+      self.heap.append([self.sorter.key(item), self.highRank, item])
+      self.highRank += 1
+      self._siftUp(len(self.heap) - 1)
+  
+  def update(self, items):
+    '''Marks the items (if queued) to be re-keyed before the next pop.'''
+    for item in items:
+      if item in self.positions:
+        self.changed.add(item)
+  
+  def pop(self):
+    self._rekey()
+    top = self.heap[0]
+    last = self.heap.pop()
+    del self.positions[top[2]]
+    if self.heap:
+      self.heap[0] = last
+      self.positions[last[2]] = 0
+      self._siftDown(0)
+    return top[2]
+  
+  def _keyBefore(self, key1, key2):
+    '''Returns True if key1 is sorted before key2.'''
+    return (key1 < key2) if self.descending else (key2 < key1)
+  
+  def _compare(self, entry1, entry2):
+    '''Compares the entries by their position in the emulated sorted list.'''
+    if self._keyBefore(entry1[0], entry2[0]):
+      return -1
+    elif self._keyBefore(entry2[0], entry1[0]):
+      return 1
+    else:
+      return cmp(entry1[1], entry2[1])
+  
+  def _rekey(self):
+    '''Updates the keys of the changed items. An item whose key moves it past a group of items with the new key is ranked before (or after) the whole group, as a stable sort would place it.'''
+    if not self.changed: return
+    entries = sorted((self.heap[self.positions[item]] for item in self.changed), cmp=self._compare)
+    self.changed = set()
+    lower = []
+    higher = []
+    for entry in entries:
+      key = self.sorter.key(entry[2])
+      if self._keyBefore(entry[0], key):
+        lower.append(entry)
+      elif self._keyBefore(key, entry[0]):
+        higher.append(entry)
+      entry[0] = key
+    for entry in reversed(lower):
+      self.lowRank -= 1
+      entry[1] = self.lowRank
+    for entry in higher:
+      entry[1] = self.highRank
+      self.highRank += 1
+    for entry in entries:
+      self._siftDown(self._siftUp(self.positions[entry[2]]))
+  
+  def _swap(self, i, j):
+    heap = self.heap
+    heap[i], heap[j] = heap[j], heap[i]
+    self.positions[heap[i][2]] = i
+    self.positions[heap[j][2]] = j
+  
+  def _siftUp(self, i):
+    while i > 0:
+      parent = (i - 1) // 2
+      if self._compare(self.heap[i], self.heap[parent]) > 0:
+        self._swap(i, parent)
+        i = parent
+      else:
+        break
+    return i
+  
+  def _siftDown(self, i):
+    count = len(self.heap)
+    while True:
+      child = 2 * i + 1
+      if child >= count:
+        break
+      if child + 1 < count and self._compare(self.heap[child + 1], self.heap[child]) > 0:
+        child += 1
+      if self._compare(self.heap[child], self.heap[i]) > 0:
+        self._swap(i, child)
+        i = child
+      else:
+        break
+    return i
+  
+  
 class SetupReader(loaders.ConfigReader):
   CONTENT = 'file'
 
@@ -1606,21 +1841,28 @@ class RLSetupReader(SetupReader):
   VERSION = '1.1.0'
   ROOT_TAG_NAME = 'delimiterdata'
   CONTENT = 'data setup'
+  CONCURRENCY_TYPES = {'threads' : False, 'processes' : True}
   rootPath = ''
 
-  def __init__(self, parameters):
+  def __init__(self, parameters=tuple()):
     SetupReader.__init__(self, parameters)
     self.PATH_FACTORIES = {'absolute' : (lambda path, base: path), 'relative' : (lambda path, base: os.path.join(base, path))}
 
-  def create(self, file):
+  def create(self, file, regionalizer=None):
     self.baseread(file)
     self.rootPath = self.parsePath(self.dom.find('root-path'), base=os.path.dirname(file), require=False)
-    loader = loaders.RegionalLoader()
+    loader = loaders.RegionalLoader(regionalizer)
     zoneel = self.dom.find('zones')
-    loader.sourceOfZones(**self.parseLayerSetup(zoneel, name='zone'))
+    loader.sourceOfZones(targetClass=objects.MonoZone, **self.parseLayerSetup(zoneel, name='zone'))
     loader.sourceOfPresets(self.parseSlots(zoneel.find('presets')))
-    loader.possibleNeighbourhood(**self.parseLayerSetup(zoneel.find('neighbourhood'), require=False))
+    loader.possibleNeighbourhood(**self.parseLayerSetup(zoneel.find('neighbourhood'), name='neighbourhood', require=False))
     loader.sourceOfInteractions(**self.parseLayerSetup(self.dom.find('interactions'), name='interaction', require=False))
+    snapshotPath = self.parsePath(self.dom.find('snapshot'), name='snapshot')
+    if snapshotPath:
+      loader.useSnapshot(snapshotPath)
+    concurrentEl = self.dom.find('concurrent-load')
+    if concurrentEl is not None:
+      loader.useConcurrentLoad(processes=self.typeGet(concurrentEl, self.CONCURRENCY_TYPES))
     return loader
   
   def parseLayerSetup(self, elem, name, require=True):
@@ -1934,11 +2176,22 @@ class DRSetupReader(SetupReader):
 def getMainParamCount(): return 26
 def getFileParamCount(): return 14
 
-def run(regionalizer, loader, delimit=True):
-  loader.load()
-  if delimit:
-    regionalizer.run(loader.getZoneList())
+def run(regionalizer, loader, delimit=True, profile=None, trace=None):
+  if profile:
+    import profiling
+    regionalizer.setProfiler(profiling.Profiler())
+  if trace:
+    tracing.record(trace)
+  try:
+    loader.load()
+    if delimit:
+      regionalizer.run(loader.getZoneList())
+  finally:
+    if trace:
+      tracing.stop()
   loader.output(regionalizer)
+  if profile:
+    regionalizer.getProfiler().save(profile)
   
 def runByParams(zoneLayer, zoneIDFld, zoneMassFld, zoneCoopFld='', zoneRegFld='', zoneColFld='', coreQuery='', outRegFld='R', doOutCoreStr='true', doOutColorStr='false', outOverlapTable='', measureFldsStr='', interTable='', interFromIDFld='', interToIDFld='', interStrFld='', interLenFld='', neighTable='', algorithmFile='', *args, **kwargs):
   delimit = kwargs['delimit'] if 'delimit' in kwargs else False
@@ -1951,15 +2204,19 @@ def runByParams(zoneLayer, zoneIDFld, zoneMassFld, zoneCoopFld='', zoneRegFld=''
   loader.sourceOfInteractions(interTable, {'from' : interFromIDFld, 'to' : interToIDFld, 'value' : interStrFld})
   loader.possibleNeighbourhood(neighTable, exterior=False)
   setOutputs(loader, outRegFld, doOutCoreStr, doOutColorStr, measureFldsStr, outOverlapTable, delimit)
-  run(reg, loader, delimit=delimit)
+  run(reg, loader, delimit=delimit, profile=kwargs.get('profile'), trace=kwargs.get('trace'))
 
 def runByFile(inputsFile, algorithmFile, outRegFld='R', doOutCoreStr='true', doOutColorStr='false', measureFldsStr='', outOverlapTable='', *args, **kwargs):
   delimit = kwargs['delimit'] if 'delimit' in kwargs else False
   common.progress('loading delimiter setup')
   reg = DRSetupReader(parameters=[(None if not param else param) for param in args]).create(algorithmFile)
-  loader = loaders.RLSetupReader().create(inputsFile)
+  loader = RLSetupReader().create(inputsFile, reg)
+  if kwargs.get('concurrent'): # 'threads' or 'processes', overrides the data setup
+    if kwargs['concurrent'] not in RLSetupReader.CONCURRENCY_TYPES:
+      raise ValueError, 'unknown concurrent load type: ' + kwargs['concurrent']
+    loader.useConcurrentLoad(processes=RLSetupReader.CONCURRENCY_TYPES[kwargs['concurrent']])
   setOutputs(loader, outRegFld, doOutCoreStr, doOutColorStr, measureFldsStr, outOverlapTable, delimit)
-  run(reg, loader, delimit=delimit)
+  run(reg, loader, delimit=delimit, profile=kwargs.get('profile'), trace=kwargs.get('trace'))
   
 def setOutputs(loader, regFld, doOutCoreStr, doOutColorStr, measureFldsStr, outOverlapTable, delimit=True):
   loader.addZoneOutputSlot('assign', regFld, require=delimit)
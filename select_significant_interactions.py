@@ -1,6 +1,6 @@
 ## IMPORT MODULES
 import sys # basic
-import traceback
+import traceback, collections
 sys.path.append('.')
 import common, objects, loaders
 
@@ -10,13 +10,19 @@ if __name__ == '__main__':
     # common.message(common.parameters(14))
     interLayer, query, interFromIDFld, interToIDFld, interStrengthFld = common.parameters(5)
     inSlots = {'from' : interFromIDFld, 'to' : interToIDFld, 'value' : interStrengthFld}
-    outSlots = {'in' : 'SIG_IN', 'out' : 'SIG_OUT'}
-    common.progress('loading interactions')
-    inter = loaders.InteractionReader(interLayer, slots, where=query).read()
-    common.progress('selecting significant interactions')
-    signif = objects.Interactions.selectSignificant(inter)
-    common.progress('writing output')
-    loaders.InteractionPresenceMarker(interLayer, inSlots, outSlots, where=query).mark(signif)
+    if loaders.InteractionStreamer.canStream(interLayer):
+      presence = lambda inter: {target : 1 for target in inter.significant()}
+      loaders.InteractionGroupMarker(interLayer, inSlots, where=query).mark(collections.OrderedDict([
+        ('SIG_IN', ('in', presence, int)), ('SIG_OUT', ('out', presence, int))
+      ]), text='selecting significant interactions')
+    else:
+      outSlots = {'in' : 'SIG_IN', 'out' : 'SIG_OUT'}
+      common.progress('loading interactions')
+      inter = loaders.InteractionReader(interLayer, inSlots, where=query).read()
+      common.progress('selecting significant interactions')
+      signif = objects.Interactions.transform(inter, 'significant')
+      common.progress('writing output')
+      loaders.InteractionPresenceMarker(interLayer, inSlots, outSlots, where=query).mark(signif)
     common.done()
   except:
     common.message(traceback.format_exc())
@@ -0,0 +1,90 @@
+'''Binary snapshots of loaded regionalization inputs.
+
+A snapshot is an uncompressed NumPy .npz archive holding named columns of the loaded data (zone rows, matched interaction and neighbourhood arrays) together with a key describing the sources (paths, slots, where clauses and modification times) they were loaded from. The snapshot is only reused while the key matches.
+
+Columns with missing or mixed values are stored as the text of a Python list literal rather than as pickled object arrays, so that reading a snapshot never runs code from the file.'''
+
+import os, ast, json, zipfile, numpy
+import common
+
+FORMAT_VERSION = 2
+KEY_NAME = 'key'
+SEPARATOR = '__'
+LITERAL_MARK = '#' # suffix of the names of columns stored as list literals
+
+
+class Snapshot:
+  def __init__(self, path, sources):
+    self.path = path
+    self.key = json.dumps({'version' : FORMAT_VERSION, 'sources' : sources}, sort_keys=True)
+    self.arrays = {}
+
+  def load(self):
+    '''Loads the snapshot if its file exists and was created from the same sources. Returns whether it was loaded.'''
+    if not os.path.exists(self.path):
+      return False
+    try:
+      with numpy.load(self.path, allow_pickle=False) as data:
+        if KEY_NAME not in data.files or data[KEY_NAME].item() != self.key:
+          common.debug('snapshot {} outdated'.format(self.path))
+          return False
+        self.arrays = {}
+        for name in data.files:
+          if name.endswith(LITERAL_MARK):
+            self.arrays[name[:-len(LITERAL_MARK)]] = self.objectArray(ast.literal_eval(data[name].item()))
+          elif name != KEY_NAME:
+            self.arrays[name] = data[name]
+    except (IOError, ValueError, SyntaxError, zipfile.BadZipfile):
+      common.warning('snapshot {} could not be read, reloading sources'.format(self.path))
+      return False
+    return True
+
+  def save(self):
+    '''Writes the snapshot, replacing the file only when it has been written completely.'''
+    arrays = {KEY_NAME : numpy.array(self.key)}
+    for name, array in self.arrays.iteritems():
+      if array.dtype == object:
+        arrays[name + LITERAL_MARK] = numpy.array(repr(array.tolist()))
+      else:
+        arrays[name] = array
+    tmpPath = self.path + '.tmp'
+    with open(tmpPath, 'wb') as file:
+      numpy.savez(file, **arrays)
+    if os.path.exists(self.path):
+      os.remove(self.path)
+    os.rename(tmpPath, self.path)
+
+  def putColumns(self, name, columns):
+    for slot, values in columns.iteritems():
+      self.arrays[name + SEPARATOR + slot] = numpy.asarray(values)
+
+  def getColumns(self, name):
+    prefix = name + SEPARATOR
+    return {key[len(prefix):] : array for key, array in self.arrays.iteritems() if key.startswith(prefix)}
+
+  def putRows(self, name, rows):
+    '''Stores a list of dictionaries with identical keys as columns.'''
+    slots = rows[0].keys() if rows else []
+    self.putColumns(name, {slot : self.toArray([row[slot] for row in rows]) for slot in slots})
+    self.arrays[name + SEPARATOR] = numpy.array(len(rows))
+
+  def getRows(self, name):
+    columns = self.getColumns(name)
+    count = int(columns.pop('', 0))
+    slots = columns.keys()
+    values = [columns[slot].tolist() for slot in slots]
+    return [{slots[j] : values[j][i] for j in xrange(len(slots))} for i in xrange(count)]
+
+  @staticmethod
+  def toArray(values):
+    '''Converts the values to an array that gives them back unchanged by tolist(), resorting to an object array for missing or mixed values.'''
+    array = numpy.array(values)
+    if array.ndim != 1 or array.dtype.kind not in 'biufSU' or len(set(type(value) for value in values)) > 1:
+      array = Snapshot.objectArray(values)
+    return array
+
+  @staticmethod
+  def objectArray(values):
+    array = numpy.empty(len(values), dtype=object)
+    array[:] = values
+    return array
@@ -0,0 +1,836 @@
+'''Storage backends for the cursor layer of the loaders.
+
+A backend is selected for every dataset path. ArcGIS datasets are accessed through arcpy.da cursors; CSV files, SQLite database tables (given as a path inside the database file, such as data.sqlite/zones) and Parquet or Arrow files are read and written without ArcGIS, so the loaders can also run headless.
+All backends work with rows accessed by index (as lists or tuples of values in the order of the requested fields).'''
+
+import os, re, csv, sqlite3, numpy
+import common
+from common import arcpy
+
+CSV_EXTENSIONS = ('.csv', '.tsv')
+SQLITE_EXTENSIONS = ('.sqlite', '.sqlite3', '.db')
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+ARROW_EXTENSIONS = ('.arrow', '.feather', '.ipc')
+
+SQLITE_TYPES = {int : 'INTEGER', long : 'INTEGER', float : 'REAL', bool : 'INTEGER', str : 'TEXT', unicode : 'TEXT'}
+SQLITE_OID_FIELD = 'OBJECTID'
+# placeholders of nulls in bulk reads of ArcGIS fields, replaced by None afterwards
+ARCPY_NULL_VALUES = {'Integer' : -2147483648, 'SmallInteger' : -32768, 'OID' : -2147483648, 'Double' : numpy.nan, 'Single' : numpy.nan, 'String' : u'\x00'}
+
+for numpyType, pyType in ((numpy.int64, long), (numpy.int32, int), (numpy.float64, float), (numpy.float32, float), (numpy.bool_, bool)):
+  sqlite3.register_adapter(numpyType, pyType)
+
+NUMBER_WITH_LEADING_ZERO = re.compile(r'^[+-]?0\d') # codes such as 00123 are kept as text
+WHERE_TOKEN = re.compile(r'''\s*(?:('(?:[^']|'')*')|("[^"]*"|\[[^\]]*\])|(\d+\.?\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)|(<>|!=|<=|>=|=|<|>|\(|\)|,|\+|-|\*|/)|([A-Za-z_][A-Za-z0-9_]*))''')
+WHERE_OPERATORS = {'=' : '==', '<>' : '!=', '!=' : '!='}
+WHERE_KEYWORDS = {'AND' : 'and', 'OR' : 'or', 'NOT' : 'not', 'IN' : 'in', 'NULL' : 'None'}
+WHERE_UNSUPPORTED = ('LIKE', 'BETWEEN', 'EXISTS', 'SELECT')
+
+
+def backendFor(layer):
+  '''Returns a storage backend appropriate for the given dataset path.'''
+  if isinstance(layer, basestring):
+    ext = os.path.splitext(layer)[1].lower()
+    if ext in CSV_EXTENSIONS:
+      return CSVBackend(layer)
+    elif ext in PARQUET_EXTENSIONS:
+      return ParquetBackend(layer)
+    elif ext in ARROW_EXTENSIONS:
+      return ArrowBackend(layer)
+    database, table = os.path.split(layer)
+    if table and os.path.splitext(database)[1].lower() in SQLITE_EXTENSIONS:
+      return SQLiteBackend(database, table)
+  return ArcpyBackend(layer)
+
+def compileWhere(where, fields):
+  '''Compiles a simple SQL where clause to a Python function on full table rows.
+
+  Supports comparisons, arithmetic, AND/OR/NOT, IN lists and IS (NOT) NULL; field names may be quoted by double quotes or brackets.'''
+  if not where:
+    return None
+  indexes = {}
+  for i in range(len(fields)):
+    indexes.setdefault(fields[i], i)
+    indexes.setdefault(fields[i].upper(), i)
+  parts = []
+  inList = False
+  pos = 0
+  where = where.strip()
+  while pos < len(where):
+    match = WHERE_TOKEN.match(where, pos)
+    if not match or match.end() == pos:
+      raise ValueError, 'cannot parse where clause {} at position {}'.format(where, pos)
+    pos = match.end()
+    string, quoted, number, op, word = match.groups()
+    if string is not None:
+      parts.append(repr(string[1:-1].replace("''", "'").decode('utf8')))
+    elif number is not None:
+      parts.append(number)
+    elif op is not None:
+      if op == ')' and inList:
+        parts.append(',')
+        inList = False
+      parts.append(WHERE_OPERATORS.get(op, op))
+    else:
+      keyword = word.upper() if word else None
+      if keyword == 'IS':
+        parts.append('is')
+      elif keyword in WHERE_KEYWORDS:
+        parts.append(WHERE_KEYWORDS[keyword])
+        if keyword == 'IN':
+          inList = True
+      elif keyword in WHERE_UNSUPPORTED:
+        raise ValueError, 'unsupported where clause operator {} for non-ArcGIS datasets'.format(word)
+      else:
+        name = quoted[1:-1] if quoted else word
+        try:
+          index = indexes[name] if name in indexes else indexes[name.upper()]
+        except KeyError:
+          raise ValueError, 'field {} from where clause not found'.format(name)
+        parts.append('row[{}]'.format(index))
+  try:
+    return eval('lambda row: ' + ' '.join(parts))
+  except SyntaxError:
+    raise ValueError, 'invalid where clause: {}'.format(where)
+
+
+class Backend:
+  '''A storage backend interface. Cursors returned by insert() and update() must be released after use.
+
+  Searching and updating cursors may be ordered by a list of fields (orderBy). Database sources order values by their own collation, which should be binary for text so that it agrees with Python comparisons.'''
+  name = None
+
+  def indexAccess(self, useDA=True):
+    return True
+
+  def hasShape(self):
+    return False
+
+  def getShapeFieldName(self):
+    raise ValueError, '{} dataset {} has no geometry'.format(self.name, self.path)
+
+  def getShapeType(self):
+    raise ValueError, '{} dataset {} has no geometry'.format(self.name, self.path)
+
+  def setOverwrite(self):
+    pass
+
+  def sortable(self):
+    '''Whether the searching and updating cursors can be ordered.'''
+    return True
+
+  def columnUpdates(self):
+    '''Whether the backend can update rows column-wise. Backends returning True provide keyColumns(fields, where=None), returning handles of the selected rows and a list of NumPy arrays with values of the given fields in the same order, and setColumns(handles, fields, columns), writing lists of field values to the rows given by the handles.'''
+    return False
+
+  def createFeatureClass(self, shapeType=None, template=None, crs=None):
+    raise ValueError, 'cannot write geometry to {} dataset {}'.format(self.name, self.path)
+
+  def release(self, cursor):
+    pass
+
+  def insertRows(self, cursor, rows):
+    '''Inserts a block of rows (lists of values in the order of the cursor fields) through a cursor returned by insert().'''
+    for row in rows:
+      cursor.insertRow(row)
+
+  def modified(self):
+    '''Returns the last modification time of the dataset file, None if it does not exist.'''
+    return os.path.getmtime(self.path) if os.path.exists(self.path) else None
+
+  def columns(self, fields, where=None):
+    '''Reads the given fields of all rows into a list of NumPy arrays.'''
+    columns = zip(*self.search(fields, where))
+    if not columns:
+      return [numpy.array([]) for field in fields]
+    return [numpy.array(column) for column in columns]
+
+
+class ArcpyBackend(Backend):
+  name = 'ArcGIS'
+
+  def __init__(self, path):
+    if arcpy is None:
+      raise IOError, 'ArcGIS not available to access {}, use a CSV, SQLite or Parquet dataset'.format(path)
+    self.path = path
+    self._description = None
+
+  def indexAccess(self, useDA=True):
+    return hasattr(arcpy, 'da') and useDA
+
+  def getDescription(self):
+    if self._description is None:
+      self._description = arcpy.Describe(self.path)
+    return self._description
+
+  def hasShape(self):
+    return hasattr(self.getDescription(), 'shapeFieldName')
+
+  def getShapeFieldName(self):
+    return self.getDescription().shapeFieldName
+
+  def getShapeType(self):
+    return self.getDescription().shapeType.lower()
+
+  def modified(self):
+    '''Returns the last modification time of the files that make up the dataset: the dataset file and its sidecar files (as for shapefiles) or, for datasets inside a geodatabase, all the files of the geodatabase.'''
+    if not isinstance(self.path, basestring):
+      return None
+    path = self.path
+    while path and not os.path.exists(path):
+      path = os.path.dirname(path)
+    if not path:
+      return None
+    elif os.path.isdir(path):
+      files = [os.path.join(path, name) for name in os.listdir(path)]
+    else:
+      stem = os.path.splitext(os.path.basename(path))[0] + '.'
+      folder = os.path.dirname(path)
+      files = [os.path.join(folder, name) for name in os.listdir(folder or '.') if name.startswith(stem)] + [path]
+    times = [os.path.getmtime(file) for file in files if os.path.isfile(file)]
+    return max(times) if times else os.path.getmtime(path)
+
+  def count(self):
+    return common.count(self.path)
+
+  def fieldList(self):
+    return common.fieldList(self.path)
+
+  def setOverwrite(self):
+    arcpy.env.overwriteOutput = True
+
+  def sortable(self):
+    return isinstance(self.path, basestring) and common.isInDatabase(self.path)
+
+  def createTable(self):
+    self.path = common.createTable(self.path)
+    self._description = None
+    return self.path
+
+  def createFeatureClass(self, shapeType=None, template=None, crs=None):
+    self.path = common.createFeatureClass(self.path, shapeType, template, crs)
+    self._description = None
+    return self.path
+
+  def addField(self, name, fldType):
+    common.addField(self.path, name, fldType)
+
+  def deleteField(self, name):
+    arcpy.DeleteField_management(self.path, name)
+
+  def search(self, fields, where=None, orderBy=None):
+    return arcpy.da.SearchCursor(self.path, fields, where, sql_clause=self.sqlClause(orderBy))
+
+  def insert(self, fields):
+    return arcpy.da.InsertCursor(self.path, fields)
+
+  def update(self, fields, where=None, orderBy=None):
+    return arcpy.da.UpdateCursor(self.path, fields, where, sql_clause=self.sqlClause(orderBy))
+
+  @staticmethod
+  def sqlClause(orderBy):
+    # ordering is only supported by database sources, not by shapefiles and dBase tables
+    return (None, 'ORDER BY ' + ', '.join(orderBy)) if orderBy else (None, None)
+
+  def columns(self, fields, where=None):
+    '''Reads the fields in bulk, with nulls replaced by None as in the other backends. Fields of types with no null placeholder are read through a cursor.'''
+    types = {field.name.upper() : field.type for field in arcpy.ListFields(self.path)}
+    fieldTypes = [types.get(field.upper()) for field in fields]
+    if not all(fieldType in ARCPY_NULL_VALUES for fieldType in fieldTypes):
+      return Backend.columns(self, fields, where)
+    nullValues = {field : ARCPY_NULL_VALUES[fieldType] for field, fieldType in zip(fields, fieldTypes)}
+    table = arcpy.da.TableToNumPyArray(self.path, list(fields), where, null_value=nullValues)
+    return [self.withNulls(table[field], nullValues[field]) for field in fields]
+
+  @staticmethod
+  def withNulls(column, nullValue):
+    nulls = numpy.isnan(column) if column.dtype.kind == 'f' else (column == nullValue)
+    if nulls.any():
+      column = column.astype(object)
+      column[nulls] = None
+    return column
+
+
+class MemoryBackend(Backend):
+  '''A backend for file formats that are read and written as a whole. The table is kept in memory as a list of row lists and written back when a writing cursor is released.'''
+
+  def __init__(self, path):
+    self.path = path
+    self.fields = None
+    self.rows = None
+    self.dirty = False
+    self.projectedCount = None
+
+  def load(self):
+    if self.fields is None:
+      if os.path.exists(self.path):
+        self.fields, self.rows = self.read()
+      else:
+        self.fields, self.rows = [], []
+
+  def count(self):
+    if self.fields is None and self.projectedCount is not None:
+      return self.projectedCount
+    self.load()
+    return len(self.rows)
+
+  def fieldList(self):
+    self.load()
+    return list(self.fields)
+
+  def indexesOf(self, fields):
+    self.load()
+    return self.matchFields(self.fields, fields)
+
+  def matchFields(self, available, fields):
+    '''Returns the indexes of the given fields among the available field names, ignoring case if there is no exact match.'''
+    indexes = []
+    upper = [field.upper() for field in available]
+    for field in fields:
+      if field in available:
+        indexes.append(available.index(field))
+      elif field.upper() in upper:
+        indexes.append(upper.index(field.upper()))
+      else:
+        raise KeyError, 'field {} not found in {}'.format(field, self.path)
+    return indexes
+
+  def createTable(self):
+    self.fields, self.rows = [], []
+    self.dirty = True
+    return self.path
+
+  def addField(self, name, fldType):
+    self.load()
+    self.fields.append(name)
+    for row in self.rows:
+      row.append(None)
+    self.dirty = True
+
+  def deleteField(self, name):
+    index = self.indexesOf([name])[0]
+    del self.fields[index]
+    for row in self.rows:
+      del row[index]
+    self.dirty = True
+
+  def search(self, fields, where=None, orderBy=None):
+    if self.fields is None and not where and not orderBy and os.path.exists(self.path):
+      # a plain read of a table not loaded yet only reads the requested fields
+      rows = self.project(fields)
+      self.projectedCount = len(rows)
+      return iter(rows)
+    else:
+      return self.filtered(fields, where, orderBy)
+
+  def filtered(self, fields, where=None, orderBy=None):
+    indexes = self.indexesOf(fields)
+    condition = compileWhere(where, self.fields)
+    for row in self.ordered(orderBy):
+      if condition is None or condition(row):
+        yield [row[i] for i in indexes]
+
+  def project(self, fields):
+    '''Reads the given fields of all rows without keeping the table in memory.'''
+    columns = self.readColumns(fields)
+    return [list(row) for row in zip(*columns)] if columns else []
+
+  def readColumns(self, fields):
+    indexes = self.indexesOf(fields)
+    return [[row[i] for row in self.rows] for i in indexes]
+
+  def insert(self, fields):
+    return MemoryInsertCursor(self, self.indexesOf(fields))
+
+  def insertRows(self, cursor, rows):
+    cursor.insertRows(rows)
+
+  def update(self, fields, where=None, orderBy=None):
+    return MemoryUpdateCursor(self, self.indexesOf(fields), compileWhere(where, self.fields), self.ordered(orderBy))
+
+  def columnUpdates(self):
+    return True
+
+  def keyColumns(self, fields, where=None):
+    indexes = self.indexesOf(fields)
+    condition = compileWhere(where, self.fields)
+    handles = [i for i in xrange(len(self.rows)) if condition is None or condition(self.rows[i])]
+    return handles, [numpy.array([self.rows[handle][index] for handle in handles]) for index in indexes]
+
+  def setColumns(self, handles, fields, columns):
+    for index, column in zip(self.indexesOf(fields), columns):
+      for handle, value in zip(handles, column):
+        self.rows[handle][index] = value
+    self.dirty = True
+    self.release(None)
+
+  def ordered(self, orderBy=None):
+    if orderBy:
+      indexes = self.indexesOf(orderBy)
+      return sorted(self.rows, key=lambda row: [row[i] for i in indexes])
+    else:
+      return self.rows
+
+  def release(self, cursor):
+    if self.dirty:
+      self.write(self.fields, self.rows)
+      self.dirty = False
+
+
+class MemoryInsertCursor:
+  def __init__(self, backend, indexes):
+    self.backend = backend
+    self.indexes = indexes
+
+  def insertRow(self, values):
+    self.insertRows([values])
+
+  def insertRows(self, rows):
+    width = len(self.backend.fields)
+    if self.indexes == range(width):
+      self.backend.rows.extend(list(values) for values in rows)
+    else:
+      for values in rows:
+        row = [None] * width
+        for i in range(len(self.indexes)):
+          row[self.indexes[i]] = values[i]
+        self.backend.rows.append(row)
+    self.backend.dirty = True
+
+
+class MemoryUpdateCursor:
+  def __init__(self, backend, indexes, condition, rows):
+    self.backend = backend
+    self.indexes = indexes
+    self.condition = condition
+    self.rows = rows
+    self.current = None
+
+  def __iter__(self):
+    for row in self.rows:
+      if self.condition is None or self.condition(row):
+        self.current = row
+        yield [row[i] for i in self.indexes]
+
+  def updateRow(self, values):
+    for i in range(len(self.indexes)):
+      self.current[self.indexes[i]] = values[i]
+    self.backend.dirty = True
+
+
+class CSVBackend(MemoryBackend):
+  '''A delimited text file with a header row. Column types are inferred from the values: a column is integer or float if all its nonempty values are and none of them has a leading zero (such as census codes), otherwise text.
+
+  The original texts of a loaded table are kept so that values left unchanged are written back exactly as they were read.'''
+  name = 'CSV'
+  encoding = 'utf8'
+  readDialect = None
+  texts = None
+
+  def read(self):
+    fields, columns, texts = self.readText()
+    self.texts = dict(zip(fields, texts))
+    return fields, [list(row) for row in zip(*columns)] if columns else []
+
+  def createTable(self):
+    self.texts = None
+    return MemoryBackend.createTable(self)
+
+  def readColumns(self, fields):
+    return self.readText(fields)[1]
+
+  def readText(self, selected=None):
+    '''Reads the header, the typed columns of the given fields (all if None) and their original texts; values of other fields are not converted.'''
+    with open(self.path, 'rb') as file:
+      self.readDialect = self.sniff(file.read(4096))
+      file.seek(0)
+      reader = csv.reader(file, self.readDialect)
+      fields = [field.decode(self.encoding) for field in next(reader)]
+      indexes = range(len(fields)) if selected is None else self.matchFields(fields, selected)
+      columns = [[] for i in indexes]
+      for row in reader:
+        if row:
+          for column, i in zip(columns, indexes):
+            column.append(row[i] if i < len(row) else '')
+    return fields, [self.typed(column) for column in columns], columns
+
+  def write(self, fields, rows):
+    originals = self.originals(fields)
+    with open(self.path, 'wb') as file:
+      writer = csv.writer(file, self.dialect())
+      writer.writerow([self.formatted(field) for field in fields])
+      for i in xrange(len(rows)):
+        writer.writerow([self.formattedAs(value, original, i) for value, original in zip(rows[i], originals)])
+
+  def originals(self, fields):
+    '''Returns (typed values, texts) of the fields as read from the file, None for fields not read.'''
+    originals = []
+    for field in fields:
+      texts = self.texts.get(field) if self.texts else None
+      originals.append(None if texts is None else (self.typed(texts), texts))
+    return originals
+
+  def formattedAs(self, value, original, i):
+    '''Formats the value, using the original text if the value is the one read from it.'''
+    if original is not None and i < len(original[1]) and value == original[0][i] and type(value) is type(original[0][i]):
+      return original[1][i]
+    return self.formatted(value)
+
+  def sniff(self, sample):
+    try:
+      return csv.Sniffer().sniff(sample.split('\n', 1)[0], delimiters=',;\t')
+    except csv.Error:
+      return self.dialect()
+
+  def dialect(self):
+    if self.readDialect:
+      return self.readDialect
+    return csv.excel_tab if self.path.lower().endswith('.tsv') else csv.excel
+
+  def typed(self, column):
+    if not any(NUMBER_WITH_LEADING_ZERO.match(value) for value in column):
+      for converter in (int, float):
+        try:
+          return [(converter(value) if value != '' else None) for value in column]
+        except ValueError:
+          pass
+    return [(value.decode(self.encoding) if value != '' else None) for value in column]
+
+  def formatted(self, value):
+    if value is None:
+      return ''
+    elif isinstance(value, unicode):
+      return value.encode(self.encoding)
+    elif isinstance(value, float):
+      return repr(value)
+    elif hasattr(value, 'dtype') and value.dtype.kind == 'f':
+      return repr(float(value))
+    else:
+      return str(value)
+
+
+class ParquetBackend(MemoryBackend):
+  '''A Parquet file accessed through PyArrow.'''
+  name = 'Parquet'
+
+  def __init__(self, path):
+    MemoryBackend.__init__(self, path)
+    self.created = False
+    self.types = {}
+    global pyarrow
+    import pyarrow, pyarrow.parquet
+
+  def read(self):
+    return self.fromTable(self.readTable())
+
+  def columns(self, fields, where=None):
+    if where or self.fields is not None:
+      return MemoryBackend.columns(self, fields, where)
+    return [numpy.array(column) for column in self.readColumns(fields)]
+
+  def readColumns(self, fields):
+    if self.fields is not None:
+      return MemoryBackend.readColumns(self, fields)
+    names = self.schemaNames()
+    selected = [names[i] for i in self.matchFields(names, fields)]
+    table = self.readTable(sorted(set(selected)))
+    return [table.column(table.schema.names.index(name)).to_pylist() for name in selected]
+
+  def createTable(self):
+    self.created = True
+    self.types = {}
+    return MemoryBackend.createTable(self)
+
+  def addField(self, name, fldType):
+    '''Adds the field, remembering its type for the record batches of a new table.'''
+    MemoryBackend.addField(self, name, fldType)
+    if self.created:
+      self.types[name] = fldType
+
+  def arrowType(self, field):
+    '''Returns the Arrow type for the declared type of the field, None if not known.'''
+    fldType = self.types.get(field)
+    if fldType in (int, long, numpy.int32, numpy.int64):
+      return pyarrow.int64()
+    elif fldType in (float, numpy.float32, numpy.float64):
+      return pyarrow.float64()
+    elif fldType in (bool, numpy.bool_):
+      return pyarrow.bool_()
+    elif fldType in (str, unicode):
+      return pyarrow.string()
+    else:
+      return None
+
+  def insert(self, fields):
+    if self.created and not self.rows:
+      # a newly created table is written directly in record batches instead of being collected in memory
+      return BatchInsertCursor(self, self.indexesOf(fields))
+    else:
+      return MemoryBackend.insert(self, fields)
+
+  def release(self, cursor):
+    if isinstance(cursor, BatchInsertCursor):
+      cursor.close()
+      self.fields, self.rows = None, None
+      self.created = False
+      self.dirty = False
+    else:
+      MemoryBackend.release(self, cursor)
+
+  def write(self, fields, rows):
+    self.writeTable(self.toTable(fields, rows))
+
+  def readTable(self, columns=None):
+    return pyarrow.parquet.read_table(self.path, columns=columns)
+
+  def schemaNames(self):
+    return list(pyarrow.parquet.read_schema(self.path).names)
+
+  def writeTable(self, table):
+    pyarrow.parquet.write_table(table, self.path)
+
+  def openWriter(self, schema):
+    return pyarrow.parquet.ParquetWriter(self.path, schema)
+
+  def closeWriter(self, writer):
+    writer.close()
+
+  @staticmethod
+  def fromTable(table):
+    fields = list(table.schema.names)
+    columns = [table.column(i).to_pylist() for i in range(len(fields))]
+    return fields, [list(row) for row in zip(*columns)] if columns else []
+
+  @staticmethod
+  def toTable(fields, rows, types=None):
+    '''Creates an Arrow table of the rows, with columns of the given Arrow types (inferred from the values where None).'''
+    if types is None:
+      types = [None] * len(fields)
+    columns = [[row[i] for row in rows] for i in range(len(fields))]
+    return pyarrow.Table.from_arrays([pyarrow.array(column, type=arrowType) for column, arrowType in zip(columns, types)], names=fields)
+
+
+class ArrowBackend(ParquetBackend):
+  '''An Arrow IPC (Feather version 2) file accessed through PyArrow.'''
+  name = 'Arrow'
+
+  def readTable(self, columns=None):
+    # the file is memory-mapped, so columns that are not selected are never read
+    return pyarrow.RecordBatchFileReader(pyarrow.memory_map(self.path, 'r')).read_all()
+
+  def schemaNames(self):
+    return list(pyarrow.RecordBatchFileReader(pyarrow.memory_map(self.path, 'r')).schema.names)
+
+  def writeTable(self, table):
+    writer = self.openWriter(table.schema)
+    writer.write_table(table)
+    self.closeWriter(writer)
+
+  def openWriter(self, schema):
+    self.sink = pyarrow.OSFile(self.path, 'wb')
+    return pyarrow.RecordBatchFileWriter(self.sink, schema)
+
+  def closeWriter(self, writer):
+    writer.close()
+    self.sink.close()
+    self.sink = None
+
+
+class BatchInsertCursor:
+  '''Writes the inserted rows to a new Parquet or Arrow file in record batches of bufferSize rows.
+
+  The column types are the types the fields were created with, or the types of the first batch for fields created without a known type. If a later batch does not fit them (such as floats in a column that started with integers), the rows written so far are read back and all the rows are written at once when the cursor is closed, with the types inferred from all of them.'''
+  bufferSize = 10000
+
+  def __init__(self, backend, indexes):
+    self.backend = backend
+    self.indexes = indexes
+    self.fields = list(backend.fields)
+    self.rows = []
+    self.writer = None
+    self.types = [backend.arrowType(field) for field in self.fields]
+    self.inMemory = False
+
+  def insertRow(self, values):
+    self.insertRows([values])
+
+  def insertRows(self, rows):
+    width = len(self.fields)
+    for values in rows:
+      row = [None] * width
+      for i in range(len(self.indexes)):
+        row[self.indexes[i]] = values[i]
+      self.rows.append(row)
+    if len(self.rows) >= self.bufferSize and not self.inMemory:
+      self.flush()
+
+  def flush(self):
+    if self.rows or self.writer is None:
+      try:
+        table = self.backend.toTable(self.fields, self.rows, self.types)
+      except (pyarrow.ArrowException, TypeError, ValueError, OverflowError):
+        self.readBack()
+        return
+      if self.writer is None:
+        self.types = list(table.schema.types)
+        self.writer = self.backend.openWriter(table.schema)
+      self.writer.write_table(table)
+      self.rows = []
+
+  def readBack(self):
+    '''Switches to writing all the rows at once: reads back the rows written so far and keeps them before the buffered ones.'''
+    if self.writer is not None:
+      self.backend.closeWriter(self.writer)
+      self.writer = None
+      self.rows = self.backend.fromTable(self.backend.readTable())[1] + self.rows
+    self.inMemory = True
+
+  def close(self):
+    if not self.inMemory:
+      self.flush()
+    if self.inMemory:
+      self.backend.write(self.fields, self.rows)
+      self.rows = []
+    else:
+      self.backend.closeWriter(self.writer)
+      self.writer = None
+
+
+class SQLiteBackend(Backend):
+  '''A table in a SQLite database file. Where clauses are passed to SQLite directly.'''
+  name = 'SQLite'
+
+  def __init__(self, database, table):
+    self.database = database
+    self.table = table
+    self.path = os.path.join(database, table)
+    self._connection = None
+
+  def modified(self):
+    return os.path.getmtime(self.database) if os.path.exists(self.database) else None
+
+  def connection(self):
+    if self._connection is None:
+      self._connection = sqlite3.connect(self.database)
+    return self._connection
+
+  @staticmethod
+  def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+  def execute(self, statement, values=()):
+    return self.connection().execute(statement, values)
+
+  def selectClause(self, fields, where=None, prefix='', orderBy=None):
+    return 'SELECT {}{} FROM {}{}{}'.format(prefix, ', '.join(self.quote(field) for field in fields),
+      self.quote(self.table), (' WHERE ' + where if where else ''),
+      (' ORDER BY ' + ', '.join(self.quote(field) for field in orderBy) if orderBy else ''))
+
+  def count(self):
+    return self.execute('SELECT COUNT(*) FROM ' + self.quote(self.table)).fetchone()[0]
+
+  def fieldList(self):
+    return [info[1] for info in self.execute('PRAGMA table_info({})'.format(self.quote(self.table)))]
+
+  def createTable(self):
+    self.execute('DROP TABLE IF EXISTS ' + self.quote(self.table))
+    self.execute('CREATE TABLE {} ({} INTEGER PRIMARY KEY)'.format(self.quote(self.table), SQLITE_OID_FIELD))
+    self.connection().commit()
+    return self.path
+
+  def addField(self, name, fldType):
+    self.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(self.quote(self.table), self.quote(name), SQLITE_TYPES.get(fldType, '')))
+    self.connection().commit()
+
+  def deleteField(self, name):
+    kept = [field for field in self.fieldList() if field != name]
+    temporary = self.quote(self.table + '_tmp')
+    self.execute('CREATE TABLE {} AS {}'.format(temporary, self.selectClause(kept)))
+    self.execute('DROP TABLE ' + self.quote(self.table))
+    self.execute('ALTER TABLE {} RENAME TO {}'.format(temporary, self.quote(self.table)))
+    self.connection().commit()
+
+  def search(self, fields, where=None, orderBy=None):
+    return self.connection().cursor().execute(self.selectClause(fields, where, orderBy=orderBy))
+
+  def insert(self, fields):
+    return SQLiteInsertCursor(self, 'INSERT INTO {} ({}) VALUES ({})'.format(self.quote(self.table),
+      ', '.join(self.quote(field) for field in fields), ', '.join('?' for field in fields)))
+
+  def update(self, fields, where=None, orderBy=None):
+    return SQLiteUpdateCursor(self, self.selectClause(fields, where, prefix='rowid, ', orderBy=orderBy),
+      'UPDATE {} SET {} WHERE rowid = ?'.format(self.quote(self.table), ', '.join(self.quote(field) + ' = ?' for field in fields)))
+
+  def insertRows(self, cursor, rows):
+    cursor.insertRows(rows)
+
+  def columnUpdates(self):
+    return True
+
+  def keyColumns(self, fields, where=None):
+    rows = self.search(['rowid'] + list(fields), where).fetchall()
+    if not rows:
+      return [], [numpy.array([]) for field in fields]
+    columns = zip(*rows)
+    return list(columns[0]), [numpy.array(column) for column in columns[1:]]
+
+  def setColumns(self, handles, fields, columns):
+    '''Loads the values to a temporary table keyed by rowid and updates the table from it by a single statement.'''
+    temporary = self.quote(self.table + '_columns')
+    names = ['c{}'.format(i) for i in range(len(fields))]
+    self.execute('DROP TABLE IF EXISTS temp.' + temporary)
+    self.execute('CREATE TEMP TABLE {} (rid INTEGER PRIMARY KEY, {})'.format(temporary, ', '.join(names)))
+    self.connection().executemany('INSERT INTO temp.{} VALUES ({})'.format(temporary, ', '.join('?' for i in range(len(fields) + 1))), zip(handles, *columns))
+    table = self.quote(self.table)
+    self.execute('UPDATE {} SET {} WHERE rowid IN (SELECT rid FROM temp.{})'.format(table,
+      ', '.join('{} = (SELECT {} FROM temp.{} WHERE rid = {}.rowid)'.format(self.quote(field), name, temporary, table) for field, name in zip(fields, names)), temporary))
+    self.execute('DROP TABLE temp.' + temporary)
+    self.connection().commit()
+
+  def release(self, cursor):
+    cursor.flush()
+    self.connection().commit()
+
+
+class SQLiteInsertCursor:
+  '''Writes the inserted rows by executemany() in blocks of bufferSize rows.'''
+  bufferSize = 10000
+
+  def __init__(self, backend, statement):
+    self.backend = backend
+    self.statement = statement
+    self.rows = []
+
+  def insertRow(self, values):
+    self.rows.append(tuple(values))
+    if len(self.rows) >= self.bufferSize:
+      self.flush()
+
+  def insertRows(self, rows):
+    self.rows.extend(tuple(values) for values in rows)
+    if len(self.rows) >= self.bufferSize:
+      self.flush()
+
+  def flush(self):
+    if self.rows:
+      self.backend.connection().executemany(self.statement, self.rows)
+      self.rows = []
+
+
+class SQLiteUpdateCursor(SQLiteInsertCursor):
+  '''Iterates over the selected rows lazily and writes the updates in blocks of bufferSize rows.'''
+
+  def __init__(self, backend, query, statement):
+    SQLiteInsertCursor.__init__(self, backend, statement)
+    self.query = query
+    self.rowid = None
+
+  def __iter__(self):
+    for row in self.backend.connection().cursor().execute(self.query):
+      self.rowid = row[0]
+      yield list(row[1:])
+
+  def updateRow(self, values):
+    self.rows.append(tuple(values) + (self.rowid, ))
+    if len(self.rows) >= self.bufferSize:
+      self.flush()
@@ -2,9 +2,9 @@ import common, objects, loaders, regionalization
 
 OUT_MEASURES = {'TOT_IN_CORE' : 'IN', 'TOT_OUT_CORE' : 'OUT'}
 
-with common.runtool(9) as parameters:
+with common.runtool(10) as parameters:
   zoneLayer, zoneQuery, zoneIDFld, interLayer, interQuery, interStrengthFlds, \
-    interFromIDFld, interToIDFld, doCount = parameters
+    interFromIDFld, interToIDFld, doCount, interStore = parameters
   interFlds = common.parseFields(interStrengthFlds)
   zoneInSlots = {'id' : zoneIDFld}
   objects.MultiInteractions.setDefaultLength(len(interFlds))
@@ -21,7 +21,7 @@ with common.runtool(9) as parameters:
       outSlots[slotName] = slotName
   regload = loaders.RegionalLoader(regionalization.Regionalizer(objects.FunctionalRegion))
   regload.sourceOfZones(zoneLayer, zoneInSlots, targetClass=objects.MonoZone, coreQuery=zoneQuery)
-  regload.sourceOfMultiInteractions(interLayer, interSlots, where=interQuery, ordering=interFlds)
+  regload.sourceOfMultiInteractions(interLayer, interSlots, where=interQuery, ordering=interFlds, store=(interStore or None)) # a store directory memory-maps the interactions
   regload.load()
   common.progress('summarizing')
   measurer = objects.ZoneMeasurer()
@@ -0,0 +1,211 @@
+'''Parameter sweeps of regionalization algorithms.
+
+The inputs are loaded only once and the algorithm is then run for every combination of the swept parameter values. Where processes can be forked, each run takes place in its own worker process forked from the loading process, so that the loaded zones and interactions are shared copy-on-write and every run starts from the same unassigned state. Elsewhere (Windows), the runs are sequential and the inputs are reloaded before every run but the first one, from the snapshot given in the data setup or from a temporary one saved by the first load. Runs may also be chained to warm-start from the solutions of their predecessors.
+
+The zone assignments of all runs are written to a single table (distinguished by the RUN field) and a summary of each run (swept parameter values, region count, unassigned zones, region mass range and region measures) to another one.'''
+
+import os, time, itertools, collections, multiprocessing, tempfile, shutil
+import common, loaders, objects, regionalization
+from loaders import ConfigError
+
+# output slots in the order of the output fields
+ASSIGNMENT_SLOTS = collections.OrderedDict([('run', 'RUN'), ('id', 'ID'), ('assign', 'R'), ('core', 'R_CORE')])
+SUMMARY_SLOTS = collections.OrderedDict([('run', 'RUN'), ('regions', 'REGIONS'), ('unassigned', 'UNASSIGNED'), ('unassignedMass', 'UNASS_MASS'), ('minMass', 'MIN_MASS'), ('maxMass', 'MAX_MASS'), ('seconds', 'SECONDS')])
+SUMMARY_TYPES = {'run' : int, 'regions' : int, 'unassigned' : int, 'unassignedMass' : float, 'minMass' : float, 'maxMass' : float, 'seconds' : float}
+DEFAULT_MEASURES = ['COO_SC']
+SNAPSHOT_NAME = 'inputs.npz'
+
+SWEEP = None # the sweep being run, inherited by the forked worker processes
+
+def getParamCount(): return 18
+
+def parseGrid(gridStr):
+  '''Parses the swept parameter values given as id=value,value,...;id=value,... into a list of (id, values) pairs.'''
+  grid = []
+  for item in common.parseFields(gridStr):
+    if '=' not in item:
+      raise ValueError, 'invalid parameter sweep format: expected id=value,value,..., got ' + item
+    id, values = item.split('=', 1)
+    grid.append((id.strip(), [value.strip() for value in values.split(',') if value.strip()]))
+  return grid
+
+def parseValue(value):
+  try:
+    return float(value)
+  except (TypeError, ValueError):
+    return value
+
+def runChain(chain):
+  return SWEEP.runChain(chain)
+
+
+class Sweep:
+  def __init__(self, algorithmFile, grid, fixed=[], measures=DEFAULT_MEASURES, warm=False):
+    '''Prepares a sweep of the algorithm over the grid of (id, values) pairs. Parameters not swept take their values from fixed (in the order of the algorithm parameters) or their defaults given in the algorithm file.
+
+    If warm is set, the runs over the values of the last swept parameter start from the solution of the run with its preceding value, so only the regions failing the new criteria are aggregated again. The values should then be given in the order of increasing strictness, as regions are not split.'''
+    self.algorithmFile = algorithmFile
+    self.grid = grid
+    self.warm = warm
+    reader = regionalization.DRSetupReader()
+    paramEl = reader.parseFile(algorithmFile).find('parameters')
+    self.parameterIDs = reader._getParameterIDs(paramEl)
+    self.base = {} if paramEl is None else {item.get('id') : item.get('default') for item in paramEl.findall('parameter')}
+    for id, value in zip(self.parameterIDs, fixed):
+      if value:
+        self.base[id] = value
+    for id, values in grid:
+      if id not in self.parameterIDs:
+        raise ConfigError, '{} is not a parameter of algorithm {}'.format(id, algorithmFile)
+      if not values:
+        raise ValueError, 'no values given to sweep for parameter ' + id
+    self.sweptIDs = [id for id, values in grid]
+    self.combinations = list(itertools.product(*[values for id, values in grid]))
+    for measure in measures:
+      if measure not in objects.RegionMeasurer.measureMethods:
+        raise ValueError, 'measure %s not known' % measure
+    self.measures = measures
+    self.loader = None
+
+  def setLoader(self, loader):
+    self.loader = loader
+
+  def parameters(self, combination):
+    values = self.base.copy()
+    values.update(zip(self.sweptIDs, combination))
+    return [values[id] for id in self.parameterIDs]
+
+  def describe(self, combination):
+    return ', '.join('{}={}'.format(id, value) for id, value in zip(self.sweptIDs, combination))
+
+  def createRegionalizer(self, combination):
+    return regionalization.DRSetupReader(parameters=self.parameters(combination)).create(self.algorithmFile)
+
+  def load(self):
+    self.loader.load(init=False)
+
+  def chains(self):
+    '''Returns the lists of run indexes executed one after another. In a warm sweep, the runs differing only in the last swept parameter form a chain, each starting from the solution of the previous one; otherwise, every run is on its own.'''
+    count = len(self.combinations)
+    length = len(self.grid[-1][1]) if self.warm and self.grid else 1
+    return [range(i, min(i + length, count)) for i in xrange(0, count, length)]
+
+  def runs(self, processes=None):
+    '''Runs all parameter combinations on the loaded inputs, yielding their (summary, assignments) in order. Reloads the inputs between sequentially run chains.'''
+    global SWEEP
+    chains = self.chains()
+    if self.forks(processes):
+      SWEEP = self
+      # every worker serves a single chain so that each chain starts from the zones as loaded
+      pool = multiprocessing.Pool(min(processes, len(chains)), maxtasksperchild=1)
+      try:
+        for results in pool.imap(runChain, chains, chunksize=1):
+          for result in results:
+            yield result
+      except:
+        pool.terminate()
+        raise
+      else:
+        pool.close()
+      finally:
+        pool.join()
+        SWEEP = None
+    else:
+      for chain in chains:
+        if chain[0] > 0:
+          self.load()
+        for result in self.runChain(chain):
+          yield result
+
+  def forks(self, processes=None):
+    '''Returns whether the chains are run in forked worker processes rather than one after another.'''
+    if processes is None:
+      processes = multiprocessing.cpu_count()
+    return processes > 1 and len(self.chains()) > 1 and hasattr(os, 'fork')
+
+  def runChain(self, chain):
+    results = []
+    presets = None
+    for i in chain:
+      if presets is not None: # a warm start from the previous solution
+        for zone in self.loader.zoneList:
+          zone.deassign()
+      reg, seconds = self.execute(i, presets)
+      presets = reg.getPresets()
+      results.append((self.summarize(i, reg, seconds), [(zone.getID(), zone.getRegionID(), zone.getLesserCoreID()) for zone in reg.getZones()]))
+    return results
+
+  def execute(self, i, presets=None):
+    combination = self.combinations[i]
+    common.progress('sweep run {} of {}: {}'.format(i + 1, len(self.combinations), self.describe(combination)))
+    start = time.time()
+    reg = self.createRegionalizer(combination)
+    if presets is None:
+      presets = self.loader.zoneLoader.getPresets() if self.loader.makePresets else []
+    reg.initRun(self.loader.zoneList, presets=presets, index=self.loader.zoneIndex)
+    reg.run(reg.getZones())
+    return reg, time.time() - start
+
+  def summarize(self, i, reg, seconds):
+    regions = reg.getRegions()
+    unassigned = [zone for zone in reg.getZones() if not zone.isAssigned()]
+    masses = [region.getMass() for region in regions]
+    summary = {'run' : i + 1, 'regions' : len(regions), 'unassigned' : len(unassigned), 'unassignedMass' : sum(zone.getMass() for zone in unassigned), 'minMass' : (min(masses) if masses else None), 'maxMass' : (max(masses) if masses else None), 'seconds' : seconds}
+    summary.update((id, parseValue(value)) for id, value in zip(self.sweptIDs, self.combinations[i]))
+    for measure in self.measures:
+      values = []
+      for region in regions:
+        try:
+          values.append(objects.RegionMeasurer.measureMethods[measure](region))
+        except ZeroDivisionError:
+          pass
+      summary['MIN_' + measure] = min(values) if values else None
+      summary['MEAN_' + measure] = sum(values) / float(len(values)) if values else None
+    return summary
+
+  def summarySlots(self):
+    '''Returns the summary output slots ordered as the run number, the swept parameters, the run results and the region measures.'''
+    slots = collections.OrderedDict(run=SUMMARY_SLOTS['run'])
+    slots.update((id, id.upper().replace('-', '_')) for id in self.sweptIDs)
+    slots.update(SUMMARY_SLOTS)
+    for measure in self.measures:
+      for prefix in ('MIN_', 'MEAN_'):
+        slots[prefix + measure] = prefix + measure
+    return slots
+
+  def write(self, assignTable, summaryTable, processes=None):
+    '''Loads the inputs, runs the sweep and writes the zone assignments of all runs and the run summaries.'''
+    tmpDir = None
+    if not self.loader.snapshotPath and len(self.chains()) > 1 and not self.forks(processes):
+      tmpDir = tempfile.mkdtemp()
+      self.loader.useSnapshot(os.path.join(tmpDir, SNAPSHOT_NAME))
+    try:
+      self.load()
+      idType = type(self.loader.zoneList[0].getID()) if self.loader.zoneList else int
+      summaries = []
+      writer = loaders.BasicWriter(assignTable, ASSIGNMENT_SLOTS, types={'run' : int, 'id' : idType, 'assign' : idType, 'core' : idType})
+      writer.write(self.assignmentRows(self.runs(processes), summaries))
+    finally:
+      if tmpDir:
+        self.loader.useSnapshot(None)
+        shutil.rmtree(tmpDir, ignore_errors=True)
+    slots = self.summarySlots()
+    types = loaders.inferFieldTypes(summaries, [slot for slot in slots if slot not in SUMMARY_TYPES])
+    types.update(SUMMARY_TYPES)
+    common.progress('writing run summaries')
+    loaders.BasicWriter(summaryTable, slots, types=types).write(summaries)
+
+  def assignmentRows(self, results, summaries):
+    for summary, assignments in results:
+      common.message('Run {} ({}): {} regions, {} zones unassigned'.format(summary['run'], self.describe(self.combinations[summary['run'] - 1]), summary['regions'], summary['unassigned']))
+      summaries.append(summary)
+      run = summary['run']
+      for id, region, core in assignments:
+        yield {'run' : run, 'id' : id, 'assign' : region, 'core' : core}
+
+
+def sweepByFile(inputsFile, algorithmFile, gridStr, assignTable, summaryTable, processesStr='', measureFldsStr='', warmStr='false', *args):
+  common.progress('loading delimiter setup')
+  sweep = Sweep(algorithmFile, parseGrid(gridStr), fixed=args, measures=(common.parseFields(measureFldsStr) or DEFAULT_MEASURES), warm=common.toBool(warmStr, 'warm start switch'))
+  sweep.setLoader(regionalization.RLSetupReader().create(inputsFile, sweep.createRegionalizer(sweep.combinations[0])))
+  sweep.write(assignTable, summaryTable, processes=(common.toInt(processesStr, 'process count') if processesStr else None))
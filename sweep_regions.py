@@ -0,0 +1,5 @@
+import common, sweep
+
+if __name__ == '__main__':
+  with common.runtool(sweep.getParamCount()) as parameters:
+    sweep.sweepByFile(*parameters)
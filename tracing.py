@@ -0,0 +1,163 @@
+'''Tracing of the decisions made during regionalization runs.
+
+The algorithm elements report their decisions (zone and region assignments, presets, changes, merges, destruction) through decision(), but only behind a check of the module-level active flag, so that with tracing off (the default) the hot loops pay a single attribute lookup and no message is ever formatted. The messages are only formatted when the text trace level asks for them; detail() messages are reserved for per-comparison data such as sort keys and are only formatted at the DETAIL level.
+
+The decisions may also be recorded to a compact binary event log of fixed-size records (event kind, flags, subject code and target code, the codes being the dense zone codes of the run) preceded by a header with the zone IDs, which readEvents() decodes back for replay or comparison of runs. Running the module as a script prints the events of a log.'''
+
+import sys, json, struct
+import common
+
+# text trace levels
+OFF = 0
+DECISIONS = 1
+DETAIL = 2
+
+# event kinds
+STAGE = 1
+PRESET = 2
+ZONE_ASSIGNED = 3
+ZONE_UNASSIGNED = 4
+REGION_AGGREGATED = 5
+NEIGHBOUR_ASSIGNED = 6
+NEIGHBOUR_UNASSIGNED = 7
+CANDIDATE = 8
+NOT_AGGREGABLE = 9
+CHANGE = 10
+ROLLBACK = 11
+MERGE = 12
+DESTROY = 13
+
+# event flags
+CORE = 1 # the assignment is a core one
+REGIONAL = 2 # the subject is a region
+
+# message templates of the kinds, formatted with the subject, target and flags
+TEMPLATES = {
+  STAGE : 'Stage {0}',
+  PRESET : 'Zone {0} preset: {1} ({2})',
+  ZONE_ASSIGNED : '{0}: {1}',
+  ZONE_UNASSIGNED : '{0} not assigned',
+  REGION_AGGREGATED : '{0}: {1}',
+  NEIGHBOUR_ASSIGNED : '{0} by neighbourhood: {1}',
+  NEIGHBOUR_UNASSIGNED : '{0} by neighbourhood not assigned',
+  CANDIDATE : '{0} aggregating',
+  NOT_AGGREGABLE : '{0} not aggregable',
+  CHANGE : 'Change {0} -> {1}',
+  ROLLBACK : 'Rollback change {0} -> {1}',
+  MERGE : 'Merging {0}: {1}',
+  DESTROY : 'Destroying {0}'}
+
+MAGIC = 'RGTRACE1'
+HEADER = struct.Struct('<I') # length of the JSON list of zone IDs
+RECORD = struct.Struct('<BBii') # kind, flags, subject code, target code (-1 for none)
+NO_CODE = -1
+
+level = OFF
+recorder = None
+active = False # checked by the callers before calling decision()
+detailed = False # checked by the callers before calling detail()
+
+
+def setLevel(newLevel):
+  '''Sets the text trace level (OFF, DECISIONS or DETAIL).'''
+  global level
+  level = newLevel
+  refresh()
+
+def refresh():
+  global active, detailed
+  active = level >= DECISIONS or recorder is not None
+  detailed = level >= DETAIL
+
+def record(path):
+  '''Starts recording the decisions to a binary event log at the given path.'''
+  global recorder
+  stop()
+  recorder = EventLog(path)
+  refresh()
+
+def stop():
+  '''Stops recording the decisions and closes the event log.'''
+  global recorder
+  if recorder is not None:
+    recorder.close()
+    recorder = None
+  refresh()
+
+def start(index):
+  '''Signals the start of a run on the zones interned in the loaders.IDIndex.'''
+  if recorder is not None:
+    recorder.start(index)
+
+def decision(kind, subject, target=None, flags=0):
+  if level >= DECISIONS:
+    common.message(u'TRACE: ' + formatEvent(kind, flags, subject, target))
+  if recorder is not None:
+    recorder.write(kind, subject, target, flags)
+
+def detail(template, *args):
+  if level >= DETAIL:
+    common.message(u'TRACE: ' + template.format(*args))
+
+
+class EventLog:
+  '''A binary log of decision events.'''
+
+  def __init__(self, path):
+    self.path = path
+    self.file = None
+    self.index = None
+    self.count = 0
+
+  def start(self, index):
+    if self.file is None:
+      self.file = open(self.path, 'wb')
+      header = json.dumps(index.ids)
+      self.file.write(MAGIC + HEADER.pack(len(header)) + header)
+    elif len(index) != len(self.index):
+      raise ValueError, 'event log {} already started for a different zone set'.format(self.path)
+    self.index = index
+
+  def code(self, object):
+    if object is None:
+      return NO_CODE
+    elif isinstance(object, (int, long)):
+      return object
+    else:
+      return self.index.get(object.getID(), NO_CODE)
+
+  def write(self, kind, subject, target, flags):
+    if self.file is not None:
+      self.file.write(RECORD.pack(kind, flags, self.code(subject), self.code(target)))
+      self.count += 1
+
+  def close(self):
+    if self.file is not None:
+      self.file.close()
+      self.file = None
+      common.message('Decision log with {} events written to {}'.format(self.count, self.path))
+
+
+def readEvents(path):
+  '''Yields the events of a binary event log as (kind, flags, subject ID, target ID) tuples; IDs are None where not given and the subject of a STAGE event is the stage number.'''
+  with open(path, 'rb') as file:
+    if file.read(len(MAGIC)) != MAGIC:
+      raise IOError, '{} is not a decision event log'.format(path)
+    length = HEADER.unpack(file.read(HEADER.size))[0]
+    ids = json.loads(file.read(length))
+    while True:
+      data = file.read(RECORD.size)
+      if len(data) < RECORD.size:
+        return
+      kind, flags, subject, target = RECORD.unpack(data)
+      if kind != STAGE:
+        subject = None if subject == NO_CODE else ids[subject]
+      yield kind, flags, subject, (None if target == NO_CODE else ids[target])
+
+def formatEvent(kind, flags, subject, target):
+  return TEMPLATES[kind].format(subject, target, ('core' if flags & CORE else 'hinterland'))
+
+
+if __name__ == '__main__':
+  for event in readEvents(sys.argv[1]):
+    print formatEvent(*event)